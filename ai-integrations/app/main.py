@@ -1,23 +1,46 @@
 # AI Integrations Service
 # Advanced healthcare-focused AI models for nutrition analysis and health predictions
 
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 import pandas as pd
 import numpy as np
 from sklearn.ensemble import RandomForestRegressor, GradientBoostingClassifier
 from sklearn.preprocessing import StandardScaler
 from sklearn.model_selection import train_test_split
 import joblib
+import hashlib
 import logging
-from datetime import datetime, timedelta
+from contextlib import AsyncExitStack
+from datetime import date, datetime, timedelta
 import os
 
 # Import service implementations
 from app.services.nutrition_analysis import NutritionAnalysisService
-from app.models.healthcare_models import BiomarkerPredictionModel, HealthRiskAssessmentModel
+from app.models.healthcare_models import BiomarkerPredictionModel, HealthRiskAssessmentModel, model_dtype
+from app.models.history import HistorySummary
+from app.models.percentiles import PercentileIndex
+from app.models.schema import BIOMARKER_FEATURES, BIOMARKERS, RISK_CATEGORIES, RISK_FEATURES, NutrientVector
+from app.services.response_cache import ResponseCache
+from app.services.cohort_analytics import COHORT_PERCENTILES, CohortAnalytics
+from app.services.daily_aggregation import DailyNutritionStore, DayNotRetained
+from app.services.feature_store import UserFeatures, UserFeatureStore
+from app.services.what_if import WhatIfSimulator
+from app.services.bulk_scoring import BulkScorer, NDJSONStreamingResponse
+from app.services.serialization import NegotiatedResponse, NegotiatedRoute
+from app.services.admission import (
+    AdmissionController, ServiceOverloaded, DEADLINE_PATH, DEGRADED_PATH, MODEL_PATH, RULE_BASED_PATH
+)
+from app.services.latency_budget import LatencyBudget, LatencyTracker, RequestClockMiddleware
+from app.services.inference_pool import create_inference_backend
+from app.services.health_rules import (
+    BIOMARKER_RECOMMENDATION_RULES, HEALTH_RISK_FACTOR_RULES, PREVENTION_RULES, MONITORING_RULES
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -26,9 +49,13 @@ logger = logging.getLogger(__name__)
 app = FastAPI(
     title="AI Integrations Service",
     description="Healthcare-focused AI models for nutrition analysis and health predictions",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=NegotiatedResponse
 )
 
+# Internal callers may exchange MessagePack instead of JSON on every endpoint
+app.router.route_class = NegotiatedRoute
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -38,12 +65,64 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Latency budgets are measured from arrival, before the body is parsed
+app.add_middleware(RequestClockMiddleware)
+
+@app.exception_handler(ServiceOverloaded)
+async def service_overloaded_handler(request: Request, exc: ServiceOverloaded):
+    """Shed load with 503 and a Retry-After hint"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after_seconds)}
+    )
+
 # Global variables for models
 nutrition_model = None
-biomarker_model = None
-health_risk_model = None
 scaler = StandardScaler()
 
+# Population percentile index written by the trainers next to the models
+POPULATION_PERCENTILES_PATH = os.getenv("POPULATION_PERCENTILES_PATH", "models/population_percentiles.npz")
+
+MODEL_FILES = [
+    "models/nutrition_model.pkl",
+    "models/biomarker_model.pkl",
+    "models/health_risk_model.pkl",
+    POPULATION_PERCENTILES_PATH
+]
+
+# Ranks intakes and biomarkers against the training cohort, once loaded
+population_percentiles: Optional[PercentileIndex] = None
+
+# Identifies the loaded model set; part of every response cache key
+model_version = "rule-based"
+
+# Cache for clients re-posting identical analysis requests
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2048")),
+    ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "300"))
+)
+
+# Bounds concurrent model inference; overflow is degraded to rule-based paths or rejected
+admission = AdmissionController(
+    max_concurrent=int(os.getenv("ADMISSION_MAX_CONCURRENT", "4")),
+    max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "32")),
+    queue_timeout_seconds=float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "0.5")),
+    max_degraded=int(os.getenv("ADMISSION_MAX_DEGRADED", "64")),
+    retry_after_seconds=int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "1"))
+)
+
+# Learned per-stage costs used to keep requests within their latency budgets
+latency_tracker = LatencyTracker(alpha=float(os.getenv("LATENCY_EWMA_ALPHA", "0.2")))
+
+def request_latency_budget(endpoint: str):
+    """Dependency building a request's LatencyBudget from its X-Latency-Budget-Ms header"""
+    def dependency(http_request: Request,
+                   x_latency_budget_ms: Optional[float] = Header(None, gt=0)) -> LatencyBudget:
+        budget_seconds = x_latency_budget_ms / 1000 if x_latency_budget_ms is not None else None
+        return latency_tracker.budget(endpoint, budget_seconds, getattr(http_request.state, "received_at", None))
+    return dependency
+
 class NutritionAnalysisRequest(BaseModel):
     age: int
     sex: str
@@ -60,37 +139,232 @@ class BiomarkerPredictionRequest(BaseModel):
     nutrition_data: Dict
     current_biomarkers: Dict
     time_horizon_days: int = 30
+    # Optional extra horizons, e.g. [30, 90, 180, 365], returned as a trajectory
+    time_horizons_days: Optional[List[int]] = None
+
+class NutrientPerturbation(BaseModel):
+    low: float
+    high: float
+    # Interpret low/high as fractions of the baseline intake instead of absolute amounts
+    relative: bool = False
+
+class WhatIfSimulationRequest(BaseModel):
+    user_profile: Dict
+    nutrition_data: Dict
+    current_biomarkers: Dict
+    perturbations: Dict[str, NutrientPerturbation]
+    n_scenarios: int = 1000
+    time_horizon_days: int = 30
+    seed: Optional[int] = None
 
 class HealthRiskAssessmentRequest(BaseModel):
     demographics: Dict
     nutrition_history: List[Dict]
     biomarker_history: List[Dict]
     family_history: List[str]
+    # Report rolling-window, exponentially weighted and trend statistics of the histories
+    include_history_trends: bool = False
+
+class MealLogRequest(BaseModel):
+    meal_id: str
+    meal: Dict
+    day: Optional[date] = None
+
+class MealUpdateRequest(BaseModel):
+    meal: Dict
+    day: Optional[date] = None
+
+class UserProfileRequest(BaseModel):
+    demographics: Dict
+    family_history: List[str] = []
+
+class BiomarkerReadingRequest(BaseModel):
+    biomarkers: Dict
+    day: Optional[date] = None
+
+class UserBiomarkerPredictionRequest(BaseModel):
+    time_horizon_days: int = 30
+    time_horizons_days: Optional[List[int]] = None
+
+class UserHealthRiskRequest(BaseModel):
+    include_history_trends: bool = False
+
+class PopulationPercentilesRequest(BaseModel):
+    nutrients: Dict[str, float] = {}
+    biomarkers: Dict[str, float] = {}
+
+class UserNutritionAnalysisRequest(BaseModel):
+    age: int
+    sex: str
+    weight: float
+    height: float
+    activity_level: str
+    health_goals: List[str]
+    medical_history: List[str]
+    biomarkers: Optional[Dict] = None
+    day: Optional[date] = None
+
+class UserFeaturesResponse(BaseModel):
+    user_id: str
+    nutrition_days: int
+    biomarker_readings: int
+    risk_features: Dict[str, float]
+    biomarker_features: Dict[str, float]
+    updated_at: datetime
+
+class DailyNutritionResponse(BaseModel):
+    user_id: str
+    day: str
+    # Meals held for the day; a day restored after eviction keeps only the totals of its earlier meals
+    meal_count: int
+    totals: Dict[str, float]
+
+class MacronutrientIntake(BaseModel):
+    grams: float
+    calories: float
+    percentage: float
+    quality: str
+
+class MacronutrientAnalysis(BaseModel):
+    total_calories: float
+    protein: MacronutrientIntake
+    carbs: MacronutrientIntake
+    fat: MacronutrientIntake
+    balance_score: float
+
+class MicronutrientStatus(BaseModel):
+    current_intake: float
+    recommended_intake: float
+    adequacy_percentage: float
+    status: str
+    priority: str
+
+class DeficiencyRisk(BaseModel):
+    nutrient: str
+    current_intake: float
+    recommended_intake: float
+    deficiency_percentage: float
+    risk_level: str
+    symptoms: List[str]
+    food_sources: List[str]
+    supplement_recommendation: str
+
+class NutritionRecommendation(BaseModel):
+    title: str
+    description: str
+    category: str
+    priority: str
+    actions: List[str]
+
+class AdditiveExplanation(BaseModel):
+    # base_value + sum(contributions) + adjustment == the explained value, on `scale`
+    scale: str
+    base_value: float
+    contributions: Dict[str, float]
+    adjustment: float
 
 class NutritionAnalysisResponse(BaseModel):
     molecular_balance_score: float
-    macronutrient_analysis: Dict
-    micronutrient_analysis: Dict
-    deficiency_risks: List[Dict]
-    recommendations: List[Dict]
+    macronutrient_analysis: MacronutrientAnalysis
+    micronutrient_analysis: Dict[str, MicronutrientStatus]
+    deficiency_risks: List[DeficiencyRisk]
+    recommendations: List[NutritionRecommendation]
     health_insights: List[str]
+    # Additive breakdown of molecular_balance_score by nutrient and health factor
+    score_explanation: Optional[AdditiveExplanation] = None
+    # Population percentiles of the day's intake ("nutrients") and the given "biomarkers",
+    # when a percentile index is loaded
+    population_percentiles: Optional[Dict[str, Dict[str, float]]] = None
+
+class ConfidenceInterval(BaseModel):
+    lower: float
+    upper: float
+
+class BiomarkerTrajectoryPoint(BaseModel):
+    time_horizon_days: int
+    predicted_values: Dict[str, float]
+    confidence_intervals: Optional[Dict[str, ConfidenceInterval]] = None
 
 class BiomarkerPredictionResponse(BaseModel):
-    predicted_values: Dict
-    confidence_scores: Dict
+    predicted_values: Dict[str, float]
+    confidence_scores: Dict[str, float]
     risk_factors: List[str]
     recommendations: List[str]
+    # Per-biomarker bounds from the spread of forest trees (trained models only)
+    confidence_intervals: Optional[Dict[str, ConfidenceInterval]] = None
+    trajectory: Optional[List[BiomarkerTrajectoryPoint]] = None
+    # "model", "rule_based" (no trained models), "degraded" (rule-based fallback under load)
+    # or "deadline" (rule-based fallback to meet the request's latency budget)
+    inference_path: str = MODEL_PATH
+
+class OutcomeDistribution(BaseModel):
+    baseline: float
+    mean: float
+    std: float
+    mean_change: float
+    percentiles: Dict[str, float]
+
+class RiskOutcomeDistribution(OutcomeDistribution):
+    # Share of scenarios above each risk level
+    probability_above: Dict[str, float]
+
+class WhatIfSimulationResponse(BaseModel):
+    n_scenarios: int
+    time_horizon_days: int
+    intake: Dict[str, OutcomeDistribution]
+    biomarkers: Dict[str, OutcomeDistribution]
+    risk_scores: Dict[str, RiskOutcomeDistribution]
+
+class HistoryTrend(BaseModel):
+    # Statistics over the entries that carry this value, oldest first
+    entries: int
+    mean: float
+    rolling_mean: Optional[float] = None
+    ewma: Optional[float] = None
+    slope_per_entry: Optional[float] = None
+
+class HistoryTrends(BaseModel):
+    nutrition: Dict[str, HistoryTrend]
+    biomarkers: Dict[str, HistoryTrend]
+
+class PopulationPercentilesResponse(BaseModel):
+    # Share of the reference cohort (0-100) below each value the index covers
+    nutrients: Dict[str, float]
+    biomarkers: Dict[str, float]
+    cohort_size: int
+
+class CohortMetricSummary(BaseModel):
+    count: int
+    mean: float
+    min: float
+    max: float
+    # Value at each requested percentile, e.g. "p95", within the sketch's relative accuracy
+    percentiles: Dict[str, float]
+
+class CohortAnalyticsResponse(BaseModel):
+    # Running workers whose sketches were merged (those that wrote within the max age)
+    workers: int
+    # Group ("nutrition", "predicted_biomarkers", "risk_scores") -> metric -> summary
+    metrics: Dict[str, Dict[str, CohortMetricSummary]]
 
 class HealthRiskResponse(BaseModel):
-    risk_scores: Dict
+    risk_scores: Dict[str, float]
     risk_factors: List[str]
     prevention_recommendations: List[str]
-    monitoring_schedule: Dict
+    monitoring_schedule: Dict[str, str]
+    # Per-category additive feature contributions to risk_scores
+    risk_explanations: Optional[Dict[str, AdditiveExplanation]] = None
+    # Recent (rolling window), exponentially weighted and trend statistics of the histories,
+    # when requested with include_history_trends
+    history_trends: Optional[HistoryTrends] = None
+    # "model", "rule_based" (no trained models), "degraded" (rule-based fallback under load)
+    # or "deadline" (rule-based fallback to meet the request's latency budget)
+    inference_path: str = MODEL_PATH
 
 @app.on_event("startup")
 async def load_models():
     """Load pre-trained models on startup"""
-    global nutrition_model, biomarker_model, health_risk_model
+    global nutrition_model, population_percentiles, model_version
     
     try:
         # Load models (will be created during training)
@@ -99,15 +373,61 @@ async def load_models():
             logger.info("Nutrition model loaded successfully")
         
         if os.path.exists("models/biomarker_model.pkl"):
-            biomarker_model = joblib.load("models/biomarker_model.pkl")
+            biomarker_model.load_model("models/biomarker_model.pkl")
             logger.info("Biomarker model loaded successfully")
             
         if os.path.exists("models/health_risk_model.pkl"):
-            health_risk_model = joblib.load("models/health_risk_model.pkl")
+            risk_model.load_model("models/health_risk_model.pkl")
             logger.info("Health risk model loaded successfully")
             
     except Exception as e:
         logger.error(f"Error loading models: {e}")
+    
+    try:
+        population_percentiles = None
+        if os.path.exists(POPULATION_PERCENTILES_PATH):
+            population_percentiles = PercentileIndex.load(POPULATION_PERCENTILES_PATH)
+            logger.info("Population percentile index loaded successfully")
+    except Exception as e:
+        logger.error(f"Error loading population percentile index: {e}")
+    
+    # Worker processes hold their own copies of the models
+    await run_in_threadpool(inference_backend.reload)
+    
+    # Responses computed with the previous models are no longer valid
+    model_version = compute_model_version()
+    response_cache.invalidate(reason=f"model version {model_version}")
+
+@app.on_event("startup")
+async def open_stores():
+    """Open the SQLite-backed stores (creating their files if needed)"""
+    global feature_store, cohort_analytics
+    feature_store = UserFeatureStore(biomarker_model, risk_model, FEATURE_STORE_PATH)
+    cohort_analytics = CohortAnalytics(
+        COHORT_METRICS,
+        COHORT_ANALYTICS_PATH,
+        flush_seconds=float(os.getenv("COHORT_ANALYTICS_FLUSH_SECONDS", "10")),
+        max_age_seconds=float(os.getenv("COHORT_ANALYTICS_MAX_AGE_SECONDS", "3600"))
+    )
+
+@app.on_event("shutdown")
+async def stop_inference_workers():
+    """Stop inference worker processes and free their shared memory"""
+    inference_backend.close()
+    if feature_store is not None:
+        feature_store.close()
+    if cohort_analytics is not None:
+        cohort_analytics.close()
+
+def compute_model_version() -> str:
+    """Fingerprint the model files on disk (path, size and mtime)"""
+    stats = [
+        f"{path}:{os.path.getsize(path)}:{os.path.getmtime(path)}"
+        for path in MODEL_FILES if os.path.exists(path)
+    ]
+    if not stats:
+        return "rule-based"
+    return hashlib.sha1("|".join(stats).encode()).hexdigest()[:12]
 
 @app.get("/health")
 async def health_check():
@@ -117,116 +437,177 @@ async def health_check():
         "timestamp": datetime.now().isoformat(),
         "models_loaded": {
             "nutrition": nutrition_model is not None,
-            "biomarker": biomarker_model is not None,
-            "health_risk": health_risk_model is not None
-        }
+            "biomarker": bool(biomarker_model.biomarker_models),
+            "health_risk": bool(risk_model.risk_models)
+        },
+        "model_version": model_version
     }
 
+@app.get("/metrics")
+async def metrics():
+    """Service metrics"""
+    return {
+        "model_version": model_version,
+        "response_cache": response_cache.stats(),
+        "daily_nutrition_store": daily_nutrition_store.stats(),
+        "feature_store": feature_store.stats(),
+        "cohort_analytics": cohort_analytics.stats(),
+        "admission": admission.stats(),
+        "latency": latency_tracker.stats(),
+        "inference_backend": inference_backend.stats(),
+        "population_percentiles": population_percentiles.stats() if population_percentiles is not None else None
+    }
+
+@app.post("/reload-models")
+async def reload_models():
+    """Reload models from disk and invalidate cached responses"""
+    await load_models()
+    return {"message": "Models reloaded", "model_version": model_version}
+
 @app.post("/analyze-nutrition", response_model=NutritionAnalysisResponse)
 async def analyze_nutrition(request: NutritionAnalysisRequest):
     """
     Advanced nutrition analysis with healthcare insights
     """
+    cache_key = response_cache.make_key("analyze-nutrition", request.model_dump(), model_version)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        await record_cohort_metrics(cached)
+        return NegotiatedResponse(cached)
+    
     try:
-        # Calculate molecular balance score
-        molecular_score = calculate_molecular_balance_score(request)
-        
-        # Analyze macronutrients
-        macro_analysis = analyze_macronutrients(request.meals)
-        
-        # Analyze micronutrients
-        micro_analysis = analyze_micronutrients(request.meals)
-        
-        # Identify deficiency risks
-        deficiency_risks = identify_deficiency_risks(request)
-        
-        # Generate recommendations
-        recommendations = generate_nutrition_recommendations(request, molecular_score)
-        
-        # Generate health insights
-        health_insights = generate_health_insights(request, molecular_score)
-        
-        return NutritionAnalysisResponse(
-            molecular_balance_score=molecular_score,
-            macronutrient_analysis=macro_analysis,
-            micronutrient_analysis=micro_analysis,
-            deficiency_risks=deficiency_risks,
-            recommendations=recommendations,
-            health_insights=health_insights
-        )
-        
+        response = run_nutrition_analysis(request)
+        response_cache.set(cache_key, response)
     except Exception as e:
         logger.error(f"Nutrition analysis error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    await record_cohort_metrics(response)
+    return NegotiatedResponse(response)
 
 @app.post("/predict-biomarkers", response_model=BiomarkerPredictionResponse)
-async def predict_biomarkers(request: BiomarkerPredictionRequest):
+async def predict_biomarkers(request: BiomarkerPredictionRequest,
+                             budget: LatencyBudget = Depends(request_latency_budget("predict-biomarkers"))):
     """
     Predict future biomarker values based on nutrition and lifestyle
+    
+    Callers needing an answer within a deadline send X-Latency-Budget-Ms;
+    when the models are not expected to finish in time, the rule-based
+    predictor answers instead (inference_path "deadline").
     """
-    try:
-        # Prepare features for prediction
-        features = prepare_biomarker_features(request)
-        
-        # Make predictions
-        predicted_values = {}
-        confidence_scores = {}
-        
-        if biomarker_model:
-            # Use trained model
-            predictions = biomarker_model.predict([features])
-            predicted_values = format_biomarker_predictions(predictions[0])
-            confidence_scores = calculate_confidence_scores(features)
-        else:
-            # Use rule-based predictions
-            predicted_values = rule_based_biomarker_prediction(request)
-            confidence_scores = {"overall": 0.7}
-        
-        # Identify risk factors
-        risk_factors = identify_biomarker_risk_factors(request, predicted_values)
-        
-        # Generate recommendations
-        recommendations = generate_biomarker_recommendations(request, predicted_values)
-        
-        return BiomarkerPredictionResponse(
-            predicted_values=predicted_values,
-            confidence_scores=confidence_scores,
-            risk_factors=risk_factors,
-            recommendations=recommendations
-        )
-        
-    except Exception as e:
-        logger.error(f"Biomarker prediction error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    cache_key = response_cache.make_key("predict-biomarkers", request.model_dump(), model_version)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        await record_cohort_metrics(cached)
+        return NegotiatedResponse(cached)
+    
+    async with admission.admit("predict-biomarkers", budget=budget) as admitted_path:
+        try:
+            # Inference runs off the event loop so admission keeps working under load
+            response = await run_in_threadpool(
+                run_biomarker_prediction, request, degraded=admitted_path == DEGRADED_PATH, budget=budget)
+        except Exception as e:
+            logger.error(f"Biomarker prediction error: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+    
+    # Fallback responses are not cached, so full inference resumes once load drops
+    if response.inference_path in (MODEL_PATH, RULE_BASED_PATH):
+        response_cache.set(cache_key, response)
+    await record_cohort_metrics(response)
+    return NegotiatedResponse(response, headers={"Server-Timing": budget.server_timing()})
 
 @app.post("/assess-health-risk", response_model=HealthRiskResponse)
-async def assess_health_risk(request: HealthRiskAssessmentRequest):
+async def assess_health_risk(request: HealthRiskAssessmentRequest,
+                             budget: LatencyBudget = Depends(request_latency_budget("assess-health-risk"))):
     """
     Comprehensive health risk assessment
+    
+    Honors X-Latency-Budget-Ms like /predict-biomarkers.
     """
-    try:
-        # Calculate risk scores for various conditions
-        risk_scores = calculate_health_risk_scores(request)
-        
-        # Identify risk factors
-        risk_factors = identify_health_risk_factors(request)
-        
-        # Generate prevention recommendations
-        prevention_recommendations = generate_prevention_recommendations(request, risk_scores)
-        
-        # Create monitoring schedule
-        monitoring_schedule = create_monitoring_schedule(request, risk_scores)
-        
-        return HealthRiskResponse(
-            risk_scores=risk_scores,
-            risk_factors=risk_factors,
-            prevention_recommendations=prevention_recommendations,
-            monitoring_schedule=monitoring_schedule
-        )
-        
-    except Exception as e:
-        logger.error(f"Health risk assessment error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    cache_key = response_cache.make_key("assess-health-risk", request.model_dump(), model_version)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        await record_cohort_metrics(cached)
+        return NegotiatedResponse(cached)
+    
+    async with admission.admit("assess-health-risk", budget=budget) as admitted_path:
+        try:
+            response = await run_in_threadpool(
+                run_health_risk_assessment, request, degraded=admitted_path == DEGRADED_PATH, budget=budget)
+        except Exception as e:
+            logger.error(f"Health risk assessment error: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+    
+    if response.inference_path in (MODEL_PATH, RULE_BASED_PATH):
+        response_cache.set(cache_key, response)
+    await record_cohort_metrics(response)
+    return NegotiatedResponse(response, headers={"Server-Timing": budget.server_timing()})
+
+@app.post("/population-percentiles", response_model=PopulationPercentilesResponse)
+async def rank_against_population(request: PopulationPercentilesRequest):
+    """
+    Percentiles of intakes and biomarker values within the training cohort
+    """
+    if population_percentiles is None:
+        raise HTTPException(status_code=503, detail="No population percentile index loaded")
+    percentiles = population_percentiles.lookup({'nutrients': request.nutrients, 'biomarkers': request.biomarkers})
+    return NegotiatedResponse(PopulationPercentilesResponse(
+        **percentiles, cohort_size=population_percentiles.cohort_size))
+
+@app.get("/cohort-analytics", response_model=CohortAnalyticsResponse)
+async def get_cohort_analytics(percentiles: List[float] = Query(list(COHORT_PERCENTILES))):
+    """
+    Distributions of the balance scores, biomarker predictions and risk scores served by the running workers
+    
+    Percentiles come from mergeable sketches every worker updates as it
+    answers and periodically writes to the shared analytics file. They
+    are live, not all-time: each worker contributes what it served since
+    it started, until it shuts down or has written nothing for
+    COHORT_ANALYTICS_MAX_AGE_SECONDS.
+    """
+    if any(not 0 <= percentile <= 100 for percentile in percentiles):
+        raise HTTPException(status_code=400, detail="percentiles must be between 0 and 100")
+    summary = await run_in_threadpool(cohort_analytics.summary, percentiles)
+    return NegotiatedResponse(CohortAnalyticsResponse(**summary))
+
+@app.post("/simulate-what-if", response_model=WhatIfSimulationResponse)
+async def simulate_what_if(request: WhatIfSimulationRequest):
+    """
+    Monte Carlo simulation of biomarker and risk outcomes under intake changes
+    """
+    # No rule-based fallback for simulations: under overload they are rejected
+    async with admission.admit("simulate-what-if", degradable=False):
+        try:
+            result = await run_in_threadpool(
+                what_if_simulator.simulate,
+                request.user_profile,
+                request.nutrition_data,
+                request.current_biomarkers,
+                {nutrient: perturbation.model_dump() for nutrient, perturbation in request.perturbations.items()},
+                n_scenarios=request.n_scenarios,
+                time_horizon_days=request.time_horizon_days,
+                seed=request.seed
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            logger.error(f"What-if simulation error: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+    return NegotiatedResponse(WhatIfSimulationResponse(**result))
+
+@app.post("/score-stream")
+async def score_stream(request: Request, time_horizon_days: int = 30):
+    """
+    Bulk scoring of NDJSON user-day records, streamed back as NDJSON
+    
+    Each request line is {"id", "user_profile", "nutrition_data", "current_biomarkers"};
+    each response line carries the record's line number and id with either its
+    scores or an error. Under overload the stream is rejected with 503 before
+    it starts; once admitted it holds its inference slot until it ends.
+    """
+    slot = AsyncExitStack()
+    await slot.enter_async_context(admission.admit("score-stream", degradable=False))
+    return NDJSONStreamingResponse(bulk_scorer.score_stream(request.stream(), time_horizon_days),
+                                   background=BackgroundTask(slot.aclose))
 
 @app.post("/train-models")
 async def train_models():
@@ -246,21 +627,310 @@ async def train_models():
         # Train health risk model
         train_health_risk_model(training_data)
         
+        # Pick up the new models and drop responses from the old ones
+        await load_models()
+        
         return {"message": "Models trained successfully", "timestamp": datetime.now().isoformat()}
         
     except Exception as e:
         logger.error(f"Model training error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/users/{user_id}/meals", response_model=DailyNutritionResponse)
+async def log_meal(user_id: str, request: MealLogRequest):
+    """Add a meal to the user's running daily totals"""
+    try:
+        totals = await run_in_threadpool(
+            daily_nutrition_store.add_meal, user_id, request.meal_id, request.meal, request.day)
+    except DayNotRetained as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return NegotiatedResponse(daily_nutrition_response(user_id, request.day, totals))
+
+@app.put("/users/{user_id}/meals/{meal_id}", response_model=DailyNutritionResponse)
+async def update_meal(user_id: str, meal_id: str, request: MealUpdateRequest):
+    """Replace a logged meal in the user's running daily totals"""
+    try:
+        totals = await run_in_threadpool(
+            daily_nutrition_store.update_meal, user_id, meal_id, request.meal, request.day)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    return NegotiatedResponse(daily_nutrition_response(user_id, request.day, totals))
+
+@app.delete("/users/{user_id}/meals/{meal_id}", response_model=DailyNutritionResponse)
+async def remove_meal(user_id: str, meal_id: str, day: Optional[date] = None):
+    """Remove a logged meal from the user's running daily totals"""
+    try:
+        totals = await run_in_threadpool(daily_nutrition_store.remove_meal, user_id, meal_id, day)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    return NegotiatedResponse(daily_nutrition_response(user_id, day, totals))
+
+@app.get("/users/{user_id}/daily-nutrition", response_model=DailyNutritionResponse)
+async def get_daily_nutrition(user_id: str, day: Optional[date] = None):
+    """Current running daily totals for a user"""
+    totals = await run_in_threadpool(daily_nutrition_store.get_totals, user_id, day)
+    if totals is None:
+        raise HTTPException(status_code=404, detail=f"No meals logged for {daily_nutrition_store.day_key(day)}")
+    return NegotiatedResponse(daily_nutrition_response(user_id, day, totals))
+
+@app.post("/users/{user_id}/daily-nutrition/recompute")
+async def recompute_daily_nutrition(user_id: str, day: Optional[date] = None):
+    """Re-sum a user's day from the stored meals and report any drift in the running totals"""
+    try:
+        result = await run_in_threadpool(daily_nutrition_store.recompute, user_id, day)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    result['totals'] = result['totals'].to_dict()
+    return {"user_id": user_id, "day": daily_nutrition_store.day_key(day), **result}
+
+@app.post("/users/{user_id}/analyze-nutrition", response_model=NutritionAnalysisResponse)
+async def analyze_user_nutrition(user_id: str, request: UserNutritionAnalysisRequest):
+    """
+    Nutrition analysis from the user's maintained daily totals
+    """
+    daily_nutrition = await run_in_threadpool(daily_nutrition_store.get_totals, user_id, request.day)
+    if daily_nutrition is None:
+        raise HTTPException(status_code=404, detail=f"No meals logged for {daily_nutrition_store.day_key(request.day)}")
+    
+    try:
+        analysis_request = NutritionAnalysisRequest(
+            meals=[],
+            **request.model_dump(exclude={'day'})
+        )
+        response = run_nutrition_analysis(analysis_request, daily_nutrition)
+    except Exception as e:
+        logger.error(f"Nutrition analysis error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    await record_cohort_metrics(response)
+    return NegotiatedResponse(response)
+
+@app.put("/users/{user_id}/profile", response_model=UserFeaturesResponse)
+async def set_user_profile(user_id: str, request: UserProfileRequest):
+    """Store the user's demographics and family history for the feature store"""
+    features = await run_in_threadpool(
+        feature_store.set_profile, user_id, request.demographics, request.family_history)
+    return NegotiatedResponse(user_features_response(features))
+
+@app.post("/users/{user_id}/biomarkers", response_model=UserFeaturesResponse)
+async def add_biomarker_reading(user_id: str, request: BiomarkerReadingRequest):
+    """Record a biomarker reading and update the user's stored features"""
+    try:
+        features = await run_in_threadpool(
+            feature_store.add_biomarker_reading, user_id, request.biomarkers, request.day)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    return NegotiatedResponse(user_features_response(features))
+
+@app.get("/users/{user_id}/features", response_model=UserFeaturesResponse)
+async def get_user_features(user_id: str):
+    """The user's stored model feature vectors"""
+    return NegotiatedResponse(user_features_response(await load_user_features(user_id)))
+
+@app.delete("/users/{user_id}/features")
+async def delete_user_features(user_id: str):
+    """Forget the user's profile, stored history and features"""
+    if not await run_in_threadpool(feature_store.delete_user, user_id):
+        raise HTTPException(status_code=404, detail=f"No profile stored for user {user_id}")
+    return {"user_id": user_id, "deleted": True}
+
+@app.post("/users/{user_id}/predict-biomarkers", response_model=BiomarkerPredictionResponse)
+async def predict_user_biomarkers(user_id: str, request: UserBiomarkerPredictionRequest,
+                                  budget: LatencyBudget = Depends(request_latency_budget("predict-biomarkers"))):
+    """
+    Biomarker predictions from the user's stored feature vector
+    
+    Uses the latest logged day and biomarker readings; responses are not
+    cached, since the stored features change with every update.
+    """
+    features = await load_user_features(user_id)
+    prediction_request = BiomarkerPredictionRequest(
+        user_profile=features.demographics,
+        nutrition_data=features.latest_nutrition().to_dict(),
+        current_biomarkers=features.current_biomarkers().to_dict(),
+        **request.model_dump()
+    )
+    
+    async with admission.admit("predict-biomarkers", budget=budget) as admitted_path:
+        try:
+            response = await run_in_threadpool(
+                run_biomarker_prediction, prediction_request, degraded=admitted_path == DEGRADED_PATH,
+                budget=budget, features=features.biomarker_features)
+        except Exception as e:
+            logger.error(f"Biomarker prediction error: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+    await record_cohort_metrics(response)
+    return NegotiatedResponse(response, headers={"Server-Timing": budget.server_timing()})
+
+@app.post("/users/{user_id}/assess-health-risk", response_model=HealthRiskResponse)
+async def assess_user_health_risk(user_id: str, request: UserHealthRiskRequest,
+                                  budget: LatencyBudget = Depends(request_latency_budget("assess-health-risk"))):
+    """
+    Health risk assessment from the user's stored feature vector and running histories
+    """
+    features = await load_user_features(user_id)
+    assessment_request = HealthRiskAssessmentRequest(
+        demographics=features.demographics,
+        nutrition_history=[],
+        biomarker_history=[],
+        family_history=features.family_history,
+        **request.model_dump()
+    )
+    
+    async with admission.admit("assess-health-risk", budget=budget) as admitted_path:
+        try:
+            response = await run_in_threadpool(
+                run_health_risk_assessment, assessment_request, degraded=admitted_path == DEGRADED_PATH,
+                budget=budget, history=(features.nutrition, features.biomarkers), features=features.risk_features)
+        except Exception as e:
+            logger.error(f"Health risk assessment error: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+    await record_cohort_metrics(response)
+    return NegotiatedResponse(response, headers={"Server-Timing": budget.server_timing()})
+
 # Initialize services
 nutrition_service = NutritionAnalysisService()
 biomarker_model = BiomarkerPredictionModel()
 risk_model = HealthRiskAssessmentModel()
 
+# Feature and scaling precision of model inference ("float64" or "float32")
+biomarker_model.dtype = risk_model.dtype = model_dtype(os.getenv("MODEL_PRECISION", "float64"))
+
+# Running daily totals for clients that log one meal at a time; every change is
+# persisted to the feature store, and evicted days are restored from it
+daily_nutrition_store = DailyNutritionStore(
+    nutrition_service,
+    max_users=int(os.getenv("DAILY_NUTRITION_MAX_USERS", "10000")),
+    idle_ttl_seconds=float(os.getenv("DAILY_NUTRITION_IDLE_TTL_SECONDS", str(6 * 3600))),
+    restore=lambda user_id, day: feature_store.nutrition_day(user_id, day),
+    persist=lambda user_id, day, totals: feature_store.record_nutrition_day(user_id, day, totals)
+)
+
+# Derived per-user model features, updated as meals and biomarker readings arrive;
+# opened at startup, so importing the app creates no files
+FEATURE_STORE_PATH = os.getenv("FEATURE_STORE_PATH", "data/feature_store.sqlite3")
+feature_store: Optional[UserFeatureStore] = None
+
+# Live distributions of what the endpoints serve, merged across workers through one
+# SQLite file (opened at startup)
+COHORT_ANALYTICS_PATH = os.getenv("COHORT_ANALYTICS_PATH", "data/cohort_analytics.sqlite3")
+COHORT_METRICS = {
+    'nutrition': ('molecular_balance_score',),
+    'predicted_biomarkers': BIOMARKERS,
+    'risk_scores': RISK_CATEGORIES
+}
+cohort_analytics: Optional[CohortAnalytics] = None
+
+# Model inference (predictions, risk assessments, what-if and bulk scoring): in-process threads, or worker processes
+inference_backend = create_inference_backend(
+    os.getenv("INFERENCE_BACKEND", "thread"),
+    biomarker_model,
+    risk_model,
+    "models/biomarker_model.pkl",
+    "models/health_risk_model.pkl",
+    workers=int(os.getenv("INFERENCE_WORKERS", "0")) or None
+)
+
+# Batched Monte Carlo what-if scenarios over the biomarker and risk models
+what_if_simulator = WhatIfSimulator(
+    biomarker_model,
+    risk_model,
+    max_scenarios=int(os.getenv("WHAT_IF_MAX_SCENARIOS", "50000")),
+    inference=inference_backend
+)
+bulk_scorer = BulkScorer(
+    nutrition_service,
+    biomarker_model,
+    risk_model,
+    batch_size=int(os.getenv("BULK_SCORING_BATCH_SIZE", "256")),
+    inference=inference_backend
+)
+
 # Helper functions using imported services
-def calculate_molecular_balance_score(request: NutritionAnalysisRequest) -> float:
-    """Calculate molecular balance score based on nutrition and health factors"""
-    user_profile = {
+def run_nutrition_analysis(request: NutritionAnalysisRequest,
+                           daily_nutrition: Optional[NutrientVector] = None) -> NutritionAnalysisResponse:
+    """Run the full nutrition analysis, summing the day's meals only once"""
+    if daily_nutrition is None:
+        daily_nutrition = nutrition_service._calculate_daily_nutrition(request.meals)
+    
+    # Calculate molecular balance score and what drove it
+    molecular_score, score_explanation = explain_molecular_balance_score(request, daily_nutrition)
+    
+    # Analyze macronutrients
+    macro_analysis = analyze_macronutrients(request.meals, daily_nutrition)
+    
+    # Analyze micronutrients
+    micro_analysis = analyze_micronutrients(request.meals, daily_nutrition)
+    
+    # Identify deficiency risks
+    deficiency_risks = identify_deficiency_risks(request, daily_nutrition)
+    
+    # Generate recommendations
+    recommendations = generate_nutrition_recommendations(request, molecular_score, daily_nutrition)
+    
+    # Generate health insights
+    health_insights = generate_health_insights(request, molecular_score, daily_nutrition)
+    
+    # Where the day's intake and the biomarkers stand in the population
+    percentiles = None
+    if population_percentiles is not None:
+        percentiles = population_percentiles.lookup(
+            {'nutrients': daily_nutrition.to_dict(), 'biomarkers': request.biomarkers or {}})
+    
+    return NutritionAnalysisResponse(
+        molecular_balance_score=molecular_score,
+        macronutrient_analysis=macro_analysis,
+        micronutrient_analysis=micro_analysis,
+        deficiency_risks=deficiency_risks,
+        recommendations=recommendations,
+        health_insights=health_insights,
+        score_explanation=score_explanation,
+        population_percentiles=percentiles
+    )
+
+def daily_nutrition_response(user_id: str, day: Optional[date], totals: NutrientVector) -> DailyNutritionResponse:
+    """Build the response for a user's running daily totals"""
+    return DailyNutritionResponse(
+        user_id=user_id,
+        day=daily_nutrition_store.day_key(day),
+        meal_count=daily_nutrition_store.meal_count(user_id, day),
+        totals=totals.to_dict()
+    )
+
+async def record_cohort_metrics(response: BaseModel):
+    """Add a served response's score, predictions or risk scores to the cohort sketches"""
+    if isinstance(response, NutritionAnalysisResponse):
+        due = cohort_analytics.record('nutrition', {'molecular_balance_score': response.molecular_balance_score})
+    elif isinstance(response, BiomarkerPredictionResponse):
+        due = cohort_analytics.record('predicted_biomarkers', response.predicted_values)
+    elif isinstance(response, HealthRiskResponse):
+        due = cohort_analytics.record('risk_scores', response.risk_scores)
+    else:
+        return
+    if due:
+        await run_in_threadpool(cohort_analytics.flush)
+
+async def load_user_features(user_id: str) -> UserFeatures:
+    """A user's stored features, 404 for users without a profile"""
+    features = await run_in_threadpool(feature_store.get, user_id)
+    if features is None:
+        raise HTTPException(status_code=404, detail=f"No profile stored for user {user_id}")
+    return features
+
+def user_features_response(features: UserFeatures) -> UserFeaturesResponse:
+    return UserFeaturesResponse(
+        user_id=features.user_id,
+        nutrition_days=features.nutrition.count,
+        biomarker_readings=features.biomarkers.count,
+        risk_features=dict(zip(RISK_FEATURES, features.risk_features.tolist())),
+        biomarker_features=dict(zip(BIOMARKER_FEATURES, features.biomarker_features.tolist())),
+        updated_at=datetime.fromtimestamp(features.updated_at)
+    )
+
+def build_user_profile(request: NutritionAnalysisRequest) -> Dict:
+    """User profile dict expected by the nutrition analysis service"""
+    return {
         'age': request.age,
         'sex': request.sex,
         'weight': request.weight,
@@ -269,54 +939,110 @@ def calculate_molecular_balance_score(request: NutritionAnalysisRequest) -> floa
         'health_goals': request.health_goals,
         'medical_history': request.medical_history
     }
-    return nutrition_service.calculate_molecular_balance_score(user_profile, request.meals)
 
-def analyze_macronutrients(meals: List[Dict]) -> Dict:
+def calculate_molecular_balance_score(request: NutritionAnalysisRequest,
+                                      daily_nutrition: Optional[NutrientVector] = None) -> float:
+    """Calculate molecular balance score based on nutrition and health factors"""
+    user_profile = build_user_profile(request)
+    return nutrition_service.calculate_molecular_balance_score(user_profile, request.meals, daily_nutrition)
+
+def explain_molecular_balance_score(request: NutritionAnalysisRequest,
+                                    daily_nutrition: Optional[NutrientVector] = None) -> Tuple[float, Optional[Dict]]:
+    """Molecular balance score with its additive breakdown by driver"""
+    user_profile = build_user_profile(request)
+    return nutrition_service.explain_molecular_balance_score(user_profile, request.meals, daily_nutrition)
+
+def analyze_macronutrients(meals: List[Dict], daily_nutrition: Optional[NutrientVector] = None) -> Dict:
     """Analyze macronutrient distribution and quality"""
-    return nutrition_service.analyze_macronutrients(meals)
+    return nutrition_service.analyze_macronutrients(meals, daily_nutrition)
 
-def analyze_micronutrients(meals: List[Dict]) -> Dict:
+def analyze_micronutrients(meals: List[Dict], daily_nutrition: Optional[NutrientVector] = None) -> Dict:
     """Analyze micronutrient intake and bioavailability"""
-    return nutrition_service.analyze_micronutrients(meals)
+    return nutrition_service.analyze_micronutrients(meals, daily_nutrition)
 
-def identify_deficiency_risks(request: NutritionAnalysisRequest) -> List[Dict]:
+def identify_deficiency_risks(request: NutritionAnalysisRequest,
+                              daily_nutrition: Optional[NutrientVector] = None) -> List[Dict]:
     """Identify potential nutrient deficiencies"""
-    user_profile = {
-        'age': request.age,
-        'sex': request.sex,
-        'weight': request.weight,
-        'height': request.height,
-        'activity_level': request.activity_level,
-        'health_goals': request.health_goals,
-        'medical_history': request.medical_history
-    }
-    return nutrition_service.identify_deficiency_risks(user_profile, request.meals)
+    user_profile = build_user_profile(request)
+    return nutrition_service.identify_deficiency_risks(user_profile, request.meals, daily_nutrition)
 
-def generate_nutrition_recommendations(request: NutritionAnalysisRequest, score: float) -> List[Dict]:
+def generate_nutrition_recommendations(request: NutritionAnalysisRequest, score: float,
+                                       daily_nutrition: Optional[NutrientVector] = None) -> List[Dict]:
     """Generate personalized nutrition recommendations"""
-    user_profile = {
-        'age': request.age,
-        'sex': request.sex,
-        'weight': request.weight,
-        'height': request.height,
-        'activity_level': request.activity_level,
-        'health_goals': request.health_goals,
-        'medical_history': request.medical_history
-    }
-    return nutrition_service.generate_nutrition_recommendations(user_profile, request.meals, score)
+    user_profile = build_user_profile(request)
+    return nutrition_service.generate_nutrition_recommendations(user_profile, request.meals, score, daily_nutrition)
 
-def generate_health_insights(request: NutritionAnalysisRequest, score: float) -> List[str]:
+def generate_health_insights(request: NutritionAnalysisRequest, score: float,
+                             daily_nutrition: Optional[NutrientVector] = None) -> List[str]:
     """Generate health insights based on nutrition analysis"""
-    user_profile = {
-        'age': request.age,
-        'sex': request.sex,
-        'weight': request.weight,
-        'height': request.height,
-        'activity_level': request.activity_level,
-        'health_goals': request.health_goals,
-        'medical_history': request.medical_history
-    }
-    return nutrition_service.generate_health_insights(user_profile, request.meals, score)
+    user_profile = build_user_profile(request)
+    return nutrition_service.generate_health_insights(user_profile, request.meals, score, daily_nutrition)
+
+def run_biomarker_prediction(request: BiomarkerPredictionRequest, degraded: bool = False,
+                             budget: Optional[LatencyBudget] = None,
+                             features: Optional[np.ndarray] = None) -> BiomarkerPredictionResponse:
+    """Biomarker predictions, timed stage by stage against the request's latency budget
+    
+    `degraded` serves the rule-based fallback even with trained models, as
+    does a budget too short for the models' expected inference time.
+    `features` is an already prepared row (e.g. from the feature store).
+    """
+    budget = budget or latency_tracker.budget("predict-biomarkers")
+    
+    # Prepare features for prediction
+    if features is None:
+        with budget.stage("features"):
+            features = prepare_biomarker_features(request)
+    
+    # Make predictions for the requested horizon and any trajectory horizons in one pass
+    horizons = [request.time_horizon_days] + list(request.time_horizons_days or [])
+    inference_path = choose_inference_path(bool(biomarker_model.biomarker_models), degraded, budget)
+    
+    if inference_path == MODEL_PATH:
+        # Use trained models
+        with budget.stage("inference"):
+            horizon_results = inference_backend.predict_biomarker_trajectory(features, horizons)
+        confidence_scores = calculate_confidence_scores(features)
+    else:
+        # Use rule-based predictions (not horizon-dependent)
+        with budget.stage("fallback"):
+            horizon_results = [{'predicted_values': rule_based_biomarker_prediction(request)}] * len(horizons)
+        confidence_scores = {"overall": 0.7}
+    
+    with budget.stage("postprocess"):
+        predicted_values = horizon_results[0]['predicted_values']
+        confidence_intervals = horizon_results[0].get('confidence_intervals') or None
+        
+        trajectory = None
+        if request.time_horizons_days:
+            trajectory = format_biomarker_trajectory(horizons[1:], horizon_results[1:])
+        
+        # Identify risk factors
+        risk_factors = identify_biomarker_risk_factors(request, predicted_values)
+        
+        # Generate recommendations
+        recommendations = generate_biomarker_recommendations(request, predicted_values)
+        
+        return BiomarkerPredictionResponse(
+            predicted_values=predicted_values,
+            confidence_scores=confidence_scores,
+            risk_factors=risk_factors,
+            recommendations=recommendations,
+            confidence_intervals=confidence_intervals,
+            trajectory=trajectory,
+            inference_path=inference_path
+        )
+
+def choose_inference_path(models_loaded: bool, degraded: bool, budget: LatencyBudget) -> str:
+    """Which path answers a request: trained models, or one of the rule-based fallbacks"""
+    if not models_loaded:
+        return RULE_BASED_PATH
+    if degraded:
+        return DEGRADED_PATH
+    if not budget.can_afford("inference", "postprocess"):
+        # The models are not expected to finish within the caller's budget
+        return DEADLINE_PATH
+    return MODEL_PATH
 
 def prepare_biomarker_features(request: BiomarkerPredictionRequest) -> List[float]:
     """Prepare features for biomarker prediction"""
@@ -328,9 +1054,14 @@ def prepare_biomarker_features(request: BiomarkerPredictionRequest) -> List[floa
 
 def format_biomarker_predictions(predictions: np.ndarray) -> Dict:
     """Format biomarker predictions"""
-    biomarker_names = ['glucose', 'cholesterol', 'blood_pressure_systolic', 'blood_pressure_diastolic', 
-                      'hba1c', 'triglycerides', 'hdl', 'ldl']
-    return dict(zip(biomarker_names, predictions))
+    return dict(zip(BIOMARKERS, predictions.tolist()))
+
+def format_biomarker_trajectory(time_horizons_days: List[int], horizon_results: List[Dict]) -> List[Dict]:
+    """Format per-horizon biomarker predictions as a trajectory"""
+    return [
+        {"time_horizon_days": horizon, **result}
+        for horizon, result in zip(time_horizons_days, horizon_results)
+    ]
 
 def calculate_confidence_scores(features: List[float]) -> Dict:
     """Calculate confidence scores for predictions"""
@@ -359,18 +1090,7 @@ def identify_biomarker_risk_factors(request: BiomarkerPredictionRequest, predict
 
 def generate_biomarker_recommendations(request: BiomarkerPredictionRequest, predictions: Dict) -> List[str]:
     """Generate recommendations based on biomarker predictions"""
-    recommendations = []
-    
-    if predictions.get('glucose', 90) > 100:
-        recommendations.append("Consider reducing carbohydrate intake to manage glucose levels")
-    
-    if predictions.get('cholesterol', 180) > 200:
-        recommendations.append("Focus on heart-healthy fats and increase fiber intake")
-    
-    if predictions.get('blood_pressure_systolic', 110) > 130:
-        recommendations.append("Reduce sodium intake and increase potassium-rich foods")
-    
-    return recommendations
+    return BIOMARKER_RECOMMENDATION_RULES.apply_one(predictions)
 
 def calculate_health_risk_scores(request: HealthRiskAssessmentRequest) -> Dict:
     """Calculate health risk scores for various conditions"""
@@ -380,53 +1100,86 @@ def calculate_health_risk_scores(request: HealthRiskAssessmentRequest) -> Dict:
         request.biomarker_history
     )
 
-def identify_health_risk_factors(request: HealthRiskAssessmentRequest) -> List[str]:
-    """Identify health risk factors"""
-    risk_factors = []
-    
-    age = request.demographics.get('age', 30)
-    bmi = request.demographics.get('bmi', 22)
-    family_history = request.demographics.get('family_history', [])
+def run_health_risk_assessment(request: HealthRiskAssessmentRequest, degraded: bool = False,
+                               budget: Optional[LatencyBudget] = None, history: Optional[Tuple] = None,
+                               features: Optional[np.ndarray] = None) -> HealthRiskResponse:
+    """Health risk assessment, timed stage by stage against the request's latency budget
     
-    if age > 50:
-        risk_factors.append("Age-related health risks")
+    Falls back to rule-based risk scores like `run_biomarker_prediction`.
+    `history` and `features` replace the request's histories with already
+    summarized ones and a prepared row (e.g. from the feature store).
+    """
+    budget = budget or latency_tracker.budget("assess-health-risk")
     
-    if bmi > 30:
-        risk_factors.append("Obesity-related health risks")
+    # Columnar histories, shared by the model features and the reported trends
+    if history is None:
+        with budget.stage("features"):
+            history = risk_model.summarize_history(request.nutrition_history, request.biomarker_history)
+    inference_path = choose_inference_path(bool(risk_model.risk_models), degraded, budget)
     
-    if 'diabetes' in family_history:
-        risk_factors.append("Family history of diabetes")
+    # Calculate risk scores for various conditions, with their feature contributions
+    with budget.stage("inference" if inference_path == MODEL_PATH else "fallback"):
+        risk_scores, risk_explanations = assess_health_risks(
+            request, rule_based=inference_path in (DEGRADED_PATH, DEADLINE_PATH), history=history, features=features)
     
-    if 'heart_disease' in family_history:
-        risk_factors.append("Family history of heart disease")
+    with budget.stage("postprocess"):
+        # Identify risk factors
+        risk_factors = identify_health_risk_factors(request)
+        
+        # Generate prevention recommendations
+        prevention_recommendations = generate_prevention_recommendations(request, risk_scores)
+        
+        # Create monitoring schedule
+        monitoring_schedule = create_monitoring_schedule(request, risk_scores)
+        
+        return HealthRiskResponse(
+            risk_scores=risk_scores,
+            risk_factors=risk_factors,
+            prevention_recommendations=prevention_recommendations,
+            monitoring_schedule=monitoring_schedule,
+            risk_explanations=risk_explanations,
+            history_trends=summarize_history_trends(history) if request.include_history_trends else None,
+            inference_path=inference_path
+        )
+
+def assess_health_risks(request: HealthRiskAssessmentRequest, rule_based: bool = False,
+                        history: Optional[Tuple[HistorySummary, HistorySummary]] = None,
+                        features: Optional[np.ndarray] = None) -> Tuple[Dict, Dict]:
+    """Health risk scores with per-category feature contributions
     
-    return risk_factors
+    Trained models run on the inference backend; rule-based scores are
+    computed here.
+    """
+    if rule_based or not risk_model.risk_models:
+        return risk_model.assess_risks(
+            request.demographics,
+            request.nutrition_history,
+            request.biomarker_history,
+            rule_based=rule_based,
+            history=history,
+            features=features
+        )
+    if features is None:
+        features = risk_model._prepare_risk_features(
+            request.demographics, request.nutrition_history, request.biomarker_history, history)
+    return inference_backend.assess_feature_row(features)
+
+def summarize_history_trends(history: Tuple) -> HistoryTrends:
+    """Per-nutrient and per-biomarker trend statistics of the histories (HistorySummary or RunningHistory)"""
+    nutrition, biomarkers = history
+    return HistoryTrends(nutrition=nutrition.trends(), biomarkers=biomarkers.trends())
+
+def identify_health_risk_factors(request: HealthRiskAssessmentRequest) -> List[str]:
+    """Identify health risk factors"""
+    return HEALTH_RISK_FACTOR_RULES.apply_one(request.demographics)
 
 def generate_prevention_recommendations(request: HealthRiskAssessmentRequest, risk_scores: Dict) -> List[str]:
     """Generate prevention recommendations"""
-    recommendations = []
-    
-    for condition, score in risk_scores.items():
-        if score > 0.7:
-            recommendations.append(f"High risk for {condition.replace('_', ' ')} - consult healthcare provider")
-        elif score > 0.4:
-            recommendations.append(f"Moderate risk for {condition.replace('_', ' ')} - consider lifestyle changes")
-    
-    return recommendations
+    return PREVENTION_RULES.apply_one(risk_scores)
 
 def create_monitoring_schedule(request: HealthRiskAssessmentRequest, risk_scores: Dict) -> Dict:
     """Create monitoring schedule based on risk levels"""
-    schedule = {}
-    
-    for condition, score in risk_scores.items():
-        if score > 0.7:
-            schedule[condition] = "Monthly monitoring recommended"
-        elif score > 0.4:
-            schedule[condition] = "Quarterly monitoring recommended"
-        else:
-            schedule[condition] = "Annual monitoring sufficient"
-    
-    return schedule
+    return dict(MONITORING_RULES.apply_one(risk_scores))
 
 def load_training_data() -> pd.DataFrame:
     """Load training data for model training"""
@@ -0,0 +1,382 @@
+"""
+Fitted feature pipelines: fixed vocabularies, categorical encodings and derived columns
+"""
+
+from typing import Callable, Dict, List, Mapping, Optional, Sequence, Tuple, Union
+import logging
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from app.models.schema import (
+    BIOMARKER_DEFAULTS, BIOMARKER_MODEL_NUTRIENT_NAMES, BIOMARKERS, FAMILY_HISTORY_CONDITIONS,
+    RISK_MODEL_BIOMARKER_NAMES, RISK_MODEL_BIOMARKERS, RISK_MODEL_NUTRIENT_NAMES
+)
+
+logger = logging.getLogger(__name__)
+
+# Vocabularies of the categorical profile fields (unknown values encode as all zeros / -1)
+SEX_VALUES = ('female', 'male')
+ACTIVITY_LEVELS = ('sedentary', 'light', 'moderate', 'active', 'very_active')
+HEALTH_GOALS = ('weight_loss', 'muscle_gain', 'general_health', 'diabetes_management', 'heart_health', 'energy')
+MEDICAL_CONDITIONS = ('diabetes', 'hypertension', 'heart_disease', 'obesity')
+
+# Age group edges: (0, 30] -> 0, (30, 50] -> 1, (50, 70] -> 2, above 70 -> 3
+AGE_GROUP_EDGES = np.array([30, 50, 70])
+
+# Nutrition model inputs
+NUTRITION_MODEL_NUTRIENTS = ('protein', 'carbs', 'fat', 'fiber', 'vitamin_c', 'vitamin_d', 'calcium', 'iron')
+
+# Demographic defaults shared by the biomarker and risk features
+DEMOGRAPHIC_DEFAULTS = {'age': 30, 'weight': 70, 'height': 170}
+
+Frame = Union[pd.DataFrame, Sequence[Mapping]]
+
+
+def _bmi(column: Callable[[str], np.ndarray]) -> np.ndarray:
+    return column('weight') / (column('height') / 100) ** 2
+
+
+def _age_group(column: Callable[[str], np.ndarray]) -> np.ndarray:
+    return np.searchsorted(AGE_GROUP_EDGES, column('age'), side='left').astype(np.float64)
+
+
+def _macronutrient_ratio(nutrient: str) -> Callable[[Callable[[str], np.ndarray]], np.ndarray]:
+    def ratio(column: Callable[[str], np.ndarray]) -> np.ndarray:
+        total = column('protein') + column('carbs') + column('fat')
+        return np.divide(column(nutrient), total, out=np.zeros_like(total), where=total > 0)
+    return ratio
+
+
+# Derived columns by name: functions of the already encoded columns (looked up by feature name)
+DERIVATIONS: Dict[str, Callable[[Callable[[str], np.ndarray]], np.ndarray]] = {
+    'bmi': _bmi,
+    'age_group': _age_group,
+    'protein_ratio': _macronutrient_ratio('protein'),
+    'carb_ratio': _macronutrient_ratio('carbs'),
+    'fat_ratio': _macronutrient_ratio('fat'),
+}
+
+
+def _column(frame: pd.DataFrame, name: str) -> Optional[pd.Series]:
+    return frame[name] if name in frame.columns else None
+
+
+class NumericColumns:
+    """Numeric fields as they are; missing or non-numeric values take a default
+
+    Defaults left as None are fitted as the training medians.
+    """
+
+    def __init__(self, names: Sequence[str], defaults: Optional[Sequence[float]] = None):
+        self.names = tuple(names)
+        self.defaults = None if defaults is None else np.asarray(defaults, dtype=np.float64)
+
+    @property
+    def fitted(self) -> bool:
+        return self.defaults is not None
+
+    @property
+    def feature_names(self) -> Tuple[str, ...]:
+        return self.names
+
+    def fit(self, frame: pd.DataFrame):
+        if self.defaults is None:
+            medians = [pd.to_numeric(frame[name], errors='coerce').median() if name in frame.columns else np.nan
+                       for name in self.names]
+            self.defaults = np.nan_to_num(np.array(medians, dtype=np.float64))
+
+    def encode_frame(self, frame: pd.DataFrame, out: np.ndarray):
+        for i, name in enumerate(self.names):
+            column = _column(frame, name)
+            if column is None:
+                out[:, i] = self.defaults[i]
+            else:
+                values = pd.to_numeric(column, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+                out[:, i] = np.where(np.isnan(values), self.defaults[i], values)
+
+
+def _as_float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError, OverflowError):
+        return np.nan
+
+
+class OneHot:
+    """One 0/1 column per vocabulary value, named `<prefix><value>` (unknown values: all zeros)
+
+    A vocabulary left as None is fitted as the sorted training values.
+    """
+
+    def __init__(self, name: str, vocabulary: Optional[Sequence[str]] = None, prefix: Optional[str] = None):
+        self.name = name
+        self.vocabulary = None if vocabulary is None else tuple(vocabulary)
+        self.prefix = f"{name}_" if prefix is None else prefix
+
+    @property
+    def fitted(self) -> bool:
+        return self.vocabulary is not None
+
+    @property
+    def feature_names(self) -> Tuple[str, ...]:
+        return tuple(f"{self.prefix}{value}" for value in self.vocabulary)
+
+    def fit(self, frame: pd.DataFrame):
+        if self.vocabulary is None:
+            column = _column(frame, self.name)
+            values = [] if column is None else column.dropna().astype(str).unique()
+            self.vocabulary = tuple(sorted(values))
+
+    def _codes(self, frame: pd.DataFrame) -> np.ndarray:
+        column = _column(frame, self.name)
+        if column is None:
+            return np.full(len(frame), -1)
+        return np.asarray(pd.Categorical(column, categories=self.vocabulary).codes)
+
+    def encode_frame(self, frame: pd.DataFrame, out: np.ndarray):
+        out[:] = 0.0
+        codes = self._codes(frame)
+        rows = np.flatnonzero(codes >= 0)
+        out[rows, codes[rows]] = 1.0
+
+    def encode_record(self, record: Mapping, out: np.ndarray):
+        """Encode one record into a zeroed row block"""
+        value = record.get(self.name)
+        if isinstance(value, str) and value in self.vocabulary:
+            out[self.vocabulary.index(value)] = 1.0
+
+
+class Ordinal(OneHot):
+    """Vocabulary position of the value in one column (unknown values: `unknown`)"""
+
+    def __init__(self, name: str, vocabulary: Optional[Sequence[str]] = None, unknown: float = -1.0):
+        super().__init__(name, vocabulary)
+        self.unknown = unknown
+
+    @property
+    def feature_names(self) -> Tuple[str, ...]:
+        return (self.name,)
+
+    def encode_frame(self, frame: pd.DataFrame, out: np.ndarray):
+        codes = self._codes(frame)
+        out[:, 0] = np.where(codes >= 0, codes, self.unknown)
+
+    def encode_record(self, record: Mapping, out: np.ndarray):
+        value = record.get(self.name)
+        out[0] = self.vocabulary.index(value) if isinstance(value, str) and value in self.vocabulary else self.unknown
+
+
+class MultiHot(OneHot):
+    """One 0/1 column per vocabulary value present in a list field (a single string counts as one item)"""
+
+    def fit(self, frame: pd.DataFrame):
+        if self.vocabulary is None:
+            column = _column(frame, self.name)
+            values = [] if column is None else column.explode().dropna().astype(str).unique()
+            self.vocabulary = tuple(sorted(values))
+
+    def encode_frame(self, frame: pd.DataFrame, out: np.ndarray):
+        out[:] = 0.0
+        column = _column(frame, self.name)
+        if column is None:
+            return
+        # One row per list item, indexed by the record it came from
+        items = column.reset_index(drop=True).explode()
+        codes = np.asarray(pd.Categorical(items, categories=self.vocabulary).codes)
+        present = codes >= 0
+        out[items.index.to_numpy()[present], codes[present]] = 1.0
+
+    def encode_record(self, record: Mapping, out: np.ndarray):
+        values = record.get(self.name) or ()
+        if isinstance(values, str):
+            values = (values,)
+        for i, value in enumerate(self.vocabulary):
+            if value in values:
+                out[i] = 1.0
+
+
+class Derived:
+    """A column computed from earlier encoded columns (see DERIVATIONS)"""
+
+    fitted = True
+
+    def __init__(self, name: str):
+        if name not in DERIVATIONS:
+            raise ValueError(f"Unknown derived column {name!r}")
+        self.name = name
+
+    @property
+    def feature_names(self) -> Tuple[str, ...]:
+        return (self.name,)
+
+    def fit(self, frame: pd.DataFrame):
+        pass
+
+
+class FeaturePipeline:
+    """Raw profile/nutrition/biomarker fields -> model feature matrix, the same for batches and single rows
+
+    A pipeline is a list of steps (NumericColumns, OneHot, Ordinal,
+    MultiHot, Derived), each writing its own block of columns, in order.
+    Vocabularies and defaults are either fixed up front or fitted once on
+    the training frame and then frozen; the fitted pipeline is saved with
+    the model, so serving encodes exactly like training did. `transform`
+    encodes a whole frame column by column (vectorized, for training and
+    batches); `transform_one` encodes one record (a mapping) into the same
+    layout without building a frame.
+    """
+
+    def __init__(self, steps: Sequence):
+        self.steps = list(steps)
+        self._layout()
+
+    def _layout(self):
+        """Column slice of every step, and the single-record plan, once every step is fitted"""
+        self.feature_names: Tuple[str, ...] = ()
+        self._slices: List[slice] = []
+        if not self.fitted:
+            return
+        start = 0
+        for step in self.steps:
+            names = step.feature_names
+            self._slices.append(slice(start, start + len(names)))
+            self.feature_names += names
+            start += len(names)
+        self.feature_index = {name: i for i, name in enumerate(self.feature_names)}
+
+        # For single records every numeric field is read in one pass and placed with one scatter
+        numeric = [(step, columns) for step, columns in zip(self.steps, self._slices)
+                   if isinstance(step, NumericColumns)]
+        self._numeric_names = tuple(name for step, _ in numeric for name in step.names)
+        self._numeric_positions = np.array([i for _, columns in numeric for i in range(columns.start, columns.stop)],
+                                           dtype=np.intp)
+        self._numeric_defaults = np.concatenate([step.defaults for step, _ in numeric] or [np.zeros(0)])
+        self._categorical = [(step, columns) for step, columns in zip(self.steps, self._slices)
+                             if isinstance(step, OneHot)]
+        self._derived = [(step.name, columns.start) for step, columns in zip(self.steps, self._slices)
+                         if isinstance(step, Derived)]
+
+    @property
+    def fitted(self) -> bool:
+        return all(step.fitted for step in self.steps)
+
+    @property
+    def width(self) -> int:
+        return len(self.feature_names)
+
+    def fit(self, frame: Frame) -> 'FeaturePipeline':
+        """Learn the vocabularies and defaults left open (fixed ones are kept)"""
+        frame = self._as_frame(frame)
+        for step in self.steps:
+            step.fit(frame)
+        self._layout()
+        return self
+
+    def fit_transform(self, frame: Frame, dtype=np.float64) -> np.ndarray:
+        frame = self._as_frame(frame)
+        return self.fit(frame).transform(frame, dtype)
+
+    def transform(self, frame: Frame, dtype=np.float64) -> np.ndarray:
+        """Feature matrix (rows, features) of a frame or a list of records"""
+        self._check_fitted()
+        frame = self._as_frame(frame)
+        out = np.empty((len(frame), self.width), dtype=dtype)
+        for step, columns in zip(self.steps, self._slices):
+            if isinstance(step, Derived):
+                out[:, columns.start] = DERIVATIONS[step.name](self._column_getter(out))
+            else:
+                step.encode_frame(frame, out[:, columns])
+        return out
+
+    def transform_one(self, record: Mapping, dtype=np.float64) -> np.ndarray:
+        """Feature row of a single record; equal to the matching `transform` row"""
+        self._check_fitted()
+        out = np.zeros(self.width, dtype=dtype)
+        get = record.get
+        names = self._numeric_names
+        try:
+            values = np.fromiter(map(get, names), np.float64, len(names))
+        except (TypeError, ValueError, OverflowError):
+            values = np.array([_as_float(get(name)) for name in names], dtype=np.float64)
+        np.copyto(values, self._numeric_defaults, where=np.isnan(values))
+        out[self._numeric_positions] = values
+
+        for step, columns in self._categorical:
+            step.encode_record(record, out[columns])
+        if self._derived:
+            column = self._column_getter(out[np.newaxis])
+            for name, position in self._derived:
+                out[position] = DERIVATIONS[name](column)[0]
+        return out
+
+    def _column_getter(self, out: np.ndarray) -> Callable[[str], np.ndarray]:
+        index = self.feature_index
+        return lambda name: out[:, index[name]]
+
+    def _check_fitted(self):
+        if not self.fitted:
+            raise ValueError("Feature pipeline is not fitted")
+
+    @staticmethod
+    def _as_frame(frame: Frame) -> pd.DataFrame:
+        if isinstance(frame, pd.DataFrame):
+            return frame
+        return pd.DataFrame.from_records(list(frame))
+
+    def save(self, filepath: str):
+        joblib.dump(self, filepath)
+
+    @classmethod
+    def load(cls, filepath: str) -> 'FeaturePipeline':
+        pipeline = joblib.load(filepath)
+        if not isinstance(pipeline, cls):
+            raise ValueError(f"{filepath} does not hold a feature pipeline")
+        return pipeline
+
+
+def nutrition_pipeline() -> FeaturePipeline:
+    """NutritionAnalysisModel inputs: demographics, encoded profile fields, nutrients and derived ratios"""
+    return FeaturePipeline([
+        NumericColumns(('age', 'weight', 'height'), list(DEMOGRAPHIC_DEFAULTS.values())),
+        OneHot('sex', SEX_VALUES),
+        Ordinal('activity_level', ACTIVITY_LEVELS),
+        MultiHot('health_goals', HEALTH_GOALS, prefix='goal_'),
+        MultiHot('medical_history', MEDICAL_CONDITIONS, prefix='history_'),
+        NumericColumns(NUTRITION_MODEL_NUTRIENTS, np.zeros(len(NUTRITION_MODEL_NUTRIENTS))),
+        Derived('bmi'),
+        Derived('age_group'),
+        Derived('protein_ratio'),
+        Derived('carb_ratio'),
+        Derived('fat_ratio'),
+    ])
+
+
+def biomarker_pipeline() -> FeaturePipeline:
+    """BiomarkerPredictionModel inputs, laid out as BIOMARKER_FEATURES"""
+    return FeaturePipeline([
+        NumericColumns(('age', 'weight', 'height'), list(DEMOGRAPHIC_DEFAULTS.values())),
+        OneHot('sex', ('male',)),
+        NumericColumns(BIOMARKER_MODEL_NUTRIENT_NAMES, np.zeros(len(BIOMARKER_MODEL_NUTRIENT_NAMES))),
+        NumericColumns(BIOMARKERS, BIOMARKER_DEFAULTS),
+    ])
+
+
+def risk_pipeline() -> FeaturePipeline:
+    """HealthRiskAssessmentModel inputs (nutrients and biomarkers averaged over history), laid out as RISK_FEATURES"""
+    return FeaturePipeline([
+        NumericColumns(('age', 'weight', 'height'), list(DEMOGRAPHIC_DEFAULTS.values())),
+        OneHot('sex', ('male',)),
+        NumericColumns(('bmi',), (22,)),
+        MultiHot('family_history', FAMILY_HISTORY_CONDITIONS, prefix='family_'),
+        NumericColumns(RISK_MODEL_NUTRIENT_NAMES, np.zeros(len(RISK_MODEL_NUTRIENT_NAMES))),
+        NumericColumns(RISK_MODEL_BIOMARKER_NAMES, BIOMARKER_DEFAULTS[RISK_MODEL_BIOMARKERS]),
+    ])
+
+
+def check_layout(pipeline: FeaturePipeline, expected: Sequence[str], model: str):
+    """Raise ValueError unless a (loaded) pipeline produces the layout the serving code indexes into"""
+    if tuple(pipeline.feature_names) != tuple(expected):
+        raise ValueError(f"{model} feature pipeline produces {list(pipeline.feature_names)}, "
+                         f"expected {list(expected)}")
@@ -4,16 +4,103 @@ Healthcare-focused nutrition analysis models
 
 import numpy as np
 import pandas as pd
+from scipy.special import expit
 from sklearn.ensemble import RandomForestRegressor, GradientBoostingClassifier
-from sklearn.preprocessing import StandardScaler, LabelEncoder
+from sklearn.preprocessing import StandardScaler
 from sklearn.model_selection import train_test_split, cross_val_score
 from sklearn.metrics import mean_squared_error, accuracy_score, classification_report
 import joblib
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, List, Mapping, Tuple, Optional, Union
 import logging
 
+from app.models.tree_compiler import CompiledForest
+from app.models.schema import (
+    BIOMARKER_FEATURE_INDEX, BIOMARKER_FEATURES, RISK_FEATURE_INDEX,
+    RISK_CATEGORIES, RISK_FEATURES, BIOMARKER_INDEX, BIOMARKER_FEATURE_BIOMARKERS,
+    GLUCOSE, CHOLESTEROL, NUTRIENTS, BIOMARKERS, RISK_MODEL_NUTRIENTS, RISK_MODEL_BIOMARKERS,
+    RISK_MODEL_NUTRIENT_NAMES, RISK_MODEL_BIOMARKER_NAMES,
+    NutrientVector, BiomarkerVector, SchemaVector
+)
+from app.models.history import HistorySummary
+from app.models.feature_pipeline import (
+    FeaturePipeline, biomarker_pipeline, check_layout, nutrition_pipeline, risk_pipeline
+)
+
 logger = logging.getLogger(__name__)
 
+# Largest batch evaluated through the compiled forest rather than per-estimator predict
+COMPILED_FOREST_MAX_ROWS = 64
+
+# Working precision of model features and feature scaling; float32 halves the memory traffic
+# of feature matrices (trees compare float32 inputs either way)
+MODEL_PRECISIONS = {'float64': np.float64, 'float32': np.float32}
+
+def model_dtype(precision: str) -> type:
+    """The feature dtype of a MODEL_PRECISIONS name"""
+    if precision not in MODEL_PRECISIONS:
+        raise ValueError(f"Unknown model precision {precision!r}; expected one of {', '.join(MODEL_PRECISIONS)}")
+    return MODEL_PRECISIONS[precision]
+
+# Contributions within this fraction of the explained scale (at least 1) are floating-point noise
+EXPLANATION_TOLERANCE = 1e-12
+
+# Optimal and acceptable (protein, carb, fat) ratio bands for the fallback molecular score
+MOLECULAR_RATIO_BANDS = (
+    ((0.2, 0.3), (0.15, 0.35)),
+    ((0.4, 0.6), (0.3, 0.7)),
+    ((0.2, 0.3), (0.15, 0.35)),
+)
+
+RISK_CATEGORY_INDEX = {category: i for i, category in enumerate(RISK_CATEGORIES)}
+
+# Fallback risk added above each (exclusive) age and BMI threshold
+RISK_AGE_THRESHOLDS = np.array([40, 50])
+RISK_AGE_FACTORS = np.array([0.0, 0.1, 0.2])
+RISK_BMI_THRESHOLDS = np.array([25, 30])
+RISK_BMI_FACTORS = np.array([0.0, 0.2, 0.3])
+
+# Category-specific fallback risk factors: (family history feature, biomarker feature, threshold)
+RISK_CATEGORY_FACTORS = {
+    'diabetes': ('family_diabetes', 'glucose', 100),
+    'cardiovascular': ('family_heart_disease', 'cholesterol', 200),
+}
+RISK_FACTOR_CATEGORIES = np.array([RISK_CATEGORY_INDEX[category] for category in RISK_CATEGORY_FACTORS])
+RISK_FACTOR_FAMILY = np.array([RISK_FEATURE_INDEX[family] for family, _, _ in RISK_CATEGORY_FACTORS.values()])
+RISK_FACTOR_BIOMARKERS = np.array([RISK_FEATURE_INDEX[biomarker] for _, biomarker, _ in RISK_CATEGORY_FACTORS.values()])
+RISK_FACTOR_THRESHOLDS = np.array([threshold for _, _, threshold in RISK_CATEGORY_FACTORS.values()])
+
+def _as_mapping(data: Union[Mapping, SchemaVector, None]) -> Mapping:
+    """A request field (dict, schema vector or None) as a name -> value mapping"""
+    if isinstance(data, SchemaVector):
+        return data.to_dict()
+    return data or {}
+
+def additive_explanations(base_values: np.ndarray, contributions: np.ndarray, names: List,
+                          predictions: np.ndarray, scale: str) -> List[Dict]:
+    """Explanation dicts for several predictions: base_value + sum(contributions) + adjustment == prediction
+
+    `contributions` is shaped (predictions, features). Only contributions
+    above EXPLANATION_TOLERANCE are kept, largest magnitude first; the
+    adjustment carries whatever the kept terms do not (e.g. clamping, or
+    the noise left out).
+    """
+    base_values = np.asarray(base_values, dtype=np.float64)
+    contributions = np.asarray(contributions, dtype=np.float64)
+    tolerance = EXPLANATION_TOLERANCE * np.maximum(1.0, np.abs(base_values))
+    contributions = np.where(np.abs(contributions) > tolerance[:, np.newaxis], contributions, 0.0)
+    orders = np.argsort(-np.abs(contributions), axis=1, kind='stable').tolist()
+    adjustments = (np.asarray(predictions) - base_values - contributions.sum(axis=1)).tolist()
+
+    explanations = []
+    for base_value, row, order, adjustment in zip(base_values.tolist(), contributions.tolist(), orders, adjustments):
+        explanations.append({
+            'scale': scale,
+            'base_value': base_value,
+            'contributions': {names[i]: row[i] for i in order if row[i] != 0},
+            'adjustment': adjustment
+        })
+    return explanations
+
 class NutritionAnalysisModel:
     """Advanced nutrition analysis with healthcare insights"""
     
@@ -21,75 +108,47 @@ class NutritionAnalysisModel:
         self.molecular_balance_model = RandomForestRegressor(n_estimators=100, random_state=42)
         self.deficiency_risk_model = GradientBoostingClassifier(n_estimators=100, random_state=42)
         self.scaler = StandardScaler()
-        self.label_encoders = {}
+        self.feature_pipeline: FeaturePipeline = nutrition_pipeline()
         self.feature_importance = {}
+        self.compiled_forest: Optional[CompiledForest] = None
         
     def prepare_features(self, data: pd.DataFrame) -> np.ndarray:
-        """Prepare features for nutrition analysis"""
-        features = data.copy()
-        
-        # Encode categorical variables
-        categorical_cols = ['sex', 'activity_level', 'health_goals', 'medical_history']
-        for col in categorical_cols:
-            if col in features.columns:
-                if col not in self.label_encoders:
-                    self.label_encoders[col] = LabelEncoder()
-                    features[col] = self.label_encoders[col].fit_transform(features[col].astype(str))
-                else:
-                    features[col] = self.label_encoders[col].transform(features[col].astype(str))
-        
-        # Calculate derived features
-        features['bmi'] = features['weight'] / (features['height'] / 100) ** 2
-        features['age_group'] = pd.cut(features['age'], bins=[0, 30, 50, 70, 100], labels=[0, 1, 2, 3])
-        
-        # Nutrition features
-        nutrition_cols = ['protein', 'carbs', 'fat', 'fiber', 'vitamin_c', 'vitamin_d', 'calcium', 'iron']
-        for col in nutrition_cols:
-            if col not in features.columns:
-                features[col] = 0
-        
-        # Calculate nutrition ratios
-        features['protein_ratio'] = features['protein'] / (features['protein'] + features['carbs'] + features['fat'])
-        features['carb_ratio'] = features['carbs'] / (features['protein'] + features['carbs'] + features['fat'])
-        features['fat_ratio'] = features['fat'] / (features['protein'] + features['carbs'] + features['fat'])
-        
-        return features.values
+        """Prepare features for nutrition analysis (encoded profile fields, nutrients, derived ratios)"""
+        return self.feature_pipeline.transform(data)
     
     def calculate_molecular_balance_score(self, features: np.ndarray) -> float:
         """Calculate molecular balance score based on nutrition and health factors"""
         if self.molecular_balance_model is None:
             return self._rule_based_molecular_score(features)
         
-        score = self.molecular_balance_model.predict([features])[0]
+        features = np.asarray(features, dtype=np.float64)[np.newaxis]
+        if self.compiled_forest is not None:
+            # The scaler is folded into the compiled thresholds
+            score = self.compiled_forest.predict(features)[0, 0]
+        else:
+            score = self.molecular_balance_model.predict(self.scaler.transform(features))[0]
         return max(0, min(100, score))  # Clamp between 0-100
     
     def _rule_based_molecular_score(self, features: np.ndarray) -> float:
         """Fallback rule-based molecular balance score"""
-        # Basic scoring based on nutrition ratios and health factors
-        base_score = 50
-        
-        # Protein ratio bonus (optimal: 0.2-0.3)
-        protein_ratio = features[0] if len(features) > 0 else 0.25
-        if 0.2 <= protein_ratio <= 0.3:
-            base_score += 15
-        elif 0.15 <= protein_ratio <= 0.35:
-            base_score += 10
-        
-        # Carb ratio bonus (optimal: 0.4-0.6)
-        carb_ratio = features[1] if len(features) > 1 else 0.5
-        if 0.4 <= carb_ratio <= 0.6:
-            base_score += 15
-        elif 0.3 <= carb_ratio <= 0.7:
-            base_score += 10
-        
-        # Fat ratio bonus (optimal: 0.2-0.3)
-        fat_ratio = features[2] if len(features) > 2 else 0.25
-        if 0.2 <= fat_ratio <= 0.3:
-            base_score += 15
-        elif 0.15 <= fat_ratio <= 0.35:
-            base_score += 10
-        
-        return min(100, base_score)
+        # Missing ratios take their optimal values
+        ratios = np.array([0.25, 0.5, 0.25])
+        ratios[:min(len(features), 3)] = features[:3]
+        return float(self.rule_based_molecular_scores(ratios[np.newaxis])[0])
+    
+    def rule_based_molecular_scores(self, X: np.ndarray) -> np.ndarray:
+        """Fallback molecular balance scores for a matrix of (protein, carb, fat) ratio rows"""
+        X = np.asarray(X, dtype=np.float64)
+        
+        # Basic scoring based on nutrition ratios: 15 points in the optimal band, 10 in the acceptable one
+        scores = np.full(len(X), 50.0)
+        for column, (optimal, acceptable) in enumerate(MOLECULAR_RATIO_BANDS):
+            ratio = X[:, column]
+            in_optimal = (optimal[0] <= ratio) & (ratio <= optimal[1])
+            in_acceptable = (acceptable[0] <= ratio) & (ratio <= acceptable[1])
+            scores += np.where(in_optimal, 15, np.where(in_acceptable, 10, 0))
+        
+        return np.minimum(100, scores)
     
     def identify_deficiency_risks(self, features: np.ndarray) -> List[Dict]:
         """Identify potential nutrient deficiencies"""
@@ -147,6 +206,8 @@ class NutritionAnalysisModel:
                 range(len(X_scaled[0])), 
                 self.molecular_balance_model.feature_importances_
             ))
+            self.compiled_forest = CompiledForest.try_compile({'molecular_balance': self.molecular_balance_model},
+                                                          self.scaler)
             
             logger.info("Nutrition analysis model trained successfully")
             
@@ -159,7 +220,7 @@ class NutritionAnalysisModel:
         model_data = {
             'molecular_balance_model': self.molecular_balance_model,
             'scaler': self.scaler,
-            'label_encoders': self.label_encoders,
+            'feature_pipeline': self.feature_pipeline,
             'feature_importance': self.feature_importance
         }
         joblib.dump(model_data, filepath)
@@ -170,8 +231,11 @@ class NutritionAnalysisModel:
         model_data = joblib.load(filepath)
         self.molecular_balance_model = model_data['molecular_balance_model']
         self.scaler = model_data['scaler']
-        self.label_encoders = model_data['label_encoders']
+        # Models saved before feature pipelines were label-encoded ad hoc; they keep the default pipeline
+        self.feature_pipeline = model_data.get('feature_pipeline') or nutrition_pipeline()
         self.feature_importance = model_data['feature_importance']
+        self.compiled_forest = CompiledForest.try_compile({'molecular_balance': self.molecular_balance_model},
+                                                          self.scaler)
         logger.info(f"Model loaded from {filepath}")
 
 
@@ -180,7 +244,13 @@ class BiomarkerPredictionModel:
     
     def __init__(self):
         self.biomarker_models = {}
+        # All fitted forests flattened for single-pass prediction and confidence intervals
+        self.compiled_forest: Optional[CompiledForest] = None
         self.scaler = StandardScaler()
+        # Raw inputs -> BIOMARKER_FEATURES, shared by training and serving
+        self.feature_pipeline: FeaturePipeline = biomarker_pipeline()
+        # Serving feature dtype (see MODEL_PRECISIONS); training always uses float64
+        self.dtype = np.float64
         self.biomarker_ranges = {
             'glucose': (70, 100),  # mg/dL
             'cholesterol': (0, 200),  # mg/dL
@@ -192,88 +262,135 @@ class BiomarkerPredictionModel:
             'ldl': (0, 100),  # mg/dL
         }
     
-    def prepare_features(self, user_profile: Dict, nutrition_data: Dict, 
-                        current_biomarkers: Dict) -> np.ndarray:
-        """Prepare features for biomarker prediction"""
-        features = []
-        
-        # Demographics
-        features.extend([
-            user_profile.get('age', 30),
-            user_profile.get('weight', 70),
-            user_profile.get('height', 170),
-            1 if user_profile.get('sex') == 'male' else 0
-        ])
-        
-        # Nutrition features
-        nutrition_features = [
-            nutrition_data.get('protein', 0),
-            nutrition_data.get('carbs', 0),
-            nutrition_data.get('fat', 0),
-            nutrition_data.get('fiber', 0),
-            nutrition_data.get('sodium', 0),
-            nutrition_data.get('sugar', 0)
-        ]
-        features.extend(nutrition_features)
-        
-        # Current biomarkers
-        biomarker_features = [
-            current_biomarkers.get('glucose', 90),
-            current_biomarkers.get('cholesterol', 180),
-            current_biomarkers.get('blood_pressure_systolic', 110),
-            current_biomarkers.get('blood_pressure_diastolic', 70),
-            current_biomarkers.get('hba1c', 5.5),
-            current_biomarkers.get('triglycerides', 100),
-            current_biomarkers.get('hdl', 50),
-            current_biomarkers.get('ldl', 100)
-        ]
-        features.extend(biomarker_features)
-        
-        return np.array(features)
+    def prepare_features(self, user_profile: Dict, nutrition_data: Union[NutrientVector, Dict], 
+                        current_biomarkers: Union[BiomarkerVector, Dict]) -> np.ndarray:
+        """Prepare features for biomarker prediction (laid out as BIOMARKER_FEATURES)
+        
+        One record through the model's feature pipeline, the one training
+        batches go through; missing biomarkers take population defaults.
+        """
+        return self.feature_pipeline.transform_one({
+            **user_profile,
+            **_as_mapping(nutrition_data),
+            **_as_mapping(current_biomarkers)
+        }, self.dtype)
     
     def predict_biomarkers(self, features: np.ndarray, time_horizon_days: int = 30) -> Dict:
         """Predict biomarker values for given time horizon"""
-        predictions = {}
-        
-        # Scale features
-        features_scaled = self.scaler.transform([features])
-        
-        # Predict each biomarker
-        for biomarker, model in self.biomarker_models.items():
-            if model is not None:
-                pred = model.predict(features_scaled)[0]
-                # Adjust prediction based on time horizon
-                time_factor = 1 + (time_horizon_days / 365) * 0.1  # 10% change per year
-                predictions[biomarker] = pred * time_factor
+        return self.predict_biomarker_trajectory(features, [time_horizon_days])[0]['predicted_values']
+    
+    def predict_biomarker_trajectory(self, features: np.ndarray, time_horizons_days: List[int]) -> List[Dict]:
+        """Predict biomarker values (with forest confidence intervals) at several time horizons
+        
+        Each model is evaluated once; entries are
+        {'predicted_values': {...}, 'confidence_intervals': {biomarker: {'lower', 'upper'}}}.
+        """
+        biomarkers = list(self.biomarker_models)
+        base = np.empty(len(biomarkers))
+        lower = np.full(len(biomarkers), np.nan)
+        upper = np.full(len(biomarkers), np.nan)
+        adjusted = np.zeros(len(biomarkers), dtype=bool)
+        
+        features = np.asarray(features, dtype=self.dtype)[np.newaxis]
+        features_scaled = None
+        
+        # Walk every compiled forest once for predictions and tree spread (the scaler is folded in)
+        compiled = {}
+        if self.compiled_forest is not None:
+            predictions, lows, highs = self.compiled_forest.predict_with_intervals(features)
+            for column, biomarker in enumerate(self.compiled_forest.names):
+                compiled[biomarker] = (predictions[0, column], lows[0, column], highs[0, column])
+        
+        # Predict each biomarker once
+        fallback = None
+        for i, biomarker in enumerate(biomarkers):
+            model = self.biomarker_models[biomarker]
+            if biomarker in compiled:
+                base[i], lower[i], upper[i] = compiled[biomarker]
+                adjusted[i] = True
+            elif model is not None:
+                # Models are trained on scaled features
+                if features_scaled is None:
+                    features_scaled = self.scaler.transform(features)
+                base[i] = model.predict(features_scaled)[0]
+                adjusted[i] = True
             else:
-                # Fallback to rule-based prediction
-                predictions[biomarker] = self._rule_based_prediction(biomarker, features)
+                # Fallback to rule-based prediction (all biomarkers in one pass)
+                if fallback is None:
+                    fallback = self.rule_based_predictions(features)[0]
+                base[i] = fallback[BIOMARKER_INDEX[biomarker]]
+        
+        # Adjust model predictions based on time horizon (10% change per year); fallbacks stay as they are
+        time_factors = 1 + (np.asarray(time_horizons_days, dtype=np.float64) / 365) * 0.1
+        time_factors = time_factors[:, np.newaxis]
+        trajectory = np.where(adjusted, base * time_factors, base)
+        lower_bounds = (lower * time_factors).tolist()
+        upper_bounds = (upper * time_factors).tolist()
+        
+        results = []
+        for h, values in enumerate(trajectory.tolist()):
+            intervals = {
+                biomarker: {'lower': lower_bounds[h][i], 'upper': upper_bounds[h][i]}
+                for i, biomarker in enumerate(biomarkers)
+                if biomarker in compiled
+            }
+            results.append({
+                'predicted_values': dict(zip(biomarkers, values)),
+                'confidence_intervals': intervals
+            })
+        return results
+    
+    def predict_biomarker_matrix(self, X: np.ndarray, time_horizon_days: int = 30) -> np.ndarray:
+        """Predictions of every biomarker for a feature matrix, shaped (rows, BIOMARKERS)
+        
+        Biomarkers with a trained model get the horizon-adjusted model
+        prediction; the others get the rule-based fallback.
+        """
+        X = np.asarray(X, dtype=self.dtype)
+        predictions = self.rule_based_predictions(X)
+        trained = [biomarker for biomarker, model in self.biomarker_models.items() if model is not None]
+        if not trained:
+            return predictions
+        
+        time_factor = 1 + (time_horizon_days / 365) * 0.1  # 10% change per year
+        
+        # The flattened traversal (on unscaled rows) wins on small batches; sklearn's own predict on large ones
+        compiled = None
+        if self.compiled_forest is not None and len(X) <= COMPILED_FOREST_MAX_ROWS:
+            compiled = self.compiled_forest.predict(X)
+        compiled_names = self.compiled_forest.names if compiled is not None else []
+        X_scaled = None
+        for biomarker in trained:
+            if biomarker in compiled_names:
+                model_predictions = compiled[:, compiled_names.index(biomarker)]
+            else:
+                if X_scaled is None:
+                    X_scaled = self.scaler.transform(X)
+                model_predictions = self.biomarker_models[biomarker].predict(X_scaled)
+            predictions[:, BIOMARKER_INDEX[biomarker]] = model_predictions * time_factor
         
         return predictions
     
     def _rule_based_prediction(self, biomarker: str, features: np.ndarray) -> float:
         """Fallback rule-based biomarker prediction"""
-        current_value = features[8] if len(features) > 8 else 90  # Default glucose
-        
-        if biomarker == 'glucose':
-            # Predict based on carb intake and current glucose
-            carb_intake = features[5] if len(features) > 5 else 0
-            if carb_intake > 200:  # High carb intake
-                return current_value * 1.1
-            elif carb_intake < 100:  # Low carb intake
-                return current_value * 0.95
-            else:
-                return current_value
+        return self.rule_based_predictions(np.asarray(features)[np.newaxis])[0, BIOMARKER_INDEX[biomarker]]
+    
+    def rule_based_predictions(self, X: np.ndarray) -> np.ndarray:
+        """Fallback predictions of every biomarker (columns in BIOMARKERS order) for a feature matrix"""
+        X = np.asarray(X, dtype=np.float64)
         
-        elif biomarker == 'cholesterol':
-            # Predict based on fat intake
-            fat_intake = features[7] if len(features) > 7 else 0
-            if fat_intake > 80:  # High fat intake
-                return current_value * 1.05
-            else:
-                return current_value
+        # Without a rule, a biomarker is predicted to stay at its current value
+        predictions = X[:, BIOMARKER_FEATURE_BIOMARKERS].copy()
         
-        return current_value
+        # Glucose follows carb intake: high (>200g) raises it, low (<100g) lowers it
+        carb_intake = X[:, BIOMARKER_FEATURE_INDEX['carbs']]
+        predictions[:, GLUCOSE] *= np.where(carb_intake > 200, 1.1, np.where(carb_intake < 100, 0.95, 1.0))
+        
+        # Cholesterol follows fat intake: high (>80g) raises it
+        fat_intake = X[:, BIOMARKER_FEATURE_INDEX['fat']]
+        predictions[:, CHOLESTEROL] *= np.where(fat_intake > 80, 1.05, 1.0)
+        
+        return predictions
     
     def calculate_risk_factors(self, predictions: Dict) -> List[str]:
         """Calculate risk factors based on predicted biomarkers"""
@@ -307,6 +424,7 @@ class BiomarkerPredictionModel:
                     self.biomarker_models[biomarker] = model
                     logger.info(f"Trained model for {biomarker}")
             
+            self.compiled_forest = CompiledForest.try_compile(self.biomarker_models, self.scaler)
             logger.info("Biomarker prediction models trained successfully")
             
         except Exception as e:
@@ -318,6 +436,7 @@ class BiomarkerPredictionModel:
         model_data = {
             'biomarker_models': self.biomarker_models,
             'scaler': self.scaler,
+            'feature_pipeline': self.feature_pipeline,
             'biomarker_ranges': self.biomarker_ranges
         }
         joblib.dump(model_data, filepath)
@@ -326,9 +445,14 @@ class BiomarkerPredictionModel:
     def load_model(self, filepath: str):
         """Load trained models"""
         model_data = joblib.load(filepath)
+        # The serving code indexes features by the BIOMARKER_FEATURES layout
+        feature_pipeline = model_data.get('feature_pipeline') or biomarker_pipeline()
+        check_layout(feature_pipeline, BIOMARKER_FEATURES, "Biomarker model")
+        self.feature_pipeline = feature_pipeline
         self.biomarker_models = model_data['biomarker_models']
         self.scaler = model_data['scaler']
         self.biomarker_ranges = model_data['biomarker_ranges']
+        self.compiled_forest = CompiledForest.try_compile(self.biomarker_models, self.scaler)
         logger.info(f"Biomarker models loaded from {filepath}")
 
 
@@ -337,11 +461,13 @@ class HealthRiskAssessmentModel:
     
     def __init__(self):
         self.risk_models = {}
-        self.risk_categories = [
-            'diabetes', 'cardiovascular', 'hypertension', 'obesity', 
-            'osteoporosis', 'cancer', 'metabolic_syndrome'
-        ]
+        self.risk_categories = list(RISK_CATEGORIES)
         self.scaler = StandardScaler()
+        # Raw inputs -> RISK_FEATURES, shared by training and serving
+        self.feature_pipeline: FeaturePipeline = risk_pipeline()
+        # Serving feature dtype (see MODEL_PRECISIONS); training always uses float64
+        self.dtype = np.float64
+        self.compiled_forest: Optional[CompiledForest] = None
     
     def calculate_risk_scores(self, demographics: Dict, nutrition_history: List[Dict], 
                             biomarker_history: List[Dict]) -> Dict:
@@ -352,132 +478,177 @@ class HealthRiskAssessmentModel:
         features = self._prepare_risk_features(demographics, nutrition_history, biomarker_history)
         
         # Calculate risk for each category
-        for category in self.risk_categories:
-            if category in self.risk_models and self.risk_models[category] is not None:
-                risk_score = self.risk_models[category].predict_proba([features])[0][1]
-                risk_scores[category] = float(risk_score)
-            else:
-                # Fallback to rule-based risk assessment
-                risk_scores[category] = self._rule_based_risk_assessment(category, features)
+        scores = self.risk_score_matrix(features[np.newaxis])[0]
+        for category, risk_score in zip(self.risk_categories, scores.tolist()):
+            risk_scores[category] = risk_score
         
         return risk_scores
     
-    def _prepare_risk_features(self, demographics: Dict, nutrition_history: List[Dict], 
-                              biomarker_history: List[Dict]) -> np.ndarray:
-        """Prepare features for risk assessment"""
-        features = []
-        
-        # Demographics
-        features.extend([
-            demographics.get('age', 30),
-            demographics.get('weight', 70),
-            demographics.get('height', 170),
-            1 if demographics.get('sex') == 'male' else 0,
-            demographics.get('bmi', 22)
-        ])
-        
-        # Family history (binary features)
-        family_history = demographics.get('family_history', [])
-        features.extend([
-            1 if 'diabetes' in family_history else 0,
-            1 if 'heart_disease' in family_history else 0,
-            1 if 'cancer' in family_history else 0,
-            1 if 'hypertension' in family_history else 0
-        ])
-        
-        # Average nutrition over time
-        if nutrition_history:
-            avg_nutrition = self._calculate_average_nutrition(nutrition_history)
-            features.extend([
-                avg_nutrition.get('protein', 0),
-                avg_nutrition.get('carbs', 0),
-                avg_nutrition.get('fat', 0),
-                avg_nutrition.get('fiber', 0),
-                avg_nutrition.get('sodium', 0)
-            ])
-        else:
-            features.extend([0, 0, 0, 0, 0])
-        
-        # Average biomarkers over time
-        if biomarker_history:
-            avg_biomarkers = self._calculate_average_biomarkers(biomarker_history)
-            features.extend([
-                avg_biomarkers.get('glucose', 90),
-                avg_biomarkers.get('cholesterol', 180),
-                avg_biomarkers.get('blood_pressure_systolic', 110),
-                avg_biomarkers.get('blood_pressure_diastolic', 70)
-            ])
+    def assess_risks(self, demographics: Dict, nutrition_history: List[Dict],
+                     biomarker_history: List[Dict], rule_based: bool = False,
+                     history: Optional[Tuple[HistorySummary, HistorySummary]] = None,
+                     features: Optional[np.ndarray] = None) -> Tuple[Dict, Dict]:
+        """Risk scores plus per-category explanations, from one prepared feature row
+        
+        `rule_based` skips the trained models and scores every category
+        with the rule-based fallback (e.g. when shedding load). `history`
+        reuses an earlier `summarize_history` of the same histories, and
+        `features` an already prepared row (e.g. from the feature store).
+        """
+        if features is None:
+            features = self._prepare_risk_features(demographics, nutrition_history, biomarker_history, history)
+        return self.assess_feature_row(features, rule_based)
+    
+    def assess_feature_row(self, features: np.ndarray, rule_based: bool = False) -> Tuple[Dict, Dict]:
+        """Risk scores plus per-category explanations for one prepared feature row"""
+        if rule_based:
+            scores = self.rule_based_risk_scores(features[np.newaxis])[0, self._rule_based_columns()]
         else:
-            features.extend([90, 180, 110, 70])
-        
-        return np.array(features)
+            scores = self.risk_score_matrix(features[np.newaxis])[0]
+        risk_scores = dict(zip(self.risk_categories, scores.tolist()))
+        return risk_scores, self.explain_risk_scores(features, scores, rule_based)
     
-    def _calculate_average_nutrition(self, nutrition_history: List[Dict]) -> Dict:
-        """Calculate average nutrition over time"""
-        if not nutrition_history:
-            return {}
-        
-        totals = {}
-        count = len(nutrition_history)
-        
-        for entry in nutrition_history:
-            for nutrient, value in entry.items():
-                if isinstance(value, (int, float)):
-                    totals[nutrient] = totals.get(nutrient, 0) + value
+    def _rule_based_columns(self) -> List[int]:
+        """Column of each risk category in the rule-based score matrix"""
+        return [RISK_CATEGORY_INDEX[category] for category in self.risk_categories]
+    
+    def explain_risk_scores(self, features: np.ndarray, scores: Optional[np.ndarray] = None,
+                            rule_based: bool = False) -> Dict:
+        """Additive per-feature explanation of each category's risk score
+        
+        Trained models are explained in log-odds by decision path
+        contributions (the score is the sigmoid of the explained value);
+        rule-based scores are split into the base, age, BMI, family history
+        and biomarker terms that make them up. Trained models that could not
+        be compiled are left unexplained. `rule_based` explains every
+        category as rule-based, matching `assess_risks(..., rule_based=True)`.
+        """
+        features = np.asarray(features, dtype=np.float64)
+        if scores is None:
+            if rule_based:
+                scores = self.rule_based_risk_scores(features[np.newaxis])[0, self._rule_based_columns()]
+            else:
+                scores = self.risk_score_matrix(features[np.newaxis])[0]
+        
+        explanations = {}
+        rule_based_columns = [column for column, category in enumerate(self.risk_categories)
+                              if rule_based or self.risk_models.get(category) is None]
+        if rule_based_columns:
+            bias, contributions = self.rule_based_risk_contributions(features[np.newaxis])
+            positions = [RISK_CATEGORY_INDEX[self.risk_categories[column]] for column in rule_based_columns]
+            for column, explanation in zip(rule_based_columns, additive_explanations(
+                    bias[0, positions], contributions[0, positions], RISK_FEATURES,
+                    scores[rule_based_columns], 'probability')):
+                explanations[self.risk_categories[column]] = explanation
+        
+        if self.compiled_forest is not None and len(rule_based_columns) < len(self.risk_categories):
+            # Raw log-odds explanations for every compiled model at once; the paths
+            # add up to the log-odds, so no separate prediction pass is needed
+            # (unscaled rows in the models' dtype, so the explained log-odds match the scores)
+            bias, contributions = self.compiled_forest.contributions(features[np.newaxis].astype(self.dtype))
+            log_odds = bias[0] + contributions[0].sum(axis=1)
+            for name, explanation in zip(self.compiled_forest.names, additive_explanations(
+                    bias[0], contributions[0], RISK_FEATURES, log_odds, 'log_odds')):
+                explanations[name] = explanation
+        
+        # Report categories in the same order as risk_scores
+        return {category: explanations[category] for category in self.risk_categories if category in explanations}
+    
+    def risk_score_matrix(self, X: np.ndarray) -> np.ndarray:
+        """Risk scores for a feature matrix, shaped (rows, risk_categories)"""
+        X = np.asarray(X, dtype=self.dtype)
+        scores = np.empty((len(X), len(self.risk_categories)))
+        X_scaled = None
+        fallback = None
+        
+        # Small batches: every model's log-odds from one flattened traversal of unscaled rows
+        compiled = None
+        if self.compiled_forest is not None and len(X) <= COMPILED_FOREST_MAX_ROWS:
+            compiled = dict(zip(self.compiled_forest.names, expit(self.compiled_forest.predict(X)).T))
+        
+        for column, category in enumerate(self.risk_categories):
+            model = self.risk_models.get(category)
+            if compiled is not None and category in compiled:
+                scores[:, column] = compiled[category]
+            elif model is not None:
+                # Models are trained on scaled features
+                if X_scaled is None:
+                    X_scaled = self.scaler.transform(X)
+                scores[:, column] = model.predict_proba(X_scaled)[:, 1]
+            else:
+                # Fallback to rule-based risk assessment (all categories in one pass)
+                if fallback is None:
+                    fallback = self.rule_based_risk_scores(X)
+                scores[:, column] = fallback[:, RISK_CATEGORY_INDEX[category]]
         
-        return {nutrient: total / count for nutrient, total in totals.items()}
+        return scores
+    
+    def summarize_history(self, nutrition_history: List[Dict],
+                          biomarker_history: List[Dict]) -> Tuple[HistorySummary, HistorySummary]:
+        """Columnar nutrition (NUTRIENTS) and biomarker (BIOMARKERS) histories, built once per request"""
+        return (HistorySummary.from_entries(nutrition_history, NUTRIENTS),
+                HistorySummary.from_entries(biomarker_history, BIOMARKERS))
+    
+    def _prepare_risk_features(self, demographics: Dict, nutrition_history: List[Dict], 
+                              biomarker_history: List[Dict],
+                              history: Optional[Tuple[HistorySummary, HistorySummary]] = None) -> np.ndarray:
+        """Prepare features for risk assessment (laid out as RISK_FEATURES)
+        
+        `history` is the result of `summarize_history` for the same
+        histories when the caller already has it, or a pair of
+        RunningHistory kept up to date by the feature store.
+        """
+        # Average nutrition (zeros without history) and biomarkers (population defaults) over time
+        nutrition, biomarkers = history or self.summarize_history(nutrition_history, biomarker_history)
+        
+        # Demographics and family history, then the averages, through the training pipeline
+        record = dict(demographics)
+        record.update(zip(RISK_MODEL_NUTRIENT_NAMES, nutrition.means(NutrientVector.defaults)[RISK_MODEL_NUTRIENTS].tolist()))
+        record.update(zip(RISK_MODEL_BIOMARKER_NAMES, biomarkers.means(BiomarkerVector.defaults)[RISK_MODEL_BIOMARKERS].tolist()))
+        return self.feature_pipeline.transform_one(record, self.dtype)
     
-    def _calculate_average_biomarkers(self, biomarker_history: List[Dict]) -> Dict:
-        """Calculate average biomarkers over time"""
-        if not biomarker_history:
-            return {}
+    def _rule_based_risk_assessment(self, category: str, features: np.ndarray) -> float:
+        """Fallback rule-based risk assessment"""
+        return float(self.rule_based_risk_scores(np.asarray(features)[np.newaxis])[0, RISK_CATEGORY_INDEX[category]])
+    
+    def rule_based_risk_scores(self, X: np.ndarray) -> np.ndarray:
+        """Fallback risk scores of every category (columns in RISK_CATEGORIES order) for a feature matrix"""
+        X = np.asarray(X, dtype=np.float64)
         
-        totals = {}
-        count = len(biomarker_history)
+        # Base risk plus age and BMI factors (looked up by threshold band), shared by every category
+        risk = 0.1 + RISK_AGE_FACTORS[np.searchsorted(RISK_AGE_THRESHOLDS, X[:, RISK_FEATURE_INDEX['age']])]
+        risk += RISK_BMI_FACTORS[np.searchsorted(RISK_BMI_THRESHOLDS, X[:, RISK_FEATURE_INDEX['bmi']])]
+        scores = np.empty((len(X), len(RISK_CATEGORIES)))
+        scores[:] = risk[:, np.newaxis]
         
-        for entry in biomarker_history:
-            for biomarker, value in entry.items():
-                if isinstance(value, (int, float)):
-                    totals[biomarker] = totals.get(biomarker, 0) + value
+        # Family history and biomarker factors for the categories that have them
+        scores[:, RISK_FACTOR_CATEGORIES] += np.where(X[:, RISK_FACTOR_FAMILY] != 0, 0.3, 0.0)
+        scores[:, RISK_FACTOR_CATEGORIES] += np.where(X[:, RISK_FACTOR_BIOMARKERS] > RISK_FACTOR_THRESHOLDS, 0.2, 0.0)
         
-        return {biomarker: total / count for biomarker, total in totals.items()}
+        return np.minimum(1.0, scores)
     
-    def _rule_based_risk_assessment(self, category: str, features: np.ndarray) -> float:
-        """Fallback rule-based risk assessment"""
-        age = features[0]
-        bmi = features[4]
-        family_diabetes = features[5]
-        family_heart = features[6]
-        glucose = features[14] if len(features) > 14 else 90
-        cholesterol = features[15] if len(features) > 15 else 180
-        
-        risk_score = 0.1  # Base risk
-        
-        # Age factor
-        if age > 50:
-            risk_score += 0.2
-        elif age > 40:
-            risk_score += 0.1
-        
-        # BMI factor
-        if bmi > 30:
-            risk_score += 0.3
-        elif bmi > 25:
-            risk_score += 0.2
-        
-        # Family history
-        if category == 'diabetes' and family_diabetes:
-            risk_score += 0.3
-        elif category == 'cardiovascular' and family_heart:
-            risk_score += 0.3
-        
-        # Biomarker factors
-        if category == 'diabetes' and glucose > 100:
-            risk_score += 0.2
-        elif category == 'cardiovascular' and cholesterol > 200:
-            risk_score += 0.2
-        
-        return min(1.0, risk_score)
+    def rule_based_risk_contributions(self, X: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Fallback risk split into a base (rows, categories) and feature terms (rows, categories, features)
+        
+        Before the cap at 1.0, each score is the base plus its feature terms.
+        """
+        X = np.asarray(X, dtype=np.float64)
+        bias = np.full((len(X), len(RISK_CATEGORIES)), 0.1)
+        contributions = np.zeros((len(X), len(RISK_CATEGORIES), len(RISK_FEATURES)))
+        
+        # Age and BMI bands apply to every category
+        contributions[:, :, RISK_FEATURE_INDEX['age']] = RISK_AGE_FACTORS[
+            np.searchsorted(RISK_AGE_THRESHOLDS, X[:, RISK_FEATURE_INDEX['age']])][:, np.newaxis]
+        contributions[:, :, RISK_FEATURE_INDEX['bmi']] = RISK_BMI_FACTORS[
+            np.searchsorted(RISK_BMI_THRESHOLDS, X[:, RISK_FEATURE_INDEX['bmi']])][:, np.newaxis]
+        
+        # Family history and biomarker factors, credited to their own features
+        contributions[:, RISK_FACTOR_CATEGORIES, RISK_FACTOR_FAMILY] = np.where(
+            X[:, RISK_FACTOR_FAMILY] != 0, 0.3, 0.0)
+        contributions[:, RISK_FACTOR_CATEGORIES, RISK_FACTOR_BIOMARKERS] = np.where(
+            X[:, RISK_FACTOR_BIOMARKERS] > RISK_FACTOR_THRESHOLDS, 0.2, 0.0)
+        
+        return bias, contributions
     
     def train(self, X: np.ndarray, y: Dict[str, np.ndarray]):
         """Train health risk assessment models"""
@@ -492,6 +663,7 @@ class HealthRiskAssessmentModel:
                     model.fit(X_scaled, target_values)
                     self.risk_models[category] = model
                     logger.info(f"Trained risk model for {category}")
+            self.compiled_forest = CompiledForest.try_compile(self.risk_models, self.scaler)
             
             logger.info("Health risk assessment models trained successfully")
             
@@ -504,6 +676,7 @@ class HealthRiskAssessmentModel:
         model_data = {
             'risk_models': self.risk_models,
             'scaler': self.scaler,
+            'feature_pipeline': self.feature_pipeline,
             'risk_categories': self.risk_categories
         }
         joblib.dump(model_data, filepath)
@@ -512,7 +685,11 @@ class HealthRiskAssessmentModel:
     def load_model(self, filepath: str):
         """Load trained models"""
         model_data = joblib.load(filepath)
+        feature_pipeline = model_data.get('feature_pipeline') or risk_pipeline()
+        check_layout(feature_pipeline, RISK_FEATURES, "Risk model")
+        self.feature_pipeline = feature_pipeline
         self.risk_models = model_data['risk_models']
         self.scaler = model_data['scaler']
         self.risk_categories = model_data['risk_categories']
+        self.compiled_forest = CompiledForest.try_compile(self.risk_models, self.scaler)
         logger.info(f"Risk assessment models loaded from {filepath}")
@@ -0,0 +1,253 @@
+"""
+Columnar nutrition and biomarker histories with vectorized summary statistics
+"""
+
+from functools import lru_cache
+from itertools import chain, repeat
+import math
+from operator import attrgetter
+import numpy as np
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+# Entries in the rolling window (the most recent ones)
+HISTORY_ROLLING_WINDOW = 7
+
+# Entries after which an entry's weight in the exponentially weighted mean halves
+HISTORY_EWMA_HALFLIFE = 7.0
+
+# entry -> entry.get, for mapping history entries without a Python-level loop
+_getter = attrgetter('get')
+
+# Rows of HistorySummary.statistics
+HISTORY_STATISTICS = ('mean', 'rolling_mean', 'ewma', 'slope_per_entry')
+
+
+def _as_float(value) -> float:
+    """A history value as a float, NaN when it is not numeric"""
+    try:
+        return float(value)
+    except (TypeError, ValueError, OverflowError):
+        return math.nan
+
+
+@lru_cache(maxsize=64)
+def _entry_weights(count: int, window: int, halflife: float) -> np.ndarray:
+    """Per-entry weights of every sum the history statistics need, shaped (5, count)
+
+    Rows: all entries, the last `window` entries, the EWMA decay, and the
+    entry position and its square (for the slope).
+    """
+    positions = np.arange(count, dtype=np.float64)
+    weights = np.empty((5, count))
+    weights[0] = 1.0
+    weights[1] = positions >= count - window
+    weights[2] = 0.5 ** ((count - 1 - positions) / halflife)
+    weights[3] = positions
+    weights[4] = positions * positions
+    weights.flags.writeable = False
+    return weights
+
+
+def _weighted_statistics(value_sums: np.ndarray, weight_sums: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """The `statistics` rows from (5, names) sums weighted like `_entry_weights` rows"""
+    numerators = value_sums[:4].copy()
+    numerators[3] = weight_sums[0] * value_sums[3] - weight_sums[3] * value_sums[0]
+    denominators = weight_sums[:4].copy()
+    denominators[3] = weight_sums[0] * weight_sums[4] - weight_sums[3] ** 2
+    # A single value has no slope (the denominator is then zero up to rounding)
+    denominators[3, counts < 2] = 0.0
+    return np.divide(numerators, denominators, out=np.full(numerators.shape, np.nan),
+                     where=denominators > 0)
+
+
+def _trend_table(names: Tuple[str, ...], counts: np.ndarray,
+                 statistics: np.ndarray) -> Dict[str, Dict[str, Optional[float]]]:
+    """Statistics per present column for responses, with the number of values (None if undefined)"""
+    columns = np.flatnonzero(counts)
+    rows = statistics[:, columns].T.tolist()
+    return {
+        names[column]: {
+            'entries': count,
+            **{key: None if math.isnan(value) else value for key, value in zip(HISTORY_STATISTICS, row)}
+        }
+        for column, count, row in zip(columns.tolist(), counts[columns].astype(int).tolist(), rows)
+    }
+
+
+class HistorySummary:
+    """A history (name -> value entries, oldest first) as one (entries, names) matrix
+
+    The matrix is built with a single pass over the entries; every
+    statistic is then a NumPy reduction over its columns, so a few thousand
+    entries cost little more than a few. Missing and non-numeric values
+    (anything `float` rejects) are NaN. Entries are taken as evenly
+    spaced, so slopes are per entry.
+    """
+
+    __slots__ = ('names', 'values', 'observed', 'filled', 'counts')
+
+    def __init__(self, names: Sequence[str], values: np.ndarray):
+        self.names = tuple(names)
+        self.values = values
+        self.observed = ~np.isnan(values)
+        # Missing values as zeros, so column sums skip them
+        self.filled = np.where(self.observed, values, 0.0)
+        self.counts = self.observed.sum(axis=0)
+
+    @classmethod
+    def from_entries(cls, history: Optional[List[Mapping]], names: Sequence[str]) -> 'HistorySummary':
+        """Summary of `names` over history entries; other keys are ignored"""
+        if not history:
+            return cls(names, np.empty((0, len(names))))
+
+        # Every entry's values straight into one float buffer (None becomes NaN)
+        values = chain.from_iterable(map(map, map(_getter, history), repeat(names)))
+        try:
+            matrix = np.fromiter(values, np.float64, len(history) * len(names))
+        except (TypeError, ValueError, OverflowError):
+            matrix = np.array([[_as_float(entry.get(name)) for name in names] for entry in history])
+        return cls(names, matrix.reshape(len(history), len(names)))
+
+    @property
+    def count(self) -> int:
+        return len(self.values)
+
+    def means(self, defaults: np.ndarray) -> np.ndarray:
+        """Mean of each column over all entries (missing values count as zero); `defaults` where never present"""
+        if not self.count:
+            return np.array(defaults, dtype=np.float64)
+        return np.where(self.counts > 0, self.filled.sum(axis=0) / self.count, defaults)
+
+    def statistics(self, window: int = HISTORY_ROLLING_WINDOW,
+                   halflife: float = HISTORY_EWMA_HALFLIFE) -> np.ndarray:
+        """Mean, rolling mean, EWMA and slope of the values present in each column, shaped (4, names)
+
+        The rolling mean covers the last `window` entries; the EWMA halves
+        an entry's weight every `halflife` entries; the slope is the
+        least-squares trend per entry. Undefined statistics (no values, or
+        fewer than two for the slope) are NaN.
+        """
+        # Weighted sums of the values present, and of the indicator of a value being present
+        weights = _entry_weights(self.count, max(1, window), halflife)
+        return _weighted_statistics(weights @ self.filled, weights @ self.observed, self.counts)
+
+    def trends(self, window: int = HISTORY_ROLLING_WINDOW,
+               halflife: float = HISTORY_EWMA_HALFLIFE) -> Dict[str, Dict[str, Optional[float]]]:
+        """`statistics` per present column for responses, with the number of values (None if undefined)"""
+        if not self.counts.any():
+            return {}
+        return _trend_table(self.names, self.counts, self.statistics(window, halflife))
+
+
+class RunningHistory:
+    """The sums behind HistorySummary.statistics, maintained entry by entry
+
+    Appending an entry, or replacing one in place, updates the weighted
+    sums in O(names) whatever the history length; only the last `window`
+    entries are kept (to drop the oldest from the rolling window). The
+    state is a few small arrays, so it can be persisted between requests
+    (see `to_state` / `from_state`) instead of the whole history. Results
+    match HistorySummary over the same entries up to rounding.
+    """
+
+    __slots__ = ('names', 'window', 'halflife', 'count', 'value_sums', 'weight_sums', 'recent')
+
+    def __init__(self, names: Sequence[str], window: int = HISTORY_ROLLING_WINDOW,
+                 halflife: float = HISTORY_EWMA_HALFLIFE):
+        self.names = tuple(names)
+        self.window = max(1, window)
+        self.halflife = halflife
+        self.count = 0
+        # Rows weighted like _entry_weights: all, window, EWMA decay, position, position squared
+        self.value_sums = np.zeros((5, len(self.names)))
+        self.weight_sums = np.zeros((5, len(self.names)))
+        self.recent = np.empty((0, len(self.names)))
+
+    @classmethod
+    def from_summary(cls, summary: HistorySummary, window: int = HISTORY_ROLLING_WINDOW,
+                     halflife: float = HISTORY_EWMA_HALFLIFE) -> 'RunningHistory':
+        """Running sums of a whole history at once (e.g. after an entry was inserted or deleted)"""
+        running = cls(summary.names, window, halflife)
+        weights = _entry_weights(summary.count, running.window, halflife)
+        running.count = summary.count
+        running.value_sums = weights @ summary.filled
+        running.weight_sums = weights @ summary.observed
+        running.recent = summary.values[-running.window:].copy()
+        return running
+
+    @property
+    def counts(self) -> np.ndarray:
+        """Number of values present in each column"""
+        return np.rint(self.weight_sums[0])
+
+    def _add(self, weights: np.ndarray, row: np.ndarray, sign: float):
+        observed = ~np.isnan(row)
+        self.value_sums += sign * np.outer(weights, np.where(observed, row, 0.0))
+        self.weight_sums += sign * np.outer(weights, observed)
+
+    def append(self, row: np.ndarray):
+        """Add the newest entry (values in `names` order, NaN where missing)"""
+        row = np.asarray(row, dtype=np.float64)
+        # Older entries age by one: decay the EWMA sums and drop the oldest from the window
+        decay = 0.5 ** (1 / self.halflife)
+        self.value_sums[2] *= decay
+        self.weight_sums[2] *= decay
+        if len(self.recent) == self.window:
+            self._add(np.array([0.0, 1.0, 0.0, 0.0, 0.0]), self.recent[0], -1)
+            self.recent = self.recent[1:]
+
+        position = float(self.count)
+        self._add(np.array([1.0, 1.0, 1.0, position, position * position]), row, 1)
+        self.recent = np.vstack([self.recent, row])
+        self.count += 1
+
+    def replace(self, position: int, old_row: np.ndarray, new_row: np.ndarray):
+        """Swap the entry at `position` (0 = oldest), whose values were `old_row`, for `new_row`"""
+        old_row = np.asarray(old_row, dtype=np.float64)
+        new_row = np.asarray(new_row, dtype=np.float64)
+        age = self.count - 1 - position
+        weights = np.array([1.0, 1.0 if age < self.window else 0.0, 0.5 ** (age / self.halflife),
+                            position, position * position])
+        self._add(weights, old_row, -1)
+        self._add(weights, new_row, 1)
+        if age < len(self.recent):
+            self.recent[len(self.recent) - 1 - age] = new_row
+
+    def latest(self) -> np.ndarray:
+        """Values of the newest entry (NaN where missing, all NaN without entries)"""
+        if not len(self.recent):
+            return np.full(len(self.names), np.nan)
+        return self.recent[-1].copy()
+
+    def means(self, defaults: np.ndarray) -> np.ndarray:
+        """Same as HistorySummary.means"""
+        if not self.count:
+            return np.array(defaults, dtype=np.float64)
+        return np.where(self.counts > 0, self.value_sums[0] / self.count, defaults)
+
+    def statistics(self) -> np.ndarray:
+        """Same as HistorySummary.statistics, with this history's window and half-life"""
+        return _weighted_statistics(self.value_sums, self.weight_sums, self.counts)
+
+    def trends(self) -> Dict[str, Dict[str, Optional[float]]]:
+        """Same as HistorySummary.trends"""
+        counts = self.counts
+        if not counts.any():
+            return {}
+        return _trend_table(self.names, counts, self.statistics())
+
+    def to_state(self) -> Tuple[int, bytes, bytes]:
+        """(count, sums, recent entries) for storage; the names, window and half-life are not included"""
+        sums = np.stack([self.value_sums, self.weight_sums])
+        return self.count, sums.tobytes(), self.recent.tobytes()
+
+    @classmethod
+    def from_state(cls, names: Sequence[str], count: int, sums: bytes, recent: bytes,
+                   window: int = HISTORY_ROLLING_WINDOW, halflife: float = HISTORY_EWMA_HALFLIFE) -> 'RunningHistory':
+        """Restore a history saved with `to_state`"""
+        running = cls(names, window, halflife)
+        running.count = count
+        sums = np.frombuffer(sums, dtype=np.float64).reshape(2, 5, len(running.names))
+        running.value_sums, running.weight_sums = sums[0].copy(), sums[1].copy()
+        running.recent = np.frombuffer(recent, dtype=np.float64).reshape(-1, len(running.names)).copy()
+        return running
@@ -0,0 +1,127 @@
+"""
+Population percentile ranks of nutrient intakes and biomarker values
+"""
+
+from typing import Dict, Mapping, Optional, Sequence
+import logging
+
+import numpy as np
+import pandas as pd
+
+from app.models.history import _as_float
+
+logger = logging.getLogger(__name__)
+
+# Quantiles kept per column: 0.1 percentile steps
+PERCENTILE_GRID_SIZE = 1001
+
+
+class PercentileIndex:
+    """Quantile sketch of a reference cohort, grouped (e.g. 'nutrients', 'biomarkers')
+
+    Every column is reduced to `grid_size` evenly spaced quantiles of its
+    values, stacked into one (columns, grid_size) matrix, so the index is
+    the same size whatever the cohort size. `lookup` ranks the values of
+    a request in every group with one vectorized search over the matrix:
+    the percentile is the share of the cohort below the value,
+    interpolated between neighbouring quantiles.
+    """
+
+    def __init__(self, groups: Mapping[str, Sequence[str]], quantiles: np.ndarray, cohort_size: int):
+        self.groups = {group: tuple(columns) for group, columns in groups.items()}
+        self.quantiles = np.asarray(quantiles, dtype=np.float64)
+        self.cohort_size = cohort_size
+        # Rows of each group's columns in `quantiles`
+        self._rows: Dict[str, slice] = {}
+        start = 0
+        for group, columns in self.groups.items():
+            self._rows[group] = slice(start, start + len(columns))
+            start += len(columns)
+        if start != len(self.quantiles):
+            raise ValueError(f"{start} columns but {len(self.quantiles)} quantile rows")
+
+    @classmethod
+    def from_cohort(cls, cohort: pd.DataFrame, groups: Mapping[str, Sequence[str]],
+                    grid_size: int = PERCENTILE_GRID_SIZE) -> 'PercentileIndex':
+        """Index of the `groups` columns found in the cohort (missing values are skipped)"""
+        present = {group: [column for column in columns if column in cohort.columns]
+                   for group, columns in groups.items()}
+        names = [column for columns in present.values() for column in columns]
+        values = cohort[names].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+
+        # Columns without any value cannot be ranked against
+        observed = ~np.isnan(values).all(axis=0) if len(values) else np.zeros(len(names), dtype=bool)
+        keep = dict(zip(names, observed.tolist()))
+        present = {group: [column for column in columns if keep[column]] for group, columns in present.items()}
+        values = values[:, observed]
+        if values.shape[1]:
+            quantiles = np.nanquantile(values, np.linspace(0.0, 1.0, grid_size), axis=0).T
+        else:
+            quantiles = np.empty((0, grid_size))
+        return cls(present, quantiles, len(cohort))
+
+    @property
+    def grid_size(self) -> int:
+        return self.quantiles.shape[1]
+
+    def ranks(self, values: np.ndarray) -> np.ndarray:
+        """Percentile (0-100) of each value against its quantile row; NaN for NaN values"""
+        values = np.asarray(values, dtype=np.float64)
+        last = self.grid_size - 1
+        # Quantiles strictly below each value, then the pair of quantiles around it
+        upper = np.clip((self.quantiles < values[:, np.newaxis]).sum(axis=1), 1, last)
+        rows = np.arange(len(values))
+        low, high = self.quantiles[rows, upper - 1], self.quantiles[rows, upper]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fraction = np.where(high > low, (values - low) / (high - low), values > low)
+        percentiles = (upper - 1 + np.clip(fraction, 0.0, 1.0)) / last * 100.0
+        percentiles[np.isnan(values)] = np.nan
+        return percentiles
+
+    def lookup(self, values: Mapping[str, Optional[Mapping]]) -> Dict[str, Dict[str, float]]:
+        """Percentiles of the given values per group, e.g. {'nutrients': {'fiber': 31.4}}
+
+        `values` maps groups to name -> value mappings; names the index does
+        not cover and non-numeric values are left out (a group the index
+        lacks comes back empty).
+        """
+        row_values = np.full(len(self.quantiles), np.nan)
+        for group, group_values in values.items():
+            if group in self.groups and group_values:
+                row_values[self._rows[group]] = [_as_float(group_values.get(column))
+                                                 for column in self.groups[group]]
+        percentiles = self.ranks(row_values).tolist()
+
+        return {
+            group: {
+                column: percentile
+                for column, percentile in zip(self.groups.get(group, ()), percentiles[self._rows.get(group, slice(0))])
+                if percentile == percentile
+            }
+            for group in values
+        }
+
+    def save(self, path: str):
+        """Write the index as an .npz file"""
+        groups = [group for group, columns in self.groups.items() for _ in columns]
+        columns = [column for columns in self.groups.values() for column in columns]
+        np.savez(path, quantiles=self.quantiles, groups=np.array(groups, dtype=str),
+                 columns=np.array(columns, dtype=str), group_order=np.array(list(self.groups), dtype=str),
+                 cohort_size=np.array(self.cohort_size))
+        logger.info(f"Percentile index of {len(columns)} columns saved to {path}")
+
+    @classmethod
+    def load(cls, path: str) -> 'PercentileIndex':
+        """Read an index written by `save`"""
+        with np.load(path, allow_pickle=False) as data:
+            groups = {group: [] for group in data['group_order'].tolist()}
+            for group, column in zip(data['groups'].tolist(), data['columns'].tolist()):
+                groups[group].append(column)
+            return cls(groups, data['quantiles'], int(data['cohort_size']))
+
+    def stats(self) -> Dict:
+        return {
+            'cohort_size': self.cohort_size,
+            'grid_size': self.grid_size,
+            'columns': {group: len(columns) for group, columns in self.groups.items()}
+        }
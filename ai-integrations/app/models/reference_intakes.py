@@ -0,0 +1,148 @@
+"""
+Precomputed daily reference intake tables by sex, age band, pregnancy and activity level
+"""
+
+from bisect import bisect_left
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from app.models.schema import NUTRIENTS, NutrientVector
+
+SEXES = ('male', 'female')
+ACTIVITY_LEVELS = ('sedentary', 'light', 'moderate', 'active', 'very_active')
+
+# Age bands by inclusive upper bound; the last band is open-ended
+AGE_BAND_UPPER_BOUNDS = (30, 50, 70)
+AGE_BANDS = ('0-30', '31-50', '51-70', '71+')
+
+# Base daily requirements for adults by sex
+BASE_REQUIREMENTS = {
+    'male': {
+        'protein': 56,  # grams per day
+        'carbs': 300,  # grams per day
+        'fat': 70,  # grams per day
+        'fiber': 38,  # grams per day
+        'vitamin_c': 90,  # mg per day
+        'vitamin_d': 20,  # mcg per day
+        'calcium': 1000,  # mg per day
+        'iron': 8,  # mg per day
+    },
+    'female': {
+        'protein': 46,
+        'carbs': 250,
+        'fat': 60,
+        'fiber': 25,
+        'vitamin_c': 75,
+        'vitamin_d': 20,
+        'calcium': 1000,
+        'iron': 18,
+    },
+}
+
+# Multipliers applied to the base requirements in each age band (over 50: more vitamin D and calcium)
+AGE_BAND_MULTIPLIERS = {
+    '0-30': {},
+    '31-50': {},
+    '51-70': {'vitamin_d': 1.5, 'calcium': 1.2},
+    '71+': {'vitamin_d': 1.5, 'calcium': 1.2},
+}
+
+# Requirements replaced during pregnancy
+PREGNANCY_REQUIREMENTS = {
+    'protein': 71,
+    'fiber': 28,
+    'vitamin_c': 85,
+    'iron': 27,
+}
+PREGNANCY_CONDITIONS = ('pregnancy', 'pregnant')
+
+# Energy-dependent macronutrient requirements scaled by activity level
+ACTIVITY_MULTIPLIERS = {
+    'sedentary': 1.0,
+    'light': 1.1,
+    'moderate': 1.2,
+    'active': 1.35,
+    'very_active': 1.5,
+}
+ACTIVITY_SCALED_NUTRIENTS = ('carbs', 'fat')
+
+# Simplified sex-independent intake references for micronutrient analysis
+GENERAL_REQUIREMENTS = {
+    'fiber': 30,
+    'vitamin_c': 90,
+    'vitamin_d': 20,
+    'calcium': 1000,
+    'iron': 15,
+    'sodium': 2000,
+}
+
+
+class ReferenceIntakeTable:
+    """Requirement vectors for every sex, age band, pregnancy and activity combination
+
+    The whole table is built once up front, so resolving a request's
+    requirements is a single indexed lookup into a read-only array.
+    """
+
+    def __init__(self):
+        self._sex_index = {sex: i for i, sex in enumerate(SEXES)}
+        self._activity_index = {level: i for i, level in enumerate(ACTIVITY_LEVELS)}
+        self.table = self._build_table()
+        self.general = NutrientVector.from_mapping(GENERAL_REQUIREMENTS)
+
+    @staticmethod
+    def _build_table() -> np.ndarray:
+        """Requirements array shaped (sex, age band, pregnant, activity level, nutrient)"""
+        table = np.zeros((len(SEXES), len(AGE_BANDS), 2, len(ACTIVITY_LEVELS), len(NUTRIENTS)))
+
+        for s, sex in enumerate(SEXES):
+            base = NutrientVector.from_mapping(BASE_REQUIREMENTS[sex])
+            for a, band in enumerate(AGE_BANDS):
+                requirements = base.copy()
+                for nutrient, multiplier in AGE_BAND_MULTIPLIERS[band].items():
+                    requirements.values[requirements.index[nutrient]] *= multiplier
+
+                for pregnant in (0, 1):
+                    row = requirements.copy()
+                    # Only female rows carry pregnancy requirements
+                    if pregnant and sex == 'female':
+                        for nutrient, value in PREGNANCY_REQUIREMENTS.items():
+                            row.values[row.index[nutrient]] = value
+
+                    for l, level in enumerate(ACTIVITY_LEVELS):
+                        table[s, a, pregnant, l] = row.values
+                        for nutrient in ACTIVITY_SCALED_NUTRIENTS:
+                            table[s, a, pregnant, l, row.index[nutrient]] *= ACTIVITY_MULTIPLIERS[level]
+
+        table.flags.writeable = False
+        return table
+
+    @staticmethod
+    def age_band(age: float) -> int:
+        """Age band position for an age (bands are closed at their upper bound)"""
+        return bisect_left(AGE_BAND_UPPER_BOUNDS, age)
+
+    @staticmethod
+    def is_pregnant(medical_history: Optional[List[str]]) -> bool:
+        """Whether a medical history records a current pregnancy"""
+        return any(condition in PREGNANCY_CONDITIONS for condition in medical_history or ())
+
+    def lookup(self, sex: str, age: float, pregnant: bool = False,
+               activity_level: Optional[str] = None) -> NutrientVector:
+        """Read-only requirement vector for one profile (unknown activity levels count as sedentary)"""
+        return NutrientVector(self.table[
+            self._sex_index[sex],
+            self.age_band(age),
+            int(pregnant),
+            self._activity_index.get(activity_level, 0)
+        ])
+
+    def for_profile(self, user_profile: Dict) -> NutrientVector:
+        """Requirement vector for a user profile"""
+        return self.lookup(
+            user_profile.get('sex', 'male'),
+            user_profile.get('age', 30),
+            self.is_pregnant(user_profile.get('medical_history')),
+            user_profile.get('activity_level')
+        )
@@ -0,0 +1,182 @@
+"""
+Fixed nutrient, biomarker and feature schemas with array-backed vectors
+"""
+
+import numpy as np
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+# Nutrients tracked in daily totals, in vector order
+NUTRIENTS: Tuple[str, ...] = (
+    'protein', 'carbs', 'fat', 'fiber',
+    'vitamin_c', 'vitamin_d', 'calcium', 'iron',
+    'sodium', 'sugar', 'calories'
+)
+NUTRIENT_INDEX: Dict[str, int] = {name: i for i, name in enumerate(NUTRIENTS)}
+(PROTEIN, CARBS, FAT, FIBER,
+ VITAMIN_C, VITAMIN_D, CALCIUM, IRON,
+ SODIUM, SUGAR, CALORIES) = range(len(NUTRIENTS))
+
+# Biomarkers predicted and tracked, in vector order
+BIOMARKERS: Tuple[str, ...] = (
+    'glucose', 'cholesterol', 'blood_pressure_systolic', 'blood_pressure_diastolic',
+    'hba1c', 'triglycerides', 'hdl', 'ldl'
+)
+BIOMARKER_INDEX: Dict[str, int] = {name: i for i, name in enumerate(BIOMARKERS)}
+(GLUCOSE, CHOLESTEROL, BP_SYSTOLIC, BP_DIASTOLIC,
+ HBA1C, TRIGLYCERIDES, HDL, LDL) = range(len(BIOMARKERS))
+
+# Population-typical values used when a biomarker is missing
+BIOMARKER_DEFAULTS = np.array([90, 180, 110, 70, 5.5, 100, 50, 100], dtype=np.float64)
+
+# Conditions scored by the health risk model, in report order
+RISK_CATEGORIES: Tuple[str, ...] = (
+    'diabetes', 'cardiovascular', 'hypertension', 'obesity',
+    'osteoporosis', 'cancer', 'metabolic_syndrome'
+)
+
+# Nutrients fed to the biomarker and risk models, as positions in NUTRIENTS
+BIOMARKER_MODEL_NUTRIENTS = np.array([PROTEIN, CARBS, FAT, FIBER, SODIUM, SUGAR])
+RISK_MODEL_NUTRIENTS = np.array([PROTEIN, CARBS, FAT, FIBER, SODIUM])
+RISK_MODEL_BIOMARKERS = np.array([GLUCOSE, CHOLESTEROL, BP_SYSTOLIC, BP_DIASTOLIC])
+
+# Feature layout of BiomarkerPredictionModel
+BIOMARKER_FEATURES: Tuple[str, ...] = (
+    ('age', 'weight', 'height', 'sex_male') +
+    tuple(NUTRIENTS[i] for i in BIOMARKER_MODEL_NUTRIENTS) +
+    BIOMARKERS
+)
+BIOMARKER_FEATURE_INDEX: Dict[str, int] = {name: i for i, name in enumerate(BIOMARKER_FEATURES)}
+BIOMARKER_FEATURE_NUTRIENTS = slice(4, 4 + len(BIOMARKER_MODEL_NUTRIENTS))
+BIOMARKER_FEATURE_BIOMARKERS = slice(BIOMARKER_FEATURE_NUTRIENTS.stop, len(BIOMARKER_FEATURES))
+BIOMARKER_MODEL_NUTRIENT_NAMES = BIOMARKER_FEATURES[BIOMARKER_FEATURE_NUTRIENTS]
+
+# Family history conditions encoded as binary risk features
+FAMILY_HISTORY_CONDITIONS: Tuple[str, ...] = ('diabetes', 'heart_disease', 'cancer', 'hypertension')
+
+# Feature layout of HealthRiskAssessmentModel
+RISK_FEATURES: Tuple[str, ...] = (
+    ('age', 'weight', 'height', 'sex_male', 'bmi') +
+    tuple(f'family_{condition}' for condition in FAMILY_HISTORY_CONDITIONS) +
+    tuple(NUTRIENTS[i] for i in RISK_MODEL_NUTRIENTS) +
+    tuple(BIOMARKERS[i] for i in RISK_MODEL_BIOMARKERS)
+)
+RISK_FEATURE_INDEX: Dict[str, int] = {name: i for i, name in enumerate(RISK_FEATURES)}
+RISK_FEATURE_FAMILY = slice(5, 5 + len(FAMILY_HISTORY_CONDITIONS))
+RISK_FEATURE_NUTRIENTS = slice(RISK_FEATURE_FAMILY.stop, RISK_FEATURE_FAMILY.stop + len(RISK_MODEL_NUTRIENTS))
+RISK_FEATURE_BIOMARKERS = slice(RISK_FEATURE_NUTRIENTS.stop, len(RISK_FEATURES))
+RISK_MODEL_NUTRIENT_NAMES = RISK_FEATURES[RISK_FEATURE_NUTRIENTS]
+RISK_MODEL_BIOMARKER_NAMES = RISK_FEATURES[RISK_FEATURE_BIOMARKERS]
+
+
+class SchemaVector:
+    """Fixed-layout float64 vector addressed by schema position or by name"""
+
+    names: Tuple[str, ...] = ()
+    index: Dict[str, int] = {}
+    defaults: np.ndarray = np.zeros(0)
+    default_list: list = []
+    default_map: Dict[str, float] = {}
+
+    __slots__ = ('values',)
+
+    def __init__(self, values: Optional[np.ndarray] = None):
+        if values is None:
+            self.values = self.defaults.copy()
+        else:
+            self.values = np.asarray(values, dtype=np.float64)
+
+    @classmethod
+    def from_mapping(cls, mapping: Optional[Mapping]) -> 'SchemaVector':
+        """Build a vector from a name -> value mapping; missing or empty values take the defaults"""
+        if isinstance(mapping, cls):
+            return mapping
+
+        if not mapping:
+            return cls(cls.defaults.copy())
+
+        values = [
+            default if value is None or value == '' else value
+            for value, default in zip(map(mapping.get, cls.names), cls.default_list)
+        ]
+        return cls(np.array(values, dtype=np.float64))
+
+    @classmethod
+    def gather(cls, data: Optional[Mapping], names: Optional[Sequence[str]] = None) -> List[float]:
+        """Values for `names` (default: the whole schema) from a vector or a name -> value mapping"""
+        names = cls.names if names is None else names
+        if isinstance(data, cls):
+            index = cls.index
+            return data.values[[index[name] for name in names]].tolist()
+
+        default_map = cls.default_map
+        if not data:
+            return [default_map[name] for name in names]
+        get = data.get
+        return [get(name, default_map[name]) for name in names]
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return float(self.values[self.index[key]])
+        return self.values[key]
+
+    def get(self, name: str, default: float = 0.0) -> float:
+        """Dict-style lookup by name"""
+        position = self.index.get(name)
+        return float(self.values[position]) if position is not None else default
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __add__(self, other: 'SchemaVector') -> 'SchemaVector':
+        return type(self)(self.values + other.values)
+
+    def __sub__(self, other: 'SchemaVector') -> 'SchemaVector':
+        return type(self)(self.values - other.values)
+
+    def __iadd__(self, other: 'SchemaVector') -> 'SchemaVector':
+        self.values += other.values
+        return self
+
+    def __isub__(self, other: 'SchemaVector') -> 'SchemaVector':
+        self.values -= other.values
+        return self
+
+    def __eq__(self, other) -> bool:
+        return type(self) is type(other) and np.array_equal(self.values, other.values)
+
+    def copy(self) -> 'SchemaVector':
+        return type(self)(self.values.copy())
+
+    def to_dict(self) -> Dict[str, float]:
+        """Plain name -> float dict (for JSON responses)"""
+        return dict(zip(self.names, self.values.tolist()))
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()})"
+
+
+class NutrientVector(SchemaVector):
+    """Daily nutrient totals in NUTRIENTS order (missing nutrients are zero)"""
+
+    names = NUTRIENTS
+    index = NUTRIENT_INDEX
+    defaults = np.zeros(len(NUTRIENTS))
+    default_list = defaults.tolist()
+    default_map = dict(zip(names, default_list))
+
+    __slots__ = ()
+
+
+class BiomarkerVector(SchemaVector):
+    """Biomarker values in BIOMARKERS order (missing biomarkers take population defaults)"""
+
+    names = BIOMARKERS
+    index = BIOMARKER_INDEX
+    defaults = BIOMARKER_DEFAULTS
+    default_list = BIOMARKER_DEFAULTS.tolist()
+    default_map = dict(zip(names, default_list))
+
+    __slots__ = ()
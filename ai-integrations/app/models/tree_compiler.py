@@ -0,0 +1,319 @@
+"""
+Flattened tree ensembles evaluated in one vectorized traversal
+"""
+
+from typing import Dict, List, Optional, Tuple
+import logging
+
+import numpy as np
+from sklearn.dummy import DummyClassifier, DummyRegressor
+from sklearn.ensemble import (
+    ExtraTreesRegressor, GradientBoostingClassifier, GradientBoostingRegressor, RandomForestRegressor
+)
+
+logger = logging.getLogger(__name__)
+
+# Two-sided normal quantile used for ensemble confidence intervals
+DEFAULT_INTERVAL_Z = 1.96  # ~95%
+
+
+def float32_thresholds(thresholds: np.ndarray) -> np.ndarray:
+    """Float64 split thresholds as the largest float32 values not above them
+
+    For any float32 x, `x <= t` holds exactly when `x <= float32_thresholds(t)`
+    does, so float32 comparisons reproduce sklearn's float64 ones.
+    """
+    rounded = thresholds.astype(np.float32)
+    above = rounded.astype(np.float64) > thresholds
+    rounded[above] = np.nextafter(rounded[above], np.float32(-np.inf))
+    return rounded
+
+
+def _scaled_split_inputs(x: np.ndarray, mean: np.ndarray, scale: np.ndarray, dtype) -> np.ndarray:
+    """What sklearn trees compare for unscaled `dtype` values after StandardScaler.transform
+
+    The scaler subtracts and divides in place, so float32 rows are rounded
+    back to float32 after each step; the trees then cast to float32.
+    """
+    if dtype == np.float32:
+        return ((x - mean).astype(np.float32) / scale).astype(np.float32)
+    return ((x - mean) / scale).astype(np.float32)
+
+
+def unscaled_thresholds(thresholds32: np.ndarray, mean: np.ndarray, scale: np.ndarray, dtype) -> np.ndarray:
+    """The largest unscaled `dtype` value each split sends left
+
+    `thresholds32`, `mean` and `scale` are per split (see float32_thresholds
+    and StandardScaler). An unscaled x goes left exactly when x <= the
+    result, the same as its scaled value would: scaling and rounding are
+    monotone, so the split is a cut in unscaled values too. The cut is
+    estimated from the scaled one and moved to the exact value by a few
+    steps of one representable value.
+    """
+    def goes_left(x, splits):
+        return _scaled_split_inputs(x, mean[splits], scale[splits], dtype) <= thresholds32[splits]
+
+    # Scaled values round down to a threshold up to halfway to the next float32 above it
+    upper = np.nextafter(thresholds32, np.float32(np.inf)).astype(np.float64)
+    with np.errstate(over='ignore', invalid='ignore'):
+        cut = ((thresholds32.astype(np.float64) + upper) / 2 * scale + mean).astype(dtype)
+
+    # Step down until the split sends the cut left, then up while the next value still goes left
+    splits = np.flatnonzero(~goes_left(cut, slice(None)) & (cut > -np.inf))
+    while splits.size:
+        cut[splits] = np.nextafter(cut[splits], dtype(-np.inf))
+        splits = splits[~goes_left(cut[splits], splits) & (cut[splits] > -np.inf)]
+    splits = np.flatnonzero(cut < np.inf)
+    while splits.size:
+        following = np.nextafter(cut[splits], dtype(np.inf))
+        left = goes_left(following, splits)
+        cut[splits[left]] = following[left]
+        splits = splits[left & (following < np.inf)]
+    return cut
+
+
+class CompiledForest:
+    """Several fitted tree ensembles flattened into one node array
+
+    Every tree of every ensemble is stored in shared `feature`, `threshold`,
+    `left`, `right` and `value` arrays; leaves point back at themselves, so
+    walking all trees for all rows is `max_depth` rounds of fancy indexing
+    instead of one `predict` call per estimator. Each named output keeps the
+    arithmetic of its sklearn estimator (same float32 input casting, same
+    summation order), so `predict` matches `estimator.predict` exactly.
+    Splits are evaluated entirely in float32: each float64 threshold is
+    rounded down to the nearest float32, which sends every float32 input
+    the same way as the float64 comparison sklearn makes, with half the
+    memory traffic.
+
+    Ensembles trained on StandardScaler output can have the scaler folded
+    into their thresholds (`fold_scaler`); the forest then takes unscaled
+    rows, float64 or float32, and routes them exactly as the scaled rows.
+
+    Supported ensembles are averaging forests (RandomForestRegressor,
+    ExtraTreesRegressor), GradientBoostingRegressor and binary
+    GradientBoostingClassifier (whose output is the raw log-odds); the
+    spread between member trees is only meaningful for the averaging ones.
+
+    `contributions` explains predictions by decision path (Saabas): every
+    split a row passes through credits its feature with the change in node
+    value, so the bias plus the per-feature contributions add up to the
+    prediction.
+    """
+
+    def __init__(self, models: Dict[str, object]):
+        features, thresholds, lefts, rights, values, weights, roots = [], [], [], [], [], [], []
+        tree_outputs, tree_scales = [], []
+        # name -> (first tree, tree count, tree weight, base offset, divisor, averaging)
+        self.outputs: Dict[str, Tuple[int, int, float, float, float, bool]] = {}
+        self.max_depth = 0
+        self.n_features = 0
+        node_count = 0
+
+        for name, model in models.items():
+            trees, weight, base, divisor, averaging = self._ensemble_layout(model)
+            self.outputs[name] = (len(roots), len(trees), weight, base, divisor, averaging)
+            self.n_features = max(self.n_features, model.n_features_in_)
+            tree_outputs += [len(self.outputs) - 1] * len(trees)
+            tree_scales += [weight / divisor] * len(trees)
+
+            for tree in trees:
+                tree_ = tree.tree_
+                if tree_.n_outputs != 1 or tree_.value.shape[2] != 1:
+                    raise ValueError(f"{name}: only single-output regression trees can be compiled")
+
+                is_leaf = tree_.children_left == -1
+                own_nodes = np.arange(tree_.node_count) + node_count
+                roots.append(node_count)
+                features.append(np.where(is_leaf, 0, tree_.feature))
+                thresholds.append(tree_.threshold)
+                lefts.append(np.where(is_leaf, own_nodes, tree_.children_left + node_count))
+                rights.append(np.where(is_leaf, own_nodes, tree_.children_right + node_count))
+                values.append(tree_.value[:, 0, 0])
+                weights.append(tree_.weighted_n_node_samples)
+                self.max_depth = max(self.max_depth, tree_.max_depth)
+                node_count += tree_.node_count
+
+        self.feature = np.concatenate(features).astype(np.intp)
+        self.threshold = np.concatenate(thresholds)
+        self.threshold32 = float32_thresholds(self.threshold)
+        self.scaler_folded = False
+        self.left = np.concatenate(lefts).astype(np.intp)
+        self.right = np.concatenate(rights).astype(np.intp)
+        self.value = np.concatenate(values)
+        self.roots = np.array(roots, dtype=np.intp)
+        self.names = list(self.outputs)
+        self.tree_output = np.array(tree_outputs, dtype=np.intp)
+        self.tree_scale = np.array(tree_scales)
+        self.node_value = self._path_node_values(np.concatenate(weights))
+
+    def _path_node_values(self, node_weights: np.ndarray) -> np.ndarray:
+        """Node values for path explanations: leaf values, and sample-weighted child means above them
+
+        Boosted trees store the pre-line-search fit at internal nodes, so
+        internal values are rebuilt from the leaves, level by level, for
+        every tree at once.
+        """
+        internal = np.flatnonzero(self.left != np.arange(len(self.left)))
+        depth = np.zeros(len(self.left), dtype=np.intp)
+        for _ in range(self.max_depth):
+            depth[self.left[internal]] = depth[internal] + 1
+            depth[self.right[internal]] = depth[internal] + 1
+
+        node_value = self.value.copy()
+        for level in range(self.max_depth - 1, -1, -1):
+            nodes = internal[depth[internal] == level]
+            left, right = self.left[nodes], self.right[nodes]
+            left_weight, right_weight = node_weights[left], node_weights[right]
+            node_value[nodes] = ((left_weight * node_value[left] + right_weight * node_value[right]) /
+                                 (left_weight + right_weight))
+        return node_value
+
+    @staticmethod
+    def _ensemble_layout(model) -> Tuple[List, float, float, float, bool]:
+        """Trees plus how their outputs combine: (trees, weight, base, divisor, averaging)"""
+        if isinstance(model, (RandomForestRegressor, ExtraTreesRegressor)):
+            return list(model.estimators_), 1.0, 0.0, float(len(model.estimators_)), True
+        if isinstance(model, GradientBoostingRegressor):
+            if isinstance(model.init_, str) and model.init_ == 'zero':
+                base = 0.0
+            elif isinstance(model.init_, DummyRegressor):
+                # A constant initial estimate, the same for every row
+                base = float(model._raw_predict_init(np.zeros((1, model.n_features_in_)))[0, 0])
+            else:
+                raise TypeError(f"Cannot compile boosting with a {type(model.init_).__name__} init estimator")
+            return list(model.estimators_[:, 0]), float(model.learning_rate), base, 1.0, False
+        if isinstance(model, GradientBoostingClassifier):
+            if model.estimators_.shape[1] != 1:
+                raise TypeError("Cannot compile multiclass boosting")
+            if not isinstance(model.init_, DummyClassifier):
+                raise TypeError(f"Cannot compile boosting with a {type(model.init_).__name__} init estimator")
+            # Raw log-odds: constant prior plus the scaled stage trees
+            base = float(model._raw_predict_init(np.zeros((1, model.n_features_in_)))[0, 0])
+            return list(model.estimators_[:, 0]), float(model.learning_rate), base, 1.0, False
+        raise TypeError(f"Cannot compile {type(model).__name__}")
+
+    @classmethod
+    def try_compile(cls, models: Dict[str, object], scaler=None) -> Optional['CompiledForest']:
+        """Compile the fitted models, or None if any of them is unsupported
+
+        With the StandardScaler the models were trained behind, the scaler
+        is folded in and the forest takes unscaled rows.
+        """
+        fitted = {name: model for name, model in models.items() if model is not None}
+        if not fitted:
+            return None
+        try:
+            forest = cls(fitted)
+            return forest if scaler is None else forest.fold_scaler(scaler)
+        except (TypeError, ValueError, AttributeError) as e:
+            logger.warning(f"Tree ensembles not compiled, using estimator predictions: {e}")
+            return None
+
+    def fold_scaler(self, scaler) -> 'CompiledForest':
+        """Fold the fitted StandardScaler the ensembles were trained behind into the thresholds
+
+        Afterwards rows are passed unscaled: float64 rows are compared
+        against `threshold` and float32 rows against `threshold32`, each
+        the exact cut for its dtype (see unscaled_thresholds). Returns self.
+        """
+        if self.scaler_folded:
+            raise ValueError("A scaler is already folded into this forest")
+        mean = scaler.mean_ if scaler.with_mean else np.zeros(self.n_features)
+        scale = scaler.scale_ if scaler.with_std else np.ones(self.n_features)
+        if len(mean) != self.n_features:
+            raise ValueError(f"Scaler has {len(mean)} features, the forest {self.n_features}")
+
+        splits = np.flatnonzero(self.left != np.arange(len(self.left)))
+        features = self.feature[splits]
+        thresholds32 = self.threshold32[splits]
+        self.threshold = self.threshold.copy()
+        self.threshold[splits] = unscaled_thresholds(thresholds32, mean[features], scale[features], np.float64)
+        self.threshold32[splits] = unscaled_thresholds(thresholds32, mean[features], scale[features], np.float32)
+        self.scaler_folded = True
+        return self
+
+    def _split_inputs(self, X: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Rows as compared at the splits, with the matching thresholds"""
+        if self.scaler_folded:
+            X = np.asarray(X)
+            if X.dtype == np.float32:
+                return X, self.threshold32
+            return np.asarray(X, dtype=np.float64), self.threshold
+        # sklearn trees compare float32 inputs (against float64 thresholds, see threshold32)
+        return np.asarray(X, dtype=np.float32), self.threshold32
+
+    def tree_values(self, X: np.ndarray) -> np.ndarray:
+        """Leaf value of every tree for every row, shaped (rows, trees)"""
+        X, threshold = self._split_inputs(X)
+        rows = np.arange(len(X))[:, np.newaxis]
+
+        nodes = np.broadcast_to(self.roots, (len(X), len(self.roots)))
+        for _ in range(self.max_depth):
+            goes_left = X[rows, self.feature[nodes]] <= threshold[nodes]
+            nodes = np.where(goes_left, self.left[nodes], self.right[nodes])
+        return self.value[nodes]
+
+    def _combine(self, tree_values: np.ndarray, name: str) -> np.ndarray:
+        """An output's prediction, accumulated tree by tree in the estimator's order"""
+        first, count, weight, base, divisor, _ = self.outputs[name]
+        terms = np.empty((len(tree_values), count + 1))
+        terms[:, 0] = base
+        terms[:, 1:] = tree_values[:, first:first + count]
+        if weight != 1.0:
+            terms[:, 1:] *= weight
+        # cumsum adds sequentially, like the estimators' own accumulation
+        return np.cumsum(terms, axis=1)[:, -1] / divisor
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """Predictions shaped (rows, outputs), columns in `names` order"""
+        tree_values = self.tree_values(X)
+        return np.column_stack([self._combine(tree_values, name) for name in self.names])
+
+    def predict_with_intervals(self, X: np.ndarray, z: float = DEFAULT_INTERVAL_Z
+                               ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Predictions plus lower and upper bounds from the spread of member trees
+
+        Bounds are `mean -/+ z * std` over the trees of averaging forests;
+        additive (boosted) outputs get zero-width intervals.
+        """
+        tree_values = self.tree_values(X)
+        predictions = np.column_stack([self._combine(tree_values, name) for name in self.names])
+
+        spread = np.zeros_like(predictions)
+        for column, name in enumerate(self.names):
+            first, count, _, _, _, averaging = self.outputs[name]
+            if averaging and count > 1:
+                spread[:, column] = tree_values[:, first:first + count].std(axis=1)
+
+        return predictions, predictions - z * spread, predictions + z * spread
+
+    def contributions(self, X: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Decision path explanations: bias (rows, outputs) and contributions (rows, outputs, features)
+
+        For every row and output, bias plus the contributions summed over
+        features equals `predict` up to float rounding.
+        """
+        X, threshold = self._split_inputs(X)
+        n_rows, n_outputs = len(X), len(self.names)
+        rows = np.arange(n_rows)[:, np.newaxis]
+
+        # Flat (row, output, feature) cell of every tree's current split
+        cell_base = (rows * n_outputs + self.tree_output) * self.n_features
+        size = n_rows * n_outputs * self.n_features
+
+        contributions = np.zeros(size)
+        nodes = np.broadcast_to(self.roots, (n_rows, len(self.roots)))
+        for _ in range(self.max_depth):
+            goes_left = X[rows, self.feature[nodes]] <= threshold[nodes]
+            next_nodes = np.where(goes_left, self.left[nodes], self.right[nodes])
+            # Leaves point at themselves, so rows already at a leaf add zero
+            delta = (self.node_value[next_nodes] - self.node_value[nodes]) * self.tree_scale
+            contributions += np.bincount((cell_base + self.feature[nodes]).ravel(),
+                                         weights=delta.ravel(), minlength=size)
+            nodes = next_nodes
+
+        # Bias: each output's base plus its trees' scaled root values
+        bias = np.array([self.outputs[name][3] for name in self.names]) + np.bincount(
+            self.tree_output, weights=self.node_value[self.roots] * self.tree_scale, minlength=n_outputs)
+        return np.tile(bias, (n_rows, 1)), contributions.reshape(n_rows, n_outputs, self.n_features)
@@ -0,0 +1,137 @@
+"""
+Admission control for model inference under load
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+import time
+from typing import AsyncIterator, Dict, Optional
+import logging
+
+from app.services.latency_budget import LatencyBudget
+
+logger = logging.getLogger(__name__)
+
+# Inference paths reported to callers
+MODEL_PATH = "model"
+RULE_BASED_PATH = "rule_based"  # no trained models loaded
+DEGRADED_PATH = "degraded"  # rule-based fallback served to shed load
+DEADLINE_PATH = "deadline"  # rule-based fallback served to meet the request's latency budget
+
+
+class ServiceOverloaded(Exception):
+    """Raised when a request can be neither run nor degraded; maps to 503 with Retry-After"""
+
+    def __init__(self, endpoint: str, retry_after_seconds: int):
+        super().__init__(f"Service overloaded ({endpoint}); retry in {retry_after_seconds}s")
+        self.endpoint = endpoint
+        self.retry_after_seconds = retry_after_seconds
+
+
+class AdmissionController:
+    """Bounded concurrent inference with a bounded, time-limited wait queue
+
+    At most `max_concurrent` requests run the models at once and at most
+    `max_queue` more wait for a slot, each for up to `queue_timeout_seconds`.
+    A request that finds the queue full or times out in it is degraded to
+    the endpoint's rule-based fallback, of which at most `max_degraded` run
+    at once; past that, or for endpoints without a fallback, it is rejected
+    with ServiceOverloaded. Latency therefore stays bounded by the queue
+    timeout plus one inference instead of growing with the backlog.
+
+    Counters are only touched on the event loop, so no lock is needed.
+    """
+
+    def __init__(self, max_concurrent: int = 4, max_queue: int = 32, queue_timeout_seconds: float = 0.5,
+                 max_degraded: int = 64, retry_after_seconds: int = 1):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout_seconds = queue_timeout_seconds
+        self.max_degraded = max(0, max_degraded)
+        self.retry_after_seconds = retry_after_seconds
+        self._slots = asyncio.Semaphore(self.max_concurrent)
+
+        self.running = 0
+        self.waiting = 0
+        self.degraded_running = 0
+
+        self.admitted = 0
+        self.queued = 0
+        self.queue_timeouts = 0
+        self.degraded: Dict[str, int] = {}
+        self.rejected: Dict[str, int] = {}
+
+    @asynccontextmanager
+    async def admit(self, endpoint: str, degradable: bool = True,
+                    budget: Optional[LatencyBudget] = None) -> AsyncIterator[str]:
+        """Hold an inference slot for the block, yielding MODEL_PATH or DEGRADED_PATH
+
+        DEGRADED_PATH means the caller must serve its rule-based fallback;
+        endpoints without one pass `degradable=False` and are rejected instead.
+        A request's latency budget caps its time in the queue, which is
+        recorded as its "queue" stage.
+        """
+        timeout = self.queue_timeout_seconds
+        if budget is not None:
+            timeout = max(0.0, min(timeout, budget.remaining()))
+        started = time.perf_counter()
+        admitted = await self._acquire(timeout)
+        if budget is not None:
+            budget.record("queue", time.perf_counter() - started)
+
+        if admitted:
+            self.admitted += 1
+            self.running += 1
+            try:
+                yield MODEL_PATH
+            finally:
+                self.running -= 1
+                self._slots.release()
+            return
+
+        if not degradable or self.degraded_running >= self.max_degraded:
+            self.rejected[endpoint] = self.rejected.get(endpoint, 0) + 1
+            raise ServiceOverloaded(endpoint, self.retry_after_seconds)
+
+        self.degraded[endpoint] = self.degraded.get(endpoint, 0) + 1
+        self.degraded_running += 1
+        try:
+            yield DEGRADED_PATH
+        finally:
+            self.degraded_running -= 1
+
+    async def _acquire(self, timeout: float) -> bool:
+        """Take a slot, waiting up to `timeout` in the bounded queue if needed; False when overloaded"""
+        if not self._slots.locked():
+            await self._slots.acquire()
+            return True
+        if self.waiting >= self.max_queue or timeout <= 0:
+            return False
+
+        self.queued += 1
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            self.queue_timeouts += 1
+            return False
+        finally:
+            self.waiting -= 1
+
+    def stats(self) -> Dict:
+        """Limits, current occupancy and admission counters"""
+        return {
+            'max_concurrent': self.max_concurrent,
+            'max_queue': self.max_queue,
+            'queue_timeout_seconds': self.queue_timeout_seconds,
+            'max_degraded': self.max_degraded,
+            'running': self.running,
+            'waiting': self.waiting,
+            'degraded_running': self.degraded_running,
+            'admitted': self.admitted,
+            'queued': self.queued,
+            'queue_timeouts': self.queue_timeouts,
+            'degraded': dict(self.degraded),
+            'rejected': dict(self.rejected)
+        }
@@ -0,0 +1,180 @@
+"""
+Streaming NDJSON bulk scoring of historical user-days
+"""
+
+import json
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
+import logging
+
+import numpy as np
+from pydantic import BaseModel, ValidationError
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from app.models.schema import BIOMARKERS
+from app.services.inference_pool import LocalInferenceBackend
+
+logger = logging.getLogger(__name__)
+
+# Longest accepted NDJSON line; longer records are reported and skipped
+MAX_LINE_BYTES = 1 << 20
+
+
+class ScoringRecord(BaseModel):
+    """One user-day to score"""
+    id: Optional[Union[str, int]] = None
+    user_profile: Dict
+    nutrition_data: Dict
+    current_biomarkers: Dict = {}
+
+
+class NDJSONStreamingResponse(StreamingResponse):
+    """Streaming NDJSON response produced while the request body is still being read
+
+    StreamingResponse watches for client disconnects by consuming `receive`,
+    which would take request body chunks away from a generator that reads
+    `request.stream()`. Here only the generator receives; a disconnect ends
+    it with ClientDisconnect. Clients should read results while uploading,
+    as with any full-duplex NDJSON stream.
+
+    The background task runs however the stream ends, so it can release
+    what was held for the stream (e.g. an admission slot).
+    """
+
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await self.stream_response(send)
+        except ClientDisconnect:
+            logger.info("Client disconnected from NDJSON stream")
+        finally:
+            if self.background is not None:
+                await self.background()
+
+
+class BulkScorer:
+    """Score an NDJSON stream of user-days in fixed-size batches
+
+    Lines are parsed as they arrive and scored `batch_size` at a time through
+    the matrix model paths, so memory stays bounded by one batch however
+    long the stream is. Results are emitted in input order, one NDJSON line
+    per record; a record that cannot be parsed or scored gets an inline
+    `error` line instead and the stream carries on. Batches are scored by
+    `inference` (in-process by default, or a ProcessInferenceBackend).
+    """
+
+    def __init__(self, nutrition_service, biomarker_model, risk_model, batch_size: int = 256,
+                 inference=None):
+        self.nutrition_service = nutrition_service
+        self.biomarker_model = biomarker_model
+        self.risk_model = risk_model
+        self.batch_size = max(1, batch_size)
+        self.inference = inference or LocalInferenceBackend(biomarker_model, risk_model)
+
+    async def score_stream(self, chunks: AsyncIterator[bytes],
+                           time_horizon_days: int = 30) -> AsyncIterator[bytes]:
+        """NDJSON result lines for an NDJSON request body streamed in arbitrary chunks"""
+        batch: List[Tuple[int, Union[ScoringRecord, str]]] = []
+        async for line_number, line in self._lines(chunks):
+            batch.append((line_number, self._parse(line)))
+            if len(batch) >= self.batch_size:
+                # Inference is CPU-bound; keep the event loop free for other requests
+                yield await run_in_threadpool(self.score_batch, batch, time_horizon_days)
+                batch = []
+        if batch:
+            yield await run_in_threadpool(self.score_batch, batch, time_horizon_days)
+
+    @staticmethod
+    async def _lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, Optional[bytes]]]:
+        """Numbered non-blank lines of a chunked body (None for lines over MAX_LINE_BYTES)"""
+        buffer = b''
+        line_number = 0
+        oversized = False
+        async for chunk in chunks:
+            # Every complete line in the chunk, in one split; the last part is still open
+            *lines, buffer = (buffer + chunk).split(b'\n')
+            for line in lines:
+                line_number += 1
+                if oversized or len(line) > MAX_LINE_BYTES:
+                    # Too long, possibly with its head already dropped
+                    oversized = False
+                    yield line_number, None
+                elif line.strip():
+                    yield line_number, line
+            if len(buffer) > MAX_LINE_BYTES:
+                # Drop the partial line rather than buffering it without bound
+                buffer = b''
+                oversized = True
+        if oversized:
+            yield line_number + 1, None
+        elif buffer.strip():
+            yield line_number + 1, buffer
+
+    @staticmethod
+    def _parse(line: Optional[bytes]) -> Union[ScoringRecord, str]:
+        """Validated record, or an error message"""
+        if line is None:
+            return f"Record exceeds {MAX_LINE_BYTES} bytes"
+        try:
+            return ScoringRecord.model_validate_json(line)
+        except ValidationError as e:
+            return "; ".join(
+                f"{'.'.join(str(part) for part in error['loc']) or 'record'}: {error['msg']}"
+                for error in e.errors()
+            )
+
+    def score_batch(self, batch: List[Tuple[int, Union[ScoringRecord, str]]],
+                    time_horizon_days: int = 30) -> bytes:
+        """NDJSON result lines for a batch of parsed records, in batch order"""
+        results: List[Dict] = []
+        biomarker_rows, risk_rows, scored = [], [], []
+        for line_number, record in batch:
+            if isinstance(record, str):
+                results.append({'line': line_number, 'error': record})
+                continue
+            result = {'line': line_number, 'id': record.id}
+            try:
+                biomarker_rows.append(self.biomarker_model.prepare_features(
+                    record.user_profile, record.nutrition_data, record.current_biomarkers))
+                risk_rows.append(self._risk_features(record))
+                result['molecular_balance_score'] = self.nutrition_service.calculate_molecular_balance_score(
+                    record.user_profile, [], record.nutrition_data)
+            except Exception as e:
+                del biomarker_rows[len(scored):], risk_rows[len(scored):]
+                result['error'] = f"Invalid record: {e}"
+            else:
+                scored.append(result)
+            results.append(result)
+
+        if scored:
+            try:
+                self._predict(scored, np.array(biomarker_rows), np.array(risk_rows), time_horizon_days)
+            except Exception as e:
+                logger.error(f"Bulk scoring batch failed: {e}")
+                for result in scored:
+                    result.pop('molecular_balance_score', None)
+                    result['error'] = f"Scoring failed: {e}"
+
+        return ''.join(json.dumps(result) + '\n' for result in results).encode()
+
+    def _risk_features(self, record: ScoringRecord) -> np.ndarray:
+        """Risk feature row for the day's intake and biomarkers"""
+        demographics = dict(record.user_profile)
+        if 'bmi' not in demographics:
+            height_m = demographics.get('height', 170) / 100
+            demographics['bmi'] = demographics.get('weight', 70) / height_m ** 2
+        return self.risk_model._prepare_risk_features(
+            demographics, [record.nutrition_data], [record.current_biomarkers])
+
+    def _predict(self, scored: List[Dict], X_biomarker: np.ndarray, X_risk: np.ndarray,
+                 time_horizon_days: int):
+        """Fill biomarker predictions and risk scores into the scored results, one model pass each"""
+        biomarkers = self.inference.predict_biomarker_matrix(X_biomarker, time_horizon_days).tolist()
+        risks = self.inference.risk_score_matrix(X_risk).tolist()
+        categories = self.risk_model.risk_categories
+        for result, biomarker_row, risk_row in zip(scored, biomarkers, risks):
+            result['predicted_biomarkers'] = dict(zip(BIOMARKERS, biomarker_row))
+            result['risk_scores'] = dict(zip(categories, risk_row))
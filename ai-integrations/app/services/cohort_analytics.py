@@ -0,0 +1,298 @@
+"""
+Live distributions of served scores and predictions, as mergeable quantile sketches
+"""
+
+from contextlib import contextmanager
+import json
+import math
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, Iterator, Mapping, Sequence, Tuple
+import logging
+
+import numpy as np
+
+from app.models.history import _as_float
+
+logger = logging.getLogger(__name__)
+
+# Quantiles are within this relative error of a true value of the metric
+SKETCH_RELATIVE_ACCURACY = 0.01
+
+# Magnitudes below the minimum count as zero; those above the maximum share the top bucket
+SKETCH_MIN_MAGNITUDE = 1e-6
+SKETCH_MAX_MAGNITUDE = 1e6
+
+# Percentiles reported by default
+COHORT_PERCENTILES = (5, 25, 50, 75, 95, 99)
+
+# Workers that have not written their sketches for this long are dropped (e.g. after a crash)
+COHORT_MAX_AGE_SECONDS = 3600.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sketches (
+    worker_id TEXT NOT NULL,
+    metric_group TEXT NOT NULL,
+    metrics TEXT NOT NULL,
+    relative_accuracy REAL NOT NULL,
+    cells BLOB NOT NULL,
+    counts BLOB NOT NULL,
+    summary BLOB NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (worker_id, metric_group)
+);
+"""
+
+
+class QuantileSketch:
+    """Relative-error quantile sketches (DDSketch) of several metrics, as one count matrix
+
+    Every value falls in a logarithmic bucket whose bounds are within
+    `relative_accuracy` of its midpoint: column `buckets` holds the zeros,
+    the columns after it positive magnitudes and the ones before it
+    negative magnitudes, so columns are ordered by value. Memory is
+    (metrics, 2 * buckets + 1) counts plus each metric's minimum, maximum
+    and sum, whatever the number of values, and two sketches of the same
+    metrics merge by adding their counts.
+    """
+
+    def __init__(self, names: Sequence[str], relative_accuracy: float = SKETCH_RELATIVE_ACCURACY,
+                 min_magnitude: float = SKETCH_MIN_MAGNITUDE, max_magnitude: float = SKETCH_MAX_MAGNITUDE):
+        self.names = tuple(names)
+        self.relative_accuracy = relative_accuracy
+        self.min_magnitude = min_magnitude
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets = math.ceil(math.log(max_magnitude / min_magnitude) / self._log_gamma) + 1
+        self.counts = np.zeros((len(self.names), 2 * self.buckets + 1), dtype=np.int64)
+        # Rows: minimum, maximum, sum
+        self.summary = np.array([[np.inf], [-np.inf], [0.0]]).repeat(len(self.names), axis=1)
+
+        # Value reported for each column: bucket midpoints (relative to the bounds), 0 for the zeros
+        magnitudes = np.empty(self.buckets)
+        magnitudes[0] = min_magnitude
+        magnitudes[1:] = min_magnitude * self.gamma ** np.arange(1, self.buckets) * 2 / (self.gamma + 1)
+        self._values = np.concatenate([-magnitudes[::-1], [0.0], magnitudes])
+
+    def _columns(self, values: np.ndarray) -> np.ndarray:
+        """Count matrix column of each (non-NaN) value"""
+        magnitudes = np.abs(values)
+        nonzero = magnitudes >= self.min_magnitude
+        with np.errstate(divide='ignore'):
+            buckets = np.ceil(np.log(np.where(nonzero, magnitudes, self.min_magnitude) / self.min_magnitude)
+                              / self._log_gamma)
+        buckets = np.clip(buckets, 0, self.buckets - 1).astype(np.intp)
+        return self.buckets + np.where(nonzero, np.where(values > 0, buckets + 1, -buckets - 1), 0)
+
+    def add(self, values: np.ndarray):
+        """Add one value per metric (in `names` order; NaN adds nothing)"""
+        values = np.asarray(values, dtype=np.float64)
+        rows = np.flatnonzero(~np.isnan(values))
+        values = values[rows]
+        self.counts[rows, self._columns(values)] += 1
+        self.summary[0, rows] = np.minimum(self.summary[0, rows], values)
+        self.summary[1, rows] = np.maximum(self.summary[1, rows], values)
+        self.summary[2, rows] += values
+
+    def merge(self, other: 'QuantileSketch'):
+        """Add another sketch of the same metrics and accuracy"""
+        if other.names != self.names or other.counts.shape != self.counts.shape:
+            raise ValueError("Only sketches of the same metrics and accuracy can be merged")
+        self.counts += other.counts
+        self.summary[0] = np.minimum(self.summary[0], other.summary[0])
+        self.summary[1] = np.maximum(self.summary[1], other.summary[1])
+        self.summary[2] += other.summary[2]
+
+    @property
+    def count(self) -> np.ndarray:
+        """Number of values added per metric"""
+        return self.counts.sum(axis=1)
+
+    def quantiles(self, quantiles: Sequence[float]) -> np.ndarray:
+        """Values at each quantile (0-1) per metric, shaped (metrics, quantiles); NaN without values
+
+        Results are clamped to the exact minimum and maximum.
+        """
+        counts = self.count
+        cumulative = self.counts.cumsum(axis=1)
+        ranks = np.asarray(quantiles, dtype=np.float64)[np.newaxis] * np.maximum(counts - 1, 0)[:, np.newaxis]
+        # First column whose cumulative count passes each rank
+        columns = (cumulative[:, np.newaxis, :] <= ranks[:, :, np.newaxis]).sum(axis=2)
+        values = self._values[np.minimum(columns, len(self._values) - 1)]
+        values = np.clip(values, self.summary[0][:, np.newaxis], self.summary[1][:, np.newaxis])
+        values[counts == 0] = np.nan
+        return values
+
+    def to_state(self) -> Tuple[bytes, bytes, bytes]:
+        """(non-zero cells, their counts, summary) for storage; the names and accuracy are not included"""
+        cells = np.flatnonzero(self.counts)
+        return (cells.astype(np.int64).tobytes(), self.counts.ravel()[cells].tobytes(),
+                self.summary.tobytes())
+
+    @classmethod
+    def from_state(cls, names: Sequence[str], cells: bytes, counts: bytes, summary: bytes,
+                   relative_accuracy: float = SKETCH_RELATIVE_ACCURACY) -> 'QuantileSketch':
+        """Restore a sketch saved with `to_state`"""
+        sketch = cls(names, relative_accuracy)
+        sketch.counts.ravel()[np.frombuffer(cells, dtype=np.int64)] = np.frombuffer(counts, dtype=np.int64)
+        sketch.summary = np.frombuffer(summary, dtype=np.float64).reshape(3, len(sketch.names)).copy()
+        return sketch
+
+
+class CohortAnalytics:
+    """Quantile sketches of what this worker serves, shared with the other workers through SQLite
+
+    Metrics are grouped (e.g. 'risk_scores' -> one metric per category);
+    `record` adds a response's values to this worker's in-memory sketches
+    and says when `flush_seconds` have passed since the last `flush`,
+    which writes them to the shared file (one row per worker and group,
+    replaced on each flush). `summary` flushes this worker, then merges
+    every worker's rows.
+
+    The distributions are live ones: each worker's sketches are cumulative
+    since it started, `close` removes them, and rows not rewritten for
+    `max_age_seconds` (workers that crashed, or served nothing since) are
+    deleted when merging. `flush`, `summary` and `close` touch the file,
+    so they should run off the event loop; `record` does not.
+    """
+
+    def __init__(self, groups: Mapping[str, Sequence[str]], path: str = ":memory:",
+                 flush_seconds: float = 10.0, relative_accuracy: float = SKETCH_RELATIVE_ACCURACY,
+                 max_age_seconds: float = COHORT_MAX_AGE_SECONDS):
+        self.groups = {group: tuple(names) for group, names in groups.items()}
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self.max_age_seconds = max_age_seconds
+        self.relative_accuracy = relative_accuracy
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.sketches = {group: QuantileSketch(names, relative_accuracy) for group, names in self.groups.items()}
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._flushed_at = time.monotonic()
+        self.recorded = 0
+        self.flushes = 0
+
+    def close(self):
+        """Withdraw this worker's sketches from the shared file and close it"""
+        with self._lock:
+            try:
+                with self._transaction():
+                    self._connection.execute("DELETE FROM sketches WHERE worker_id = ?", (self.worker_id,))
+            except sqlite3.Error as e:
+                logger.error(f"Error removing cohort sketches: {e}")
+            self._connection.close()
+
+    def record(self, group: str, values: Mapping[str, float]) -> bool:
+        """Add one response's values (name -> value; other names are ignored) to a group's sketch
+
+        Returns whether a flush is due.
+        """
+        sketch = self.sketches[group]
+        row = np.array([_as_float(values.get(name)) for name in sketch.names])
+        with self._lock:
+            sketch.add(row)
+            self._dirty = True
+            self.recorded += 1
+            return time.monotonic() - self._flushed_at >= self.flush_seconds
+
+    def flush(self, force: bool = False):
+        """Write this worker's sketches to the shared file, if anything was recorded since the last flush
+
+        With `force`, sketches with any values are rewritten regardless, refreshing their age.
+        """
+        with self._lock:
+            if not self._dirty and not (force and self.recorded):
+                return
+            now = time.time()
+            rows = [(self.worker_id, group, json.dumps(sketch.names), self.relative_accuracy,
+                     *sketch.to_state(), now)
+                    for group, sketch in self.sketches.items()]
+            # A failed write (e.g. the file locked by another worker) is retried next interval, not every request
+            self._flushed_at = time.monotonic()
+            try:
+                with self._transaction():
+                    self._connection.executemany(
+                        "INSERT OR REPLACE INTO sketches (worker_id, metric_group, metrics, relative_accuracy, "
+                        "cells, counts, summary, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            except sqlite3.Error as e:
+                logger.error(f"Error writing cohort sketches: {e}")
+                return
+            self._dirty = False
+            self.flushes += 1
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        """Run the block in one SQLite transaction (write lock taken up front), rolled back on error"""
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            raise
+        self._connection.execute("COMMIT")
+
+    def merged(self) -> Tuple[Dict[str, QuantileSketch], int]:
+        """Every current worker's sketches merged per group, and the number of those workers
+
+        Rows older than `max_age_seconds` are deleted first.
+        """
+        self.flush(force=True)
+        merged = {group: QuantileSketch(names, self.relative_accuracy) for group, names in self.groups.items()}
+        workers = set()
+        with self._lock, self._transaction():
+            self._connection.execute(
+                "DELETE FROM sketches WHERE updated_at < ?", (time.time() - self.max_age_seconds,))
+            rows = self._connection.execute(
+                "SELECT worker_id, metric_group, metrics, relative_accuracy, cells, counts, summary "
+                "FROM sketches").fetchall()
+        for worker_id, group, metrics, relative_accuracy, cells, counts, summary in rows:
+            names = tuple(json.loads(metrics))
+            # Rows written with other metrics or accuracy (e.g. by an older release) cannot be merged
+            if group not in merged or names != merged[group].names or relative_accuracy != self.relative_accuracy:
+                continue
+            merged[group].merge(QuantileSketch.from_state(names, cells, counts, summary, relative_accuracy))
+            workers.add(worker_id)
+        return merged, len(workers)
+
+    def summary(self, percentiles: Sequence[float] = COHORT_PERCENTILES) -> Dict:
+        """Count, mean, extremes and percentiles (0-100) of every metric with values, across current workers"""
+        sketches, workers = self.merged()
+        metrics = {}
+        for group, sketch in sketches.items():
+            counts = sketch.count
+            values = sketch.quantiles([percentile / 100 for percentile in percentiles])
+            metrics[group] = {
+                name: {
+                    'count': int(counts[row]),
+                    'mean': float(sketch.summary[2, row] / counts[row]),
+                    'min': float(sketch.summary[0, row]),
+                    'max': float(sketch.summary[1, row]),
+                    'percentiles': {f'p{percentile:g}': value
+                                    for percentile, value in zip(percentiles, values[row].tolist())}
+                }
+                for row, name in enumerate(sketch.names)
+                if counts[row]
+            }
+        return {'workers': workers, 'metrics': metrics}
+
+    def stats(self) -> Dict:
+        return {
+            'path': self.path,
+            'worker_id': self.worker_id,
+            'recorded': self.recorded,
+            'flushes': self.flushes,
+            'max_age_seconds': self.max_age_seconds,
+            'relative_accuracy': self.relative_accuracy,
+            'buckets_per_metric': next(iter(self.sketches.values())).counts.shape[1] if self.sketches else 0
+        }
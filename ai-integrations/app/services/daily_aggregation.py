@@ -0,0 +1,264 @@
+"""
+Incremental per-user daily nutrition aggregation
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Callable, Dict, Optional, Union
+import logging
+
+from app.models.schema import NutrientVector
+
+logger = logging.getLogger(__name__)
+
+
+class DayNotRetained(ValueError):
+    """Raised when a meal is logged for a day older than the days kept for the user; maps to 400"""
+
+
+class DailyNutritionTotals:
+    """Meals and running nutrient totals for one user on one day"""
+
+    def __init__(self, restored: Optional[NutrientVector] = None):
+        self.meals: Dict[str, NutrientVector] = {}
+        # Persisted totals the day was restored from after eviction; their meals are not kept
+        self.restored = restored.copy() if restored is not None else None
+        self.totals = restored.copy() if restored is not None else NutrientVector()
+
+    @property
+    def empty(self) -> bool:
+        return not self.meals and self.restored is None
+
+    def apply(self, nutrition: NutrientVector, sign: float):
+        """Add (sign=1) or subtract (sign=-1) one meal's contribution"""
+        if sign > 0:
+            self.totals += nutrition
+        else:
+            self.totals -= nutrition
+
+
+class DailyNutritionStore:
+    """Per-user running daily nutrition totals maintained from meal deltas
+
+    Each add, edit or remove touches only the meal that changed, so keeping a
+    day's totals current is O(1) in the number of meals already logged.
+    Users idle longer than `idle_ttl_seconds`, or beyond `max_users` least
+    recently active ones, are evicted; only the latest `max_days` days are
+    kept per user, and meals for older days are rejected with DayNotRetained.
+
+    `restore(user_id, day)` returns a day's persisted totals (or None); a
+    day missing from memory, e.g. after its user was evicted, starts from
+    them instead of from zero. Meals logged before the eviction then only
+    count in the totals and can no longer be edited individually.
+    `persist(user_id, day, totals)` is called after every change with the
+    day's new totals, or None once nothing is logged for it.
+
+    A user's changes, restores and persists run under one of `lock_stripes`
+    per-user locks, so each persisted total is the latest one and slow
+    storage only holds up users sharing the stripe; the shared lock guards
+    just the in-memory index of users and days.
+    """
+
+    def __init__(self, nutrition_service, max_users: int = 10000,
+                 idle_ttl_seconds: float = 6 * 3600, max_days: int = 7,
+                 restore: Optional[Callable[[str, str], Optional[NutrientVector]]] = None,
+                 persist: Optional[Callable[[str, str, Optional[NutrientVector]], None]] = None,
+                 lock_stripes: int = 64):
+        self.nutrition_service = nutrition_service
+        self.restore = restore
+        self.persist = persist
+        self.max_users = max_users
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.max_days = max_days
+
+        # user_id -> {day -> DailyNutritionTotals}, ordered by last activity
+        self._users: "OrderedDict[str, Dict[str, DailyNutritionTotals]]" = OrderedDict()
+        self._last_seen: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._user_locks = [threading.Lock() for _ in range(lock_stripes)]
+        self.evictions = 0
+
+    @staticmethod
+    def day_key(day: Optional[Union[str, date]] = None) -> str:
+        """ISO date string for a day, defaulting to today"""
+        if isinstance(day, date):
+            return day.isoformat()
+        return day or date.today().isoformat()
+
+    def _user_lock(self, user_id: str) -> threading.Lock:
+        """The lock serialising one user's changes"""
+        return self._user_locks[hash(user_id) % len(self._user_locks)]
+
+    def _get_day(self, user_id: str, day: str, create: bool) -> Optional[DailyNutritionTotals]:
+        """Look up (and optionally create) a user's day, marking the user active
+
+        A day missing from memory is restored from its persisted totals when
+        there are any; otherwise it is only created when `create` is set.
+        Must be called holding the user's lock, which keeps other requests
+        for the user from adding the day while it is being restored.
+        """
+        with self._lock:
+            days = self._users.get(user_id)
+            totals = days.get(day) if days is not None else None
+            if totals is not None:
+                self._touch(user_id)
+                return totals
+
+        restored = self.restore(user_id, day) if self.restore is not None else None
+
+        with self._lock:
+            days = self._users.get(user_id)
+            if restored is not None or create:
+                totals = DailyNutritionTotals(restored)
+                if days is None:
+                    days = self._users[user_id] = {}
+                # Keep only the most recent days (ISO dates sort chronologically); a day that
+                # would be dropped at once is refused rather than silently losing its meal
+                if sum(existing > day for existing in days) < self.max_days:
+                    days[day] = totals
+                    for stale in sorted(days)[:-self.max_days]:
+                        del days[stale]
+                elif create:
+                    raise DayNotRetained(f"Only the latest {self.max_days} days are kept; {day} is older")
+
+            if days is not None:
+                self._touch(user_id)
+            return totals
+
+    def _touch(self, user_id: str):
+        """Mark a user as the most recently active (shared lock held)"""
+        self._users.move_to_end(user_id)
+        self._last_seen[user_id] = time.monotonic()
+
+    def _persist(self, user_id: str, day: str, totals: DailyNutritionTotals):
+        """Hand a changed day's totals to `persist` (user's lock held)"""
+        if self.persist is not None:
+            self.persist(user_id, day, None if totals.empty else totals.totals.copy())
+
+    def add_meal(self, user_id: str, meal_id: str, meal: Dict,
+                 day: Optional[Union[str, date]] = None) -> NutrientVector:
+        """Log a new meal and return the updated daily totals
+
+        Raises ValueError for a meal id already logged that day, and
+        DayNotRetained for a day older than the latest `max_days` days.
+        """
+        day = self.day_key(day)
+        nutrition = self.nutrition_service.meal_nutrition(meal)
+
+        with self._user_lock(user_id):
+            totals = self._get_day(user_id, day, create=True)
+            if meal_id in totals.meals:
+                raise ValueError(f"Meal {meal_id} already logged for {day}")
+
+            totals.meals[meal_id] = nutrition
+            totals.apply(nutrition, 1)
+            self._persist(user_id, day, totals)
+            result = totals.totals.copy()
+
+        self.evict_inactive()
+        return result
+
+    def update_meal(self, user_id: str, meal_id: str, meal: Dict,
+                    day: Optional[Union[str, date]] = None) -> NutrientVector:
+        """Replace a logged meal and return the updated daily totals"""
+        day = self.day_key(day)
+        nutrition = self.nutrition_service.meal_nutrition(meal)
+
+        with self._user_lock(user_id):
+            totals = self._get_day(user_id, day, create=False)
+            if totals is None or meal_id not in totals.meals:
+                raise KeyError(f"Meal {meal_id} not found for {day}")
+
+            totals.apply(totals.meals[meal_id], -1)
+            totals.meals[meal_id] = nutrition
+            totals.apply(nutrition, 1)
+            self._persist(user_id, day, totals)
+            return totals.totals.copy()
+
+    def remove_meal(self, user_id: str, meal_id: str, day: Optional[Union[str, date]] = None) -> NutrientVector:
+        """Remove a logged meal and return the updated daily totals"""
+        day = self.day_key(day)
+
+        with self._user_lock(user_id):
+            totals = self._get_day(user_id, day, create=False)
+            if totals is None or meal_id not in totals.meals:
+                raise KeyError(f"Meal {meal_id} not found for {day}")
+
+            totals.apply(totals.meals.pop(meal_id), -1)
+            self._persist(user_id, day, totals)
+            return totals.totals.copy()
+
+    def get_totals(self, user_id: str, day: Optional[Union[str, date]] = None) -> Optional[NutrientVector]:
+        """Current running totals for a user's day, or None if nothing is logged"""
+        with self._user_lock(user_id):
+            totals = self._get_day(user_id, self.day_key(day), create=False)
+            return totals.totals.copy() if totals is not None else None
+
+    def meal_count(self, user_id: str, day: Optional[Union[str, date]] = None) -> int:
+        """Number of meals held for a user's day (not those only in restored totals)"""
+        with self._user_lock(user_id):
+            totals = self._get_day(user_id, self.day_key(day), create=False)
+            return len(totals.meals) if totals is not None else 0
+
+    def recompute(self, user_id: str, day: Optional[Union[str, date]] = None,
+                  tolerance: float = 1e-6) -> Dict:
+        """Re-sum a day from its stored meals (and restored totals), report any drift and reset the running totals"""
+        day = self.day_key(day)
+
+        with self._user_lock(user_id):
+            totals = self._get_day(user_id, day, create=False)
+            if totals is None:
+                raise KeyError(f"No meals logged for {day}")
+
+            recomputed = totals.restored.copy() if totals.restored is not None else NutrientVector()
+            for nutrition in totals.meals.values():
+                recomputed += nutrition
+
+            difference = totals.totals - recomputed
+            drift = {
+                nutrient: value
+                for nutrient, value in difference.to_dict().items()
+                if abs(value) > tolerance
+            }
+            if drift:
+                logger.warning(f"Daily totals drifted for user {user_id} on {day}: {drift}")
+
+            totals.totals = recomputed
+            if drift:
+                self._persist(user_id, day, totals)
+            return {
+                'totals': recomputed.copy(),
+                'consistent': not drift,
+                'drift': drift
+            }
+
+    def evict_inactive(self, now: Optional[float] = None) -> int:
+        """Drop users idle past the TTL and the least recently active users over capacity"""
+        now = time.monotonic() if now is None else now
+        evicted = 0
+
+        with self._lock:
+            while self._users:
+                user_id = next(iter(self._users))
+                idle = now - self._last_seen[user_id] > self.idle_ttl_seconds
+                if not idle and len(self._users) <= self.max_users:
+                    break
+                del self._users[user_id]
+                del self._last_seen[user_id]
+                evicted += 1
+            self.evictions += evicted
+
+        return evicted
+
+    def stats(self) -> Dict:
+        """Store size and eviction counters"""
+        with self._lock:
+            return {
+                'users': len(self._users),
+                'days': sum(len(days) for days in self._users.values()),
+                'max_users': self.max_users,
+                'idle_ttl_seconds': self.idle_ttl_seconds,
+                'evictions': self.evictions
+            }
@@ -0,0 +1,333 @@
+"""
+Per-user derived feature store on embedded SQLite
+"""
+
+from contextlib import contextmanager
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import date
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+import logging
+
+import numpy as np
+
+from app.models.history import HistorySummary, RunningHistory
+from app.services.daily_aggregation import DailyNutritionStore
+from app.models.schema import BIOMARKER_FEATURE_BIOMARKERS, BIOMARKERS, NUTRIENTS, BiomarkerVector, NutrientVector
+
+logger = logging.getLogger(__name__)
+
+NUTRITION = 'nutrition'
+BIOMARKER_READINGS = 'biomarkers'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_profiles (
+    user_id TEXT PRIMARY KEY,
+    demographics TEXT NOT NULL,
+    family_history TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS nutrition_days (
+    user_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    vals BLOB NOT NULL,
+    PRIMARY KEY (user_id, day)
+);
+CREATE TABLE IF NOT EXISTS biomarker_readings (
+    user_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    vals BLOB NOT NULL,
+    PRIMARY KEY (user_id, position)
+);
+CREATE TABLE IF NOT EXISTS latest_biomarkers (
+    user_id TEXT PRIMARY KEY,
+    vals BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS history_state (
+    user_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    sums BLOB NOT NULL,
+    recent BLOB NOT NULL,
+    PRIMARY KEY (user_id, kind)
+);
+CREATE TABLE IF NOT EXISTS user_features (
+    user_id TEXT PRIMARY KEY,
+    risk_features BLOB NOT NULL,
+    biomarker_features BLOB NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+class UserFeatures:
+    """A user's stored profile, model-ready feature vectors and running histories"""
+
+    __slots__ = ('user_id', 'demographics', 'family_history', 'risk_features', 'biomarker_features',
+                 'nutrition', 'biomarkers', 'updated_at')
+
+    def __init__(self, user_id: str, demographics: Dict, family_history: List[str], risk_features: np.ndarray,
+                 biomarker_features: np.ndarray, nutrition: RunningHistory, biomarkers: RunningHistory,
+                 updated_at: float):
+        self.user_id = user_id
+        self.demographics = demographics
+        self.family_history = family_history
+        self.risk_features = risk_features
+        self.biomarker_features = biomarker_features
+        self.nutrition = nutrition
+        self.biomarkers = biomarkers
+        self.updated_at = updated_at
+
+    def latest_nutrition(self) -> NutrientVector:
+        """The most recent day's nutrient totals (zeros without history)"""
+        return NutrientVector(np.nan_to_num(self.nutrition.latest()))
+
+    def current_biomarkers(self) -> BiomarkerVector:
+        """Latest reading of each biomarker (population defaults for those never read), as fed to the model"""
+        return BiomarkerVector(self.biomarker_features[BIOMARKER_FEATURE_BIOMARKERS].copy())
+
+
+class UserFeatureStore:
+    """Each user's derived model features, persisted and updated incrementally
+
+    Users register a profile (demographics and family history) and then
+    feed the store daily nutrition totals (e.g. from DailyNutritionStore as
+    meals are logged) and biomarker readings. Every update adjusts the
+    user's running history sums (RunningHistory) by the one entry that
+    changed and rewrites the user's risk and biomarker feature vectors, so
+    prediction endpoints read a ready vector by user id instead of
+    rebuilding it from raw history. Only back-filling or removing a day
+    other than the latest re-reads that user's stored days; each
+    biomarker's latest value is kept alongside, updated with every reading.
+
+    Everything lives in one SQLite file (WAL mode); a single connection is
+    shared behind a lock, so calls should run off the event loop.
+    """
+
+    def __init__(self, biomarker_model, risk_model, path: str = ":memory:"):
+        self.biomarker_model = biomarker_model
+        self.risk_model = risk_model
+        self.path = path
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self.updates = 0
+        self.rebuilds = 0
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def set_profile(self, user_id: str, demographics: Dict,
+                    family_history: Optional[List[str]] = None) -> UserFeatures:
+        """Create or replace a user's profile and refresh the feature vectors
+
+        `family_history` defaults to the one in `demographics`, where the
+        risk features read it from.
+        """
+        family_history = list(family_history or demographics.get('family_history') or [])
+        demographics = {**demographics, 'family_history': family_history}
+        with self._lock, self._transaction():
+            self._connection.execute(
+                "INSERT OR REPLACE INTO user_profiles (user_id, demographics, family_history) VALUES (?, ?, ?)",
+                (user_id, json.dumps(demographics), json.dumps(family_history)))
+            return self._refresh(user_id)
+
+    def record_nutrition_day(self, user_id: str, day: Optional[Union[str, date]],
+                             totals: Optional[NutrientVector]) -> Optional[UserFeatures]:
+        """Store a day's nutrient totals (None removes the day) and update the features
+
+        History is kept for users without a profile too; they get features
+        (and a non-None result) once `set_profile` is called.
+        """
+        day = DailyNutritionStore.day_key(day)
+        with self._lock, self._transaction():
+            history = self._load_history(user_id, NUTRITION)
+            row = self._connection.execute(
+                "SELECT vals FROM nutrition_days WHERE user_id = ? AND day = ?", (user_id, day)).fetchone()
+            later = self._connection.execute(
+                "SELECT COUNT(*) FROM nutrition_days WHERE user_id = ? AND day > ?", (user_id, day)).fetchone()[0]
+
+            if totals is None:
+                if row is not None:
+                    self._connection.execute(
+                        "DELETE FROM nutrition_days WHERE user_id = ? AND day = ?", (user_id, day))
+                    history = self._rebuild_nutrition(user_id)
+            else:
+                values = np.asarray(totals.values, dtype=np.float64)
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO nutrition_days (user_id, day, vals) VALUES (?, ?, ?)",
+                    (user_id, day, values.tobytes()))
+                if row is not None:
+                    # Same day again: swap its contribution in place
+                    history.replace(history.count - 1 - later, np.frombuffer(row[0]), values)
+                elif later == 0:
+                    history.append(values)
+                else:
+                    # A back-filled day shifts every later day's position
+                    history = self._rebuild_nutrition(user_id)
+
+            self._save_history(user_id, NUTRITION, history)
+            return self._refresh(user_id, nutrition=history)
+
+    def add_biomarker_reading(self, user_id: str, readings: Dict,
+                              day: Optional[Union[str, date]] = None) -> UserFeatures:
+        """Append a biomarker reading (missing biomarkers stay unobserved) and update the features
+
+        Raises KeyError for users without a profile.
+        """
+        values = HistorySummary.from_entries([readings], BIOMARKERS).values[0]
+        with self._lock, self._transaction():
+            if self._load_profile(user_id) is None:
+                raise KeyError(f"No profile stored for user {user_id}")
+            history = self._load_history(user_id, BIOMARKER_READINGS)
+            self._connection.execute(
+                "INSERT INTO biomarker_readings (user_id, position, day, vals) VALUES (?, ?, ?, ?)",
+                (user_id, history.count, DailyNutritionStore.day_key(day), values.tobytes()))
+            latest = np.where(np.isnan(values), self._latest_biomarkers(user_id), values)
+            self._connection.execute(
+                "INSERT OR REPLACE INTO latest_biomarkers (user_id, vals) VALUES (?, ?)", (user_id, latest.tobytes()))
+            history.append(values)
+            self._save_history(user_id, BIOMARKER_READINGS, history)
+            return self._refresh(user_id, biomarkers=history)
+
+    def nutrition_day(self, user_id: str, day: Optional[Union[str, date]]) -> Optional[NutrientVector]:
+        """A stored day's nutrient totals, or None"""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT vals FROM nutrition_days WHERE user_id = ? AND day = ?",
+                (user_id, DailyNutritionStore.day_key(day))).fetchone()
+        return None if row is None else NutrientVector(np.frombuffer(row[0], dtype=np.float64).copy())
+
+    def get(self, user_id: str) -> Optional[UserFeatures]:
+        """A user's stored features, or None for unknown users"""
+        with self._lock:
+            profile = self._load_profile(user_id)
+            if profile is None:
+                return None
+            features = self._connection.execute(
+                "SELECT risk_features, biomarker_features, updated_at FROM user_features WHERE user_id = ?",
+                (user_id,)).fetchone()
+            return UserFeatures(
+                user_id, *profile,
+                np.frombuffer(features[0], dtype=np.float64), np.frombuffer(features[1], dtype=np.float64),
+                self._load_history(user_id, NUTRITION), self._load_history(user_id, BIOMARKER_READINGS),
+                features[2]
+            )
+
+    def delete_user(self, user_id: str) -> bool:
+        """Forget everything stored for a user; False if there was nothing"""
+        with self._lock, self._transaction():
+            deleted = self._connection.execute("DELETE FROM user_profiles WHERE user_id = ?", (user_id,)).rowcount
+            for table in ('nutrition_days', 'biomarker_readings', 'latest_biomarkers', 'history_state',
+                          'user_features'):
+                self._connection.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+            return bool(deleted)
+
+    def stats(self) -> Dict:
+        """Store size and update counters"""
+        with self._lock:
+            count = lambda table: self._connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            return {
+                'path': self.path,
+                'users': count('user_profiles'),
+                'nutrition_days': count('nutrition_days'),
+                'biomarker_readings': count('biomarker_readings'),
+                'updates': self.updates,
+                'rebuilds': self.rebuilds
+            }
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        """Run the block in one SQLite transaction, rolled back on error
+
+        The write lock is taken up front (BEGIN IMMEDIATE): updates read
+        then write, and a deferred transaction whose snapshot another
+        worker's commit outdated fails with SQLITE_BUSY without waiting.
+        """
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            raise
+        self._connection.execute("COMMIT")
+
+    def _load_profile(self, user_id: str) -> Optional[Tuple[Dict, List[str]]]:
+        """(demographics, family history), or None without a profile"""
+        profile = self._connection.execute(
+            "SELECT demographics, family_history FROM user_profiles WHERE user_id = ?", (user_id,)).fetchone()
+        return None if profile is None else (json.loads(profile[0]), json.loads(profile[1]))
+
+    def _load_history(self, user_id: str, kind: str) -> RunningHistory:
+        names = NUTRIENTS if kind == NUTRITION else BIOMARKERS
+        row = self._connection.execute(
+            "SELECT count, sums, recent FROM history_state WHERE user_id = ? AND kind = ?", (user_id, kind)).fetchone()
+        return RunningHistory(names) if row is None else RunningHistory.from_state(names, *row)
+
+    def _save_history(self, user_id: str, kind: str, history: RunningHistory):
+        self._connection.execute(
+            "INSERT OR REPLACE INTO history_state (user_id, kind, count, sums, recent) VALUES (?, ?, ?, ?, ?)",
+            (user_id, kind, *history.to_state()))
+
+    def _rebuild_nutrition(self, user_id: str) -> RunningHistory:
+        """Running sums re-read from every stored day of the user"""
+        self.rebuilds += 1
+        rows = [np.frombuffer(vals, dtype=np.float64) for (vals,) in self._connection.execute(
+            "SELECT vals FROM nutrition_days WHERE user_id = ? ORDER BY day", (user_id,))]
+        matrix = np.vstack(rows) if rows else np.empty((0, len(NUTRIENTS)))
+        return RunningHistory.from_summary(HistorySummary(NUTRIENTS, matrix))
+
+    def _latest_biomarkers(self, user_id: str) -> np.ndarray:
+        """Each biomarker's value in its latest reading (NaN for biomarkers never read)"""
+        row = self._connection.execute(
+            "SELECT vals FROM latest_biomarkers WHERE user_id = ?", (user_id,)).fetchone()
+        if row is not None:
+            return np.frombuffer(row[0], dtype=np.float64)
+        # Users without readings, or whose readings predate the latest values being kept
+        values = np.full(len(BIOMARKERS), np.nan)
+        for (vals,) in self._connection.execute(
+                "SELECT vals FROM biomarker_readings WHERE user_id = ? ORDER BY position", (user_id,)):
+            readings = np.frombuffer(vals, dtype=np.float64)
+            values = np.where(np.isnan(readings), values, readings)
+        return values
+
+    def _current_biomarkers(self, user_id: str) -> BiomarkerVector:
+        """Each biomarker's value in its latest reading, defaults for biomarkers never read"""
+        values = self._latest_biomarkers(user_id)
+        return BiomarkerVector(np.where(np.isnan(values), BiomarkerVector.defaults, values))
+
+    def _refresh(self, user_id: str, nutrition: Optional[RunningHistory] = None,
+                 biomarkers: Optional[RunningHistory] = None) -> Optional[UserFeatures]:
+        """Recompute and store a user's feature vectors from the profile and running histories"""
+        profile = self._load_profile(user_id)
+        if profile is None:
+            return None
+        demographics, family_history = profile
+        nutrition = nutrition or self._load_history(user_id, NUTRITION)
+        biomarkers = biomarkers or self._load_history(user_id, BIOMARKER_READINGS)
+
+        # Risk features from the running averages; biomarker features from the latest day and readings
+        risk_features = self.risk_model._prepare_risk_features(demographics, [], [], (nutrition, biomarkers))
+        biomarker_features = self.biomarker_model.prepare_features(
+            demographics, NutrientVector(np.nan_to_num(nutrition.latest())), self._current_biomarkers(user_id))
+        # Stored as float64 whatever the models' serving precision
+        risk_features = np.asarray(risk_features, dtype=np.float64)
+        biomarker_features = np.asarray(biomarker_features, dtype=np.float64)
+        updated_at = time.time()
+
+        self._connection.execute(
+            "INSERT OR REPLACE INTO user_features (user_id, risk_features, biomarker_features, updated_at) "
+            "VALUES (?, ?, ?, ?)",
+            (user_id, risk_features.tobytes(), biomarker_features.tobytes(), updated_at))
+        self.updates += 1
+        return UserFeatures(user_id, demographics, family_history, risk_features, biomarker_features,
+                            nutrition, biomarkers, updated_at)
@@ -0,0 +1,48 @@
+"""
+Rule tables for biomarker and health risk recommendations
+"""
+
+from app.models.schema import RISK_CATEGORIES
+from app.services.rule_engine import Rule, RuleSet
+
+# Recommendations from predicted biomarker values (missing values take population defaults)
+BIOMARKER_RECOMMENDATION_RULES = RuleSet([
+    Rule("Consider reducing carbohydrate intake to manage glucose levels",
+         when=[('glucose', '>', 100)]),
+    Rule("Focus on heart-healthy fats and increase fiber intake",
+         when=[('cholesterol', '>', 200)]),
+    Rule("Reduce sodium intake and increase potassium-rich foods",
+         when=[('blood_pressure_systolic', '>', 130)]),
+], defaults={'glucose': 90, 'cholesterol': 180, 'blood_pressure_systolic': 110})
+
+# Risk factors from demographics and family history
+HEALTH_RISK_FACTOR_RULES = RuleSet([
+    Rule("Age-related health risks", when=[('age', '>', 50)]),
+    Rule("Obesity-related health risks", when=[('bmi', '>', 30)]),
+    Rule("Family history of diabetes", when=[('family_history', 'contains', 'diabetes')]),
+    Rule("Family history of heart disease", when=[('family_history', 'contains', 'heart_disease')]),
+], defaults={'age': 30, 'bmi': 22})
+
+# Prevention recommendations per risk category score
+PREVENTION_RULES = RuleSet([
+    rule
+    for category in RISK_CATEGORIES
+    for rule in (
+        Rule(f"High risk for {category.replace('_', ' ')} - consult healthcare provider",
+             when=[(category, '>', 0.7)], group=category),
+        Rule(f"Moderate risk for {category.replace('_', ' ')} - consider lifestyle changes",
+             when=[(category, '>', 0.4)], group=category),
+    )
+])
+
+# Monitoring frequency per risk category score, as (category, schedule) pairs
+MONITORING_RULES = RuleSet([
+    rule
+    for category in RISK_CATEGORIES
+    for rule in (
+        Rule((category, "Monthly monitoring recommended"), when=[(category, '>', 0.7)], group=category),
+        Rule((category, "Quarterly monitoring recommended"), when=[(category, '>', 0.4)], group=category),
+        # Scores are probabilities, so this only skips categories that were not scored
+        Rule((category, "Annual monitoring sufficient"), when=[(category, '>=', 0)], group=category),
+    )
+])
@@ -0,0 +1,323 @@
+"""
+Model inference backends: in-process, or a pool of worker processes fed through shared memory
+"""
+
+import multiprocessing
+from multiprocessing import shared_memory
+import os
+import queue
+import threading
+from typing import Dict, List, Optional, Tuple
+import logging
+
+import numpy as np
+
+from app.models.schema import BIOMARKERS, BIOMARKER_FEATURES, RISK_CATEGORIES, RISK_FEATURES
+
+logger = logging.getLogger(__name__)
+
+# Largest feature matrix (rows) moved per worker call; bigger ones are split
+DEFAULT_MAX_ROWS = 4096
+
+_INPUT_COLUMNS = max(len(BIOMARKER_FEATURES), len(RISK_FEATURES))
+_OUTPUT_COLUMNS = max(len(BIOMARKERS), len(RISK_CATEGORIES))
+
+
+class LocalInferenceBackend:
+    """Model inference in the calling thread, on the service's own model objects"""
+
+    def __init__(self, biomarker_model, risk_model):
+        self.biomarker_model = biomarker_model
+        self.risk_model = risk_model
+
+    def predict_biomarker_matrix(self, X: np.ndarray, time_horizon_days: int = 30) -> np.ndarray:
+        return self.biomarker_model.predict_biomarker_matrix(X, time_horizon_days)
+
+    def risk_score_matrix(self, X: np.ndarray) -> np.ndarray:
+        return self.risk_model.risk_score_matrix(X)
+
+    def predict_biomarker_trajectory(self, features: np.ndarray, time_horizons_days: List[int]) -> List[Dict]:
+        return self.biomarker_model.predict_biomarker_trajectory(features, time_horizons_days)
+
+    def assess_feature_row(self, features: np.ndarray) -> Tuple[Dict, Dict]:
+        return self.risk_model.assess_feature_row(features)
+
+    def reload(self):
+        """Nothing to do: the model objects are reloaded in place"""
+
+    def close(self):
+        pass
+
+    def stats(self) -> Dict:
+        return {'backend': 'thread'}
+
+
+def _worker_main(connection, input_name: str, output_name: str, max_rows: int,
+                 biomarker_model_path: str, risk_model_path: str, dtype: type = np.float64):
+    """Worker process loop: load the models once, then serve matrix requests until told to stop"""
+    from app.models.healthcare_models import BiomarkerPredictionModel, HealthRiskAssessmentModel
+
+    # Spawned workers share the parent's resource tracker, which unlinks the blocks if the parent dies
+    input_block = shared_memory.SharedMemory(name=input_name)
+    output_block = shared_memory.SharedMemory(name=output_name)
+    inputs = np.ndarray((max_rows, _INPUT_COLUMNS), dtype=dtype, buffer=input_block.buf)
+    outputs = np.ndarray((max_rows, _OUTPUT_COLUMNS), dtype=np.float64, buffer=output_block.buf)
+
+    def load():
+        biomarker_model, risk_model = BiomarkerPredictionModel(), HealthRiskAssessmentModel()
+        biomarker_model.dtype = risk_model.dtype = dtype
+        if os.path.exists(biomarker_model_path):
+            biomarker_model.load_model(biomarker_model_path)
+        if os.path.exists(risk_model_path):
+            risk_model.load_model(risk_model_path)
+        return biomarker_model, risk_model
+
+    biomarker_model, risk_model = load()
+    try:
+        while True:
+            message = connection.recv()
+            if message is None:
+                break
+            # `argument` is the time horizon for matrices, (row, option) for single rows
+            operation, rows, columns, argument = message
+            try:
+                if operation == 'reload':
+                    biomarker_model, risk_model = load()
+                    connection.send(('ok', 0))
+                    continue
+                if operation == 'trajectory':
+                    features, time_horizons_days = argument
+                    connection.send(('ok', biomarker_model.predict_biomarker_trajectory(features, time_horizons_days)))
+                    continue
+                if operation == 'assess':
+                    features, _ = argument
+                    connection.send(('ok', risk_model.assess_feature_row(features)))
+                    continue
+                X = inputs[:rows, :columns]
+                if operation == 'biomarkers':
+                    result = biomarker_model.predict_biomarker_matrix(X, argument)
+                else:
+                    result = risk_model.risk_score_matrix(X)
+                outputs[:rows, :result.shape[1]] = result
+                connection.send(('ok', result.shape[1]))
+            except Exception as e:
+                connection.send(('error', f"{type(e).__name__}: {e}"))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        del inputs, outputs
+        input_block.close()
+        output_block.close()
+
+
+class _Worker:
+    """One worker process with its pipe and its input/output shared-memory blocks
+
+    The input block holds features in the models' precision (`dtype`);
+    outputs are always float64.
+    """
+
+    def __init__(self, context, max_rows: int, biomarker_model_path: str, risk_model_path: str,
+                 dtype: type = np.float64):
+        self.max_rows = max_rows
+        self.input_block = shared_memory.SharedMemory(
+            create=True, size=max_rows * _INPUT_COLUMNS * np.dtype(dtype).itemsize)
+        self.output_block = shared_memory.SharedMemory(create=True, size=max_rows * _OUTPUT_COLUMNS * 8)
+        self.inputs = np.ndarray((max_rows, _INPUT_COLUMNS), dtype=dtype, buffer=self.input_block.buf)
+        self.outputs = np.ndarray((max_rows, _OUTPUT_COLUMNS), dtype=np.float64, buffer=self.output_block.buf)
+
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child_connection, self.input_block.name, self.output_block.name, max_rows,
+                  biomarker_model_path, risk_model_path, dtype),
+            daemon=True
+        )
+        self.process.start()
+        child_connection.close()
+
+    def call(self, operation: str, X: np.ndarray, time_horizon_days: int = 0) -> np.ndarray:
+        """Run one operation on at most `max_rows` rows; the result is copied out of shared memory"""
+        rows, columns = X.shape
+        self.inputs[:rows, :columns] = X
+        _, output_columns = self._request((operation, rows, columns, time_horizon_days))
+        return self.outputs[:rows, :output_columns].copy()
+
+    def call_row(self, operation: str, features: np.ndarray, option=None):
+        """Run one operation on a single feature row; the row and result go over the pipe"""
+        return self._request((operation, 0, 0, (features, option)))[1]
+
+    def reload(self):
+        self._request(('reload', 0, 0, 0))
+
+    def _request(self, message: Tuple) -> Tuple[str, object]:
+        try:
+            self.connection.send(message)
+            status, value = self.connection.recv()
+        except (EOFError, OSError) as e:
+            raise RuntimeError(f"Inference worker {self.process.pid} died") from e
+        if status == 'error':
+            raise RuntimeError(f"Inference worker failed: {value}")
+        return status, value
+
+    @property
+    def alive(self) -> bool:
+        return self.process.is_alive()
+
+    def close(self):
+        try:
+            self.connection.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.connection.close()
+        del self.inputs, self.outputs
+        for block in (self.input_block, self.output_block):
+            block.close()
+            block.unlink()
+
+
+class ProcessInferenceBackend:
+    """Model inference in long-lived worker processes, free of the service's GIL
+
+    Each worker loads the saved models once and owns an input and an output
+    shared-memory block: a caller copies its feature matrix into the input
+    block, sends a four-field message over a pipe, and copies the result out
+    of the output block, so no arrays are pickled per call. Single requests
+    (one feature row, with dict results and explanations) are small enough
+    to send over the pipe instead. Callers (e.g.
+    threadpool threads) check out an idle worker and block on the pipe with
+    the GIL released, so `workers` calls run truly in parallel. Matrices
+    over `max_rows` are split across successive calls.
+
+    The pool is started lazily on first use; `reload` makes every worker
+    reload the model files, e.g. after /reload-models. Workers run the
+    models at `dtype` precision (see MODEL_PRECISIONS), which also sizes
+    the input blocks.
+    """
+
+    def __init__(self, biomarker_model_path: str, risk_model_path: str,
+                 workers: Optional[int] = None, max_rows: int = DEFAULT_MAX_ROWS,
+                 dtype: type = np.float64):
+        self.biomarker_model_path = biomarker_model_path
+        self.risk_model_path = risk_model_path
+        self.dtype = dtype
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.max_rows = max(1, max_rows)
+        self._context = multiprocessing.get_context("spawn")
+        self._pool: List[_Worker] = []
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.restarts = 0
+
+    def _start(self):
+        with self._lock:
+            if self._pool:
+                return
+            for _ in range(self.workers):
+                worker = self._spawn()
+                self._pool.append(worker)
+                self._idle.put(worker)
+            logger.info(f"Started {self.workers} inference worker processes")
+
+    def _spawn(self) -> _Worker:
+        return _Worker(self._context, self.max_rows, self.biomarker_model_path, self.risk_model_path, self.dtype)
+
+    def _checkout(self, call):
+        """`call(worker)` on an idle worker, replacing the worker if it died meanwhile"""
+        if not self._pool:
+            self._start()
+        worker = self._idle.get()
+        try:
+            result = call(worker)
+            with self._lock:
+                self.calls += 1
+        finally:
+            if not worker.alive:
+                worker = self._replace(worker)
+            self._idle.put(worker)
+        return result
+
+    def _run(self, operation: str, X: np.ndarray, time_horizon_days: int = 0) -> np.ndarray:
+        X = np.asarray(X, dtype=self.dtype)
+        chunks = self._checkout(lambda worker: [
+            worker.call(operation, X[start:start + self.max_rows], time_horizon_days)
+            for start in range(0, len(X), self.max_rows)])
+        if not chunks:
+            return np.empty((0, len(BIOMARKERS) if operation == 'biomarkers' else len(RISK_CATEGORIES)))
+        return chunks[0] if len(chunks) == 1 else np.vstack(chunks)
+
+    def _replace(self, worker: _Worker) -> _Worker:
+        """Swap a dead worker for a fresh one"""
+        logger.warning(f"Inference worker {worker.process.pid} exited; starting a replacement")
+        worker.close()
+        replacement = self._spawn()
+        with self._lock:
+            self._pool[self._pool.index(worker)] = replacement
+            self.restarts += 1
+        return replacement
+
+    def predict_biomarker_matrix(self, X: np.ndarray, time_horizon_days: int = 30) -> np.ndarray:
+        """Same result as BiomarkerPredictionModel.predict_biomarker_matrix, computed in a worker"""
+        return self._run('biomarkers', X, time_horizon_days)
+
+    def risk_score_matrix(self, X: np.ndarray) -> np.ndarray:
+        """Same result as HealthRiskAssessmentModel.risk_score_matrix, computed in a worker"""
+        return self._run('risks', X)
+
+    def predict_biomarker_trajectory(self, features: np.ndarray, time_horizons_days: List[int]) -> List[Dict]:
+        """Same result as BiomarkerPredictionModel.predict_biomarker_trajectory, computed in a worker"""
+        features = np.asarray(features)
+        return self._checkout(lambda worker: worker.call_row('trajectory', features, list(time_horizons_days)))
+
+    def assess_feature_row(self, features: np.ndarray) -> Tuple[Dict, Dict]:
+        """Same result as HealthRiskAssessmentModel.assess_feature_row, computed in a worker"""
+        features = np.asarray(features)
+        return self._checkout(lambda worker: worker.call_row('assess', features))
+
+    def reload(self):
+        """Make every worker reload the model files (waits for in-flight calls)"""
+        if not self._pool:
+            return
+        checked_out = [self._idle.get() for _ in range(len(self._pool))]
+        try:
+            for worker in checked_out:
+                worker.reload()
+        finally:
+            for worker in checked_out:
+                self._idle.put(worker)
+
+    def close(self):
+        """Stop the workers and free their shared memory"""
+        with self._lock:
+            for worker in self._pool:
+                worker.close()
+            self._pool = []
+            self._idle = queue.Queue()
+
+    def stats(self) -> Dict:
+        return {
+            'backend': 'process',
+            'workers': self.workers,
+            'started': bool(self._pool),
+            'max_rows': self.max_rows,
+            'precision': np.dtype(self.dtype).name,
+            'calls': self.calls,
+            'restarts': self.restarts
+        }
+
+
+def create_inference_backend(kind: str, biomarker_model, risk_model, biomarker_model_path: str,
+                             risk_model_path: str, workers: Optional[int] = None):
+    """Backend for model inference: "thread" (in-process) or "process" (worker pool)
+
+    Worker processes run at the precision of the given models.
+    """
+    if kind == "process":
+        return ProcessInferenceBackend(biomarker_model_path, risk_model_path, workers, dtype=risk_model.dtype)
+    if kind != "thread":
+        logger.warning(f"Unknown inference backend {kind!r}; using in-process inference")
+    return LocalInferenceBackend(biomarker_model, risk_model)
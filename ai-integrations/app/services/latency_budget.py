@@ -0,0 +1,122 @@
+"""
+Per-request latency budgets with learned stage costs
+"""
+
+from contextlib import contextmanager
+import math
+import threading
+import time
+from typing import Dict, Iterator, Optional
+import logging
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+# Header carrying a caller's latency budget in milliseconds
+LATENCY_BUDGET_HEADER = "X-Latency-Budget-Ms"
+
+
+class RequestClockMiddleware:
+    """Stamp every request's arrival so budgets also cover body parsing and validation"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            scope.setdefault("state", {})["received_at"] = time.perf_counter()
+        await self.app(scope, receive, send)
+
+
+class LatencyTracker:
+    """Exponentially weighted moving averages of stage durations, shared by all requests
+
+    Keys are "<endpoint>.<stage>"; `alpha` is the weight of the newest
+    observation, so estimates follow load changes within a few requests.
+    """
+
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self._ewma: Dict[str, float] = {}
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, key: str, seconds: float):
+        """Fold one stage duration into its moving average"""
+        with self._lock:
+            previous = self._ewma.get(key)
+            self._ewma[key] = seconds if previous is None else previous + self.alpha * (seconds - previous)
+            self._counts[key] = self._counts.get(key, 0) + 1
+
+    def estimate(self, key: str) -> Optional[float]:
+        """Expected stage duration in seconds, or None before the first observation"""
+        return self._ewma.get(key)
+
+    def budget(self, endpoint: str, budget_seconds: Optional[float] = None,
+               started_at: Optional[float] = None) -> 'LatencyBudget':
+        """A budget for one request to `endpoint` (unbounded without `budget_seconds`)"""
+        return LatencyBudget(endpoint, self, budget_seconds, started_at)
+
+    def stats(self) -> Dict:
+        """Moving average (ms) and sample count per endpoint stage"""
+        with self._lock:
+            return {
+                'alpha': self.alpha,
+                'stages': {
+                    key: {'ewma_ms': round(value * 1000, 3), 'samples': self._counts[key]}
+                    for key, value in sorted(self._ewma.items())
+                }
+            }
+
+
+class LatencyBudget:
+    """One request's deadline plus the time spent in each of its stages
+
+    Stages are timed with `stage(name)`; every duration is also fed to the
+    shared tracker, whose estimates `can_afford` compares with the time
+    left. Stages without an estimate yet are assumed to fit.
+    """
+
+    def __init__(self, endpoint: str, tracker: LatencyTracker, budget_seconds: Optional[float] = None,
+                 started_at: Optional[float] = None):
+        self.endpoint = endpoint
+        self.tracker = tracker
+        self.started_at = time.perf_counter() if started_at is None else started_at
+        self.deadline = math.inf if budget_seconds is None else self.started_at + budget_seconds
+        self.stages: Dict[str, float] = {}
+
+    @property
+    def bounded(self) -> bool:
+        return self.deadline != math.inf
+
+    def remaining(self) -> float:
+        """Seconds left before the deadline (inf when unbounded, may be negative)"""
+        return self.deadline - time.perf_counter()
+
+    def record(self, name: str, seconds: float):
+        """Account for a stage timed elsewhere"""
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        self.tracker.observe(f"{self.endpoint}.{name}", seconds)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Time the enclosed block as stage `name`"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def can_afford(self, *stages: str) -> bool:
+        """Whether the stages' expected durations fit in the time left"""
+        if not self.bounded:
+            return True
+        expected = sum(self.tracker.estimate(f"{self.endpoint}.{name}") or 0.0 for name in stages)
+        return expected <= self.remaining()
+
+    def server_timing(self) -> str:
+        """Stage durations as a Server-Timing header value"""
+        timings = [f"{name};dur={seconds * 1000:.3f}" for name, seconds in self.stages.items()]
+        timings.append(f"total;dur={(time.perf_counter() - self.started_at) * 1000:.3f}")
+        return ", ".join(timings)
@@ -3,25 +3,31 @@ Healthcare-focused nutrition analysis service
 """
 
 import numpy as np
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple, Union
 import logging
 
+from app.models.reference_intakes import ReferenceIntakeTable
+from app.services.rule_engine import Rule, RuleSet
+from app.models.schema import (
+    NUTRIENTS, NUTRIENT_INDEX, NutrientVector,
+    PROTEIN, CARBS, FAT, FIBER, VITAMIN_C, VITAMIN_D, CALCIUM, IRON, SODIUM
+)
+
 logger = logging.getLogger(__name__)
 
+# Micronutrients scored for adequacy, as positions in NUTRIENTS
+ADEQUACY_MICRONUTRIENTS = np.array([FIBER, VITAMIN_C, VITAMIN_D, CALCIUM, IRON])
+ADEQUACY_MICRONUTRIENT_NAMES = tuple(NUTRIENTS[position] for position in ADEQUACY_MICRONUTRIENTS)
+
+# Micronutrients reported by analyze_micronutrients, in report order
+MICRONUTRIENT_ANALYSIS = (FIBER, VITAMIN_C, VITAMIN_D, CALCIUM, IRON, SODIUM)
+
 class NutritionAnalysisService:
     """Advanced nutrition analysis with healthcare insights"""
     
     def __init__(self):
-        self.nutrient_requirements = {
-            'protein': {'male': 56, 'female': 46},  # grams per day
-            'carbs': {'male': 300, 'female': 250},  # grams per day
-            'fat': {'male': 70, 'female': 60},      # grams per day
-            'fiber': {'male': 38, 'female': 25},   # grams per day
-            'vitamin_c': {'male': 90, 'female': 75}, # mg per day
-            'vitamin_d': {'male': 20, 'female': 20}, # mcg per day
-            'calcium': {'male': 1000, 'female': 1000}, # mg per day
-            'iron': {'male': 8, 'female': 18},      # mg per day
-        }
+        # Reference intakes for every sex / age band / pregnancy / activity combination
+        self.reference_intakes = ReferenceIntakeTable()
         
         self.health_conditions = {
             'diabetes': {
@@ -55,166 +61,208 @@ class NutritionAnalysisService:
                 ]
             }
         }
+        
+        # Declarative rule tables for recommendations and insights
+        self.recommendation_rules = self._build_recommendation_rules()
+        self.insight_rules = self._build_insight_rules()
     
-    def calculate_molecular_balance_score(self, user_profile: Dict, meals: List[Dict]) -> float:
+    def calculate_molecular_balance_score(self, user_profile: Dict, meals: List[Dict],
+                                          daily_nutrition: Optional[Union[NutrientVector, Dict]] = None) -> float:
         """Calculate molecular balance score based on nutrition and health factors"""
+        return self.explain_molecular_balance_score(user_profile, meals, daily_nutrition)[0]
+    
+    def explain_molecular_balance_score(self, user_profile: Dict, meals: List[Dict],
+                                        daily_nutrition: Optional[Union[NutrientVector, Dict]] = None
+                                        ) -> Tuple[float, Optional[Dict]]:
+        """Molecular balance score plus its additive breakdown by driver (None if scoring failed)
+        
+        The breakdown credits every point of the score to the nutrient, health
+        condition or lifestyle factor that earned it, weighted like the score:
+        base_value + sum(contributions) + adjustment == score up to float
+        rounding, where the adjustment is the clamp to 0-100.
+        """
         try:
             # Calculate daily nutrition totals
-            daily_nutrition = self._calculate_daily_nutrition(meals)
+            daily_nutrition = self._daily_totals(meals, daily_nutrition)
             
             # Get user requirements
             sex = user_profile.get('sex', 'male')
-            age = user_profile.get('age', 30)
+            requirements = self.requirements_for(user_profile)
             weight = user_profile.get('weight', 70)
             height = user_profile.get('height', 170)
             
             # Calculate BMI
             bmi = weight / (height / 100) ** 2
             
+            # Points earned by each driver, per component
+            macro_points = self._macro_balance_points(daily_nutrition)
+            adequacy = self._micro_adequacy(daily_nutrition, requirements)
+            micro_points = dict(zip(ADEQUACY_MICRONUTRIENT_NAMES, (adequacy * 20).tolist()))
+            health_points = self._health_factor_points(user_profile, daily_nutrition)
+            lifestyle_points = self._lifestyle_points(user_profile)
+            
             # Base score
             score = 50
             
             # Macronutrient balance (40% of score)
-            macro_score = self._calculate_macro_balance(daily_nutrition, sex)
-            score += macro_score * 0.4
+            score += self._calculate_macro_balance(daily_nutrition, sex, macro_points) * 0.4
             
             # Micronutrient adequacy (30% of score)
-            micro_score = self._calculate_micro_adequacy(daily_nutrition, sex, age)
-            score += micro_score * 0.3
+            score += float(adequacy.sum() * 20) * 0.3  # 20 points per micronutrient
             
             # Health factor adjustments (20% of score)
-            health_score = self._calculate_health_factors(user_profile, daily_nutrition)
-            score += health_score * 0.2
+            score += self._calculate_health_factors(user_profile, daily_nutrition, health_points) * 0.2
             
             # Lifestyle factors (10% of score)
-            lifestyle_score = self._calculate_lifestyle_score(user_profile)
-            score += lifestyle_score * 0.1
+            score += self._calculate_lifestyle_score(user_profile, lifestyle_points) * 0.1
             
-            return max(0, min(100, score))
+            clamped = max(0, min(100, score))
+            
+            contributions = {}
+            for points, component_weight in ((macro_points, 0.4), (micro_points, 0.3),
+                                             (health_points, 0.2), (lifestyle_points, 0.1)):
+                for driver, value in points.items():
+                    if value:
+                        contributions[driver] = value * component_weight
+            
+            explanation = {
+                'scale': 'score',
+                'base_value': 50.0,
+                'contributions': dict(sorted(contributions.items(), key=lambda item: -abs(item[1]))),
+                'adjustment': float(clamped - score)
+            }
+            return clamped, explanation
             
         except Exception as e:
             logger.error(f"Error calculating molecular balance score: {e}")
-            return 50  # Default score
+            return 50, None  # Default score
     
-    def _calculate_daily_nutrition(self, meals: List[Dict]) -> Dict:
+    def _calculate_daily_nutrition(self, meals: List[Dict]) -> NutrientVector:
         """Calculate total daily nutrition from meals"""
-        totals = {
-            'protein': 0, 'carbs': 0, 'fat': 0, 'fiber': 0,
-            'vitamin_c': 0, 'vitamin_d': 0, 'calcium': 0, 'iron': 0,
-            'sodium': 0, 'sugar': 0, 'calories': 0
-        }
+        totals = [0.0] * len(NUTRIENTS)
         
         for meal in meals:
-            nutrition = meal.get('total_nutrition', {})
-            for nutrient, value in nutrition.items():
-                if nutrient in totals:
-                    totals[nutrient] += float(value) if value else 0
+            for nutrient, value in meal.get('total_nutrition', {}).items():
+                position = NUTRIENT_INDEX.get(nutrient)
+                if position is not None and value:
+                    totals[position] += float(value)
         
-        return totals
+        return NutrientVector(np.array(totals))
+    
+    def _daily_totals(self, meals: List[Dict],
+                      daily_nutrition: Optional[Union[NutrientVector, Dict]]) -> NutrientVector:
+        """Use precomputed daily totals when given, otherwise sum the meals"""
+        if daily_nutrition is None:
+            return self._calculate_daily_nutrition(meals)
+        return NutrientVector.from_mapping(daily_nutrition)
+    
+    def meal_nutrition(self, meal: Dict) -> NutrientVector:
+        """Extract the tracked nutrients a single meal contributes to the daily totals"""
+        return NutrientVector.from_mapping(meal.get('total_nutrition', {}))
     
-    def _calculate_macro_balance(self, nutrition: Dict, sex: str) -> float:
+    def requirements_for(self, user_profile: Dict) -> NutrientVector:
+        """Daily requirement vector for a user's sex, age, pregnancy and activity level"""
+        return self.reference_intakes.for_profile(user_profile)
+    
+    def _calculate_macro_balance(self, nutrition: NutrientVector, sex: str,
+                                 points: Optional[Dict[str, float]] = None) -> float:
         """Calculate macronutrient balance score"""
-        protein = nutrition.get('protein', 0)
-        carbs = nutrition.get('carbs', 0)
-        fat = nutrition.get('fat', 0)
+        if points is None:
+            points = self._macro_balance_points(nutrition)
+        return sum(points.values())
+    
+    def _macro_balance_points(self, nutrition: NutrientVector) -> Dict[str, float]:
+        """Macronutrient balance points earned by protein, carbs and fat"""
+        protein, carbs, fat = nutrition.values[PROTEIN:FAT + 1].tolist()
+        points = {'protein': 0, 'carbs': 0, 'fat': 0}
         
         # Calculate ratios
         total_calories = protein * 4 + carbs * 4 + fat * 9
         if total_calories == 0:
-            return 0
+            return points
         
         protein_ratio = (protein * 4) / total_calories
         carb_ratio = (carbs * 4) / total_calories
         fat_ratio = (fat * 9) / total_calories
         
-        score = 0
-        
         # Protein ratio (optimal: 0.2-0.3)
         if 0.2 <= protein_ratio <= 0.3:
-            score += 30
+            points['protein'] = 30
         elif 0.15 <= protein_ratio <= 0.35:
-            score += 20
+            points['protein'] = 20
         elif 0.1 <= protein_ratio <= 0.4:
-            score += 10
+            points['protein'] = 10
         
         # Carb ratio (optimal: 0.4-0.6)
         if 0.4 <= carb_ratio <= 0.6:
-            score += 30
+            points['carbs'] = 30
         elif 0.3 <= carb_ratio <= 0.7:
-            score += 20
+            points['carbs'] = 20
         elif 0.2 <= carb_ratio <= 0.8:
-            score += 10
+            points['carbs'] = 10
         
         # Fat ratio (optimal: 0.2-0.3)
         if 0.2 <= fat_ratio <= 0.3:
-            score += 30
+            points['fat'] = 30
         elif 0.15 <= fat_ratio <= 0.35:
-            score += 20
+            points['fat'] = 20
         elif 0.1 <= fat_ratio <= 0.4:
-            score += 10
+            points['fat'] = 10
         
-        return score
+        return points
     
-    def _calculate_micro_adequacy(self, nutrition: Dict, sex: str, age: int) -> float:
+    def _calculate_micro_adequacy(self, nutrition: NutrientVector, requirements: NutrientVector) -> float:
         """Calculate micronutrient adequacy score"""
-        score = 0
-        requirements = self.nutrient_requirements
-        
-        micronutrients = ['fiber', 'vitamin_c', 'vitamin_d', 'calcium', 'iron']
-        
-        for nutrient in micronutrients:
-            current = nutrition.get(nutrient, 0)
-            required = requirements[nutrient][sex]
-            
-            # Age adjustments
-            if age > 50 and nutrient == 'vitamin_d':
-                required *= 1.5
-            if age > 50 and nutrient == 'calcium':
-                required *= 1.2
-            
-            adequacy = min(1.0, current / required) if required > 0 else 0
-            score += adequacy * 20  # 20 points per micronutrient
-        
-        return score
+        adequacy = self._micro_adequacy(nutrition, requirements)
+        return float(adequacy.sum() * 20)  # 20 points per micronutrient
     
-    def _calculate_health_factors(self, user_profile: Dict, nutrition: Dict) -> float:
+    def _micro_adequacy(self, nutrition: NutrientVector, requirements: NutrientVector) -> np.ndarray:
+        """Fraction of the requirement met (capped at 1) for each scored micronutrient"""
+        current = nutrition.values[ADEQUACY_MICRONUTRIENTS]
+        required = requirements.values[ADEQUACY_MICRONUTRIENTS]
+        return np.minimum(1.0, current / required)
+    
+    def _calculate_health_factors(self, user_profile: Dict, nutrition: NutrientVector,
+                                  points: Optional[Dict[str, float]] = None) -> float:
         """Calculate health factor adjustments"""
-        score = 0
+        if points is None:
+            points = self._health_factor_points(user_profile, nutrition)
+        return sum(points.values())
+    
+    def _health_factor_points(self, user_profile: Dict, nutrition: NutrientVector) -> Dict[str, float]:
+        """Health factor adjustments per medical condition and the nutrients it checks"""
+        points = {}
+        values = nutrition.values.tolist()
         
         # Medical history adjustments
         medical_history = user_profile.get('medical_history', [])
         
         if 'diabetes' in medical_history:
             # Check diabetes-friendly nutrition
-            carbs = nutrition.get('carbs', 0)
-            fiber = nutrition.get('fiber', 0)
-            if carbs < 200 and fiber > 25:
-                score += 10
-            else:
-                score -= 10
+            carbs = values[CARBS]
+            fiber = values[FIBER]
+            points['diabetes:carbs_fiber'] = 10 if carbs < 200 and fiber > 25 else -10
         
         if 'hypertension' in medical_history:
             # Check sodium intake
-            sodium = nutrition.get('sodium', 0)
-            if sodium < 2000:
-                score += 10
-            else:
-                score -= 15
+            sodium = values[SODIUM]
+            points['hypertension:sodium'] = 10 if sodium < 2000 else -15
         
         if 'heart_disease' in medical_history:
             # Check fat quality
-            fat = nutrition.get('fat', 0)
-            if fat < 80:
-                score += 10
-            else:
-                score -= 10
+            fat = values[FAT]
+            points['heart_disease:fat'] = 10 if fat < 80 else -10
         
-        return score
+        return points
     
-    def _calculate_lifestyle_score(self, user_profile: Dict) -> float:
+    def _calculate_lifestyle_score(self, user_profile: Dict, points: Optional[Dict[str, float]] = None) -> float:
         """Calculate lifestyle factor score"""
-        score = 0
-        
+        if points is None:
+            points = self._lifestyle_points(user_profile)
+        return sum(points.values())
+    
+    def _lifestyle_points(self, user_profile: Dict) -> Dict[str, float]:
+        """Lifestyle points earned by activity level and health goals"""
         activity_level = user_profile.get('activity_level', 'sedentary')
         activity_scores = {
             'sedentary': 0,
@@ -224,27 +272,22 @@ class NutritionAnalysisService:
             'very_active': 40
         }
         
-        score += activity_scores.get(activity_level, 0)
+        points = {'activity_level': activity_scores.get(activity_level, 0)}
         
         # Health goals bonus
         health_goals = user_profile.get('health_goals', [])
-        if 'general_health' in health_goals:
-            score += 5
-        if 'weight_loss' in health_goals:
-            score += 5
-        if 'muscle_gain' in health_goals:
-            score += 5
-        
-        return score
+        for goal in ('general_health', 'weight_loss', 'muscle_gain'):
+            if goal in health_goals:
+                points[f'goal:{goal}'] = 5
+        
+        return points
     
-    def analyze_macronutrients(self, meals: List[Dict]) -> Dict:
+    def analyze_macronutrients(self, meals: List[Dict],
+                               daily_nutrition: Optional[Union[NutrientVector, Dict]] = None) -> Dict:
         """Analyze macronutrient distribution and quality"""
-        daily_nutrition = self._calculate_daily_nutrition(meals)
+        daily_nutrition = self._daily_totals(meals, daily_nutrition)
         
-        protein = daily_nutrition.get('protein', 0)
-        carbs = daily_nutrition.get('carbs', 0)
-        fat = daily_nutrition.get('fat', 0)
-        calories = daily_nutrition.get('calories', 0)
+        protein, carbs, fat = daily_nutrition.values[PROTEIN:FAT + 1].tolist()
         
         total_calories = protein * 4 + carbs * 4 + fat * 9
         
@@ -271,30 +314,21 @@ class NutritionAnalysisService:
             'balance_score': self._calculate_macro_balance(daily_nutrition, 'male')  # Default to male
         }
     
-    def analyze_micronutrients(self, meals: List[Dict]) -> Dict:
+    def analyze_micronutrients(self, meals: List[Dict],
+                               daily_nutrition: Optional[Union[NutrientVector, Dict]] = None) -> Dict:
         """Analyze micronutrient intake and bioavailability"""
-        daily_nutrition = self._calculate_daily_nutrition(meals)
+        daily_nutrition = self._daily_totals(meals, daily_nutrition)
+        current_values = daily_nutrition.values.tolist()
+        required_values = self.reference_intakes.general.values.tolist()
         
-        micronutrients = ['fiber', 'vitamin_c', 'vitamin_d', 'calcium', 'iron', 'sodium']
         analysis = {}
         
-        for nutrient in micronutrients:
-            current = daily_nutrition.get(nutrient, 0)
-            
-            # Get requirements (simplified)
-            requirements = {
-                'fiber': 30,
-                'vitamin_c': 90,
-                'vitamin_d': 20,
-                'calcium': 1000,
-                'iron': 15,
-                'sodium': 2000
-            }
-            
-            required = requirements[nutrient]
+        for position in MICRONUTRIENT_ANALYSIS:
+            current = current_values[position]
+            required = required_values[position]
             adequacy = (current / required * 100) if required > 0 else 0
             
-            analysis[nutrient] = {
+            analysis[NUTRIENTS[position]] = {
                 'current_intake': current,
                 'recommended_intake': required,
                 'adequacy_percentage': adequacy,
@@ -304,27 +338,22 @@ class NutritionAnalysisService:
         
         return analysis
     
-    def identify_deficiency_risks(self, user_profile: Dict, meals: List[Dict]) -> List[Dict]:
+    def identify_deficiency_risks(self, user_profile: Dict, meals: List[Dict],
+                                  daily_nutrition: Optional[Union[NutrientVector, Dict]] = None) -> List[Dict]:
         """Identify potential nutrient deficiencies"""
-        daily_nutrition = self._calculate_daily_nutrition(meals)
-        sex = user_profile.get('sex', 'male')
-        age = user_profile.get('age', 30)
-        medical_history = user_profile.get('medical_history', [])
+        daily_nutrition = self._daily_totals(meals, daily_nutrition)
         
+        current_values = daily_nutrition.values.tolist()
+        required_values = self.requirements_for(user_profile).values.tolist()
         deficiencies = []
         
         # Check each micronutrient
-        micronutrients = ['vitamin_d', 'iron', 'calcium', 'vitamin_c', 'fiber']
+        micronutrients = [VITAMIN_D, IRON, CALCIUM, VITAMIN_C, FIBER]
         
-        for nutrient in micronutrients:
-            current = daily_nutrition.get(nutrient, 0)
-            required = self.nutrient_requirements[nutrient][sex]
-            
-            # Age adjustments
-            if age > 50 and nutrient == 'vitamin_d':
-                required *= 1.5
-            if age > 50 and nutrient == 'calcium':
-                required *= 1.2
+        for position in micronutrients:
+            nutrient = NUTRIENTS[position]
+            current = current_values[position]
+            required = required_values[position]
             
             if current < required * 0.8:  # Less than 80% of requirement
                 risk_level = 'high' if current < required * 0.5 else 'medium'
@@ -377,16 +406,11 @@ class NutritionAnalysisService:
         else:
             return f"Continue current {nutrient.replace('_', ' ')} intake - adequate levels"
     
-    def generate_nutrition_recommendations(self, user_profile: Dict, meals: List[Dict], molecular_score: float) -> List[Dict]:
-        """Generate personalized nutrition recommendations"""
-        recommendations = []
-        daily_nutrition = self._calculate_daily_nutrition(meals)
-        medical_history = user_profile.get('medical_history', [])
-        health_goals = user_profile.get('health_goals', [])
-        
-        # General recommendations based on molecular score
-        if molecular_score < 60:
-            recommendations.append({
+    def _build_recommendation_rules(self) -> RuleSet:
+        """Rule table behind generate_nutrition_recommendations"""
+        rules = [
+            # General recommendations based on molecular score
+            Rule({
                 'title': 'Improve Overall Nutrition Balance',
                 'description': 'Your molecular balance score indicates room for improvement in nutrition quality.',
                 'category': 'diet',
@@ -396,109 +420,119 @@ class NutritionAnalysisService:
                     'Focus on nutrient-dense meals',
                     'Reduce processed food intake'
                 ]
-            })
+            }, when=[('molecular_score', '<', 60)])
+        ]
         
         # Medical condition-specific recommendations
-        for condition in medical_history:
-            if condition in self.health_conditions:
-                condition_info = self.health_conditions[condition]
-                recommendations.append({
-                    'title': f'Manage {condition.title()}',
-                    'description': f'Specific nutrition strategies for {condition} management.',
-                    'category': 'medical',
-                    'priority': 'high',
-                    'actions': condition_info['recommendations']
-                })
+        for condition, condition_info in self.health_conditions.items():
+            rules.append(Rule({
+                'title': f'Manage {condition.title()}',
+                'description': f'Specific nutrition strategies for {condition} management.',
+                'category': 'medical',
+                'priority': 'high',
+                'actions': condition_info['recommendations']
+            }, when=[('medical_history', 'contains', condition)]))
         
         # Goal-specific recommendations
-        for goal in health_goals:
-            if goal == 'weight_loss':
-                recommendations.append({
-                    'title': 'Support Weight Loss Goals',
-                    'description': 'Nutrition strategies to support healthy weight loss.',
-                    'category': 'diet',
-                    'priority': 'medium',
-                    'actions': [
-                        'Increase protein intake to 25-30% of calories',
-                        'Focus on high-fiber foods for satiety',
-                        'Monitor portion sizes',
-                        'Stay hydrated with water'
-                    ]
-                })
-            elif goal == 'muscle_gain':
-                recommendations.append({
-                    'title': 'Support Muscle Building',
-                    'description': 'Nutrition strategies to support muscle growth.',
-                    'category': 'diet',
-                    'priority': 'medium',
-                    'actions': [
-                        'Increase protein intake to 1.6-2.2g per kg body weight',
-                        'Time protein intake around workouts',
-                        'Ensure adequate calorie surplus',
-                        'Focus on complete protein sources'
-                    ]
-                })
-        
-        # Micronutrient-specific recommendations
-        micro_analysis = self.analyze_micronutrients(meals)
-        for nutrient, analysis in micro_analysis.items():
-            if analysis['status'] == 'deficient':
-                recommendations.append({
-                    'title': f'Address {nutrient.replace("_", " ").title()} Deficiency',
-                    'description': f'Your {nutrient} intake is {analysis["adequacy_percentage"]:.1f}% of recommended levels.',
-                    'category': 'supplements',
-                    'priority': 'high',
-                    'actions': [
-                        f'Increase {nutrient}-rich foods',
-                        f'Consider {nutrient} supplementation',
-                        'Monitor levels with healthcare provider'
-                    ]
-                })
-        
-        return recommendations
-    
-    def generate_health_insights(self, user_profile: Dict, meals: List[Dict], molecular_score: float) -> List[str]:
-        """Generate health insights based on nutrition analysis"""
-        insights = []
-        daily_nutrition = self._calculate_daily_nutrition(meals)
-        medical_history = user_profile.get('medical_history', [])
-        
-        # Molecular score insights
-        if molecular_score >= 80:
-            insights.append("Excellent molecular balance! Your nutrition is supporting optimal health.")
-        elif molecular_score >= 60:
-            insights.append("Good molecular balance with room for improvement in specific areas.")
-        else:
-            insights.append("Your molecular balance indicates significant opportunities for nutrition optimization.")
-        
-        # Macronutrient insights
-        protein = daily_nutrition.get('protein', 0)
-        carbs = daily_nutrition.get('carbs', 0)
-        fat = daily_nutrition.get('fat', 0)
-        
-        if protein >= 80:
-            insights.append("Adequate protein intake supports muscle maintenance and immune function.")
-        elif protein < 60:
-            insights.append("Low protein intake may impact muscle mass and recovery.")
-        
-        if carbs > 300:
-            insights.append("High carbohydrate intake may affect blood sugar stability.")
-        elif carbs < 150:
-            insights.append("Low carbohydrate intake may impact energy levels and exercise performance.")
+        rules += [
+            Rule({
+                'title': 'Support Weight Loss Goals',
+                'description': 'Nutrition strategies to support healthy weight loss.',
+                'category': 'diet',
+                'priority': 'medium',
+                'actions': [
+                    'Increase protein intake to 25-30% of calories',
+                    'Focus on high-fiber foods for satiety',
+                    'Monitor portion sizes',
+                    'Stay hydrated with water'
+                ]
+            }, when=[('health_goals', 'contains', 'weight_loss')]),
+            Rule({
+                'title': 'Support Muscle Building',
+                'description': 'Nutrition strategies to support muscle growth.',
+                'category': 'diet',
+                'priority': 'medium',
+                'actions': [
+                    'Increase protein intake to 1.6-2.2g per kg body weight',
+                    'Time protein intake around workouts',
+                    'Ensure adequate calorie surplus',
+                    'Focus on complete protein sources'
+                ]
+            }, when=[('health_goals', 'contains', 'muscle_gain')])
+        ]
+        
+        # Micronutrient-specific recommendations ('deficient' is under 50% adequacy)
+        for position in MICRONUTRIENT_ANALYSIS:
+            nutrient = NUTRIENTS[position]
+            rules.append(Rule({
+                'title': f'Address {nutrient.replace("_", " ").title()} Deficiency',
+                'description': f'Your {nutrient} intake is {{{nutrient}_adequacy:.1f}}% of recommended levels.',
+                'category': 'supplements',
+                'priority': 'high',
+                'actions': [
+                    f'Increase {nutrient}-rich foods',
+                    f'Consider {nutrient} supplementation',
+                    'Monitor levels with healthcare provider'
+                ]
+            }, when=[(f'{nutrient}_adequacy', '<', 50)], template=True))
         
-        # Medical condition insights
-        if 'diabetes' in medical_history:
-            fiber = daily_nutrition.get('fiber', 0)
-            if fiber >= 25:
-                insights.append("Good fiber intake supports blood sugar management.")
-            else:
-                insights.append("Increasing fiber intake can help with blood sugar control.")
+        return RuleSet(rules)
+    
+    def _build_insight_rules(self) -> RuleSet:
+        """Rule table behind generate_health_insights"""
+        return RuleSet([
+            # Molecular score insights
+            Rule("Excellent molecular balance! Your nutrition is supporting optimal health.",
+                 when=[('molecular_score', '>=', 80)], group='score'),
+            Rule("Good molecular balance with room for improvement in specific areas.",
+                 when=[('molecular_score', '>=', 60)], group='score'),
+            Rule("Your molecular balance indicates significant opportunities for nutrition optimization.",
+                 group='score'),
+            
+            # Macronutrient insights
+            Rule("Adequate protein intake supports muscle maintenance and immune function.",
+                 when=[('protein', '>=', 80)], group='protein'),
+            Rule("Low protein intake may impact muscle mass and recovery.",
+                 when=[('protein', '<', 60)], group='protein'),
+            Rule("High carbohydrate intake may affect blood sugar stability.",
+                 when=[('carbs', '>', 300)], group='carbs'),
+            Rule("Low carbohydrate intake may impact energy levels and exercise performance.",
+                 when=[('carbs', '<', 150)], group='carbs'),
+            
+            # Medical condition insights
+            Rule("Good fiber intake supports blood sugar management.",
+                 when=[('medical_history', 'contains', 'diabetes'), ('fiber', '>=', 25)], group='diabetes'),
+            Rule("Increasing fiber intake can help with blood sugar control.",
+                 when=[('medical_history', 'contains', 'diabetes')], group='diabetes'),
+            Rule("Low sodium intake supports blood pressure management.",
+                 when=[('medical_history', 'contains', 'hypertension'), ('sodium', '<=', 2000)], group='hypertension'),
+            Rule("Reducing sodium intake can help lower blood pressure.",
+                 when=[('medical_history', 'contains', 'hypertension')], group='hypertension'),
+        ], defaults={'molecular_score': 0})
+    
+    def _rule_record(self, user_profile: Dict, molecular_score: float, nutrition: NutrientVector) -> Dict:
+        """Fields the recommendation and insight rules are evaluated on"""
+        record = nutrition.to_dict()
+        record['molecular_score'] = molecular_score
+        record['medical_history'] = user_profile.get('medical_history', [])
+        record['health_goals'] = user_profile.get('health_goals', [])
+        return record
+    
+    def generate_nutrition_recommendations(self, user_profile: Dict, meals: List[Dict], molecular_score: float,
+                                           daily_nutrition: Optional[Union[NutrientVector, Dict]] = None) -> List[Dict]:
+        """Generate personalized nutrition recommendations"""
+        daily_nutrition = self._daily_totals(meals, daily_nutrition)
+        record = self._rule_record(user_profile, molecular_score, daily_nutrition)
         
-        if 'hypertension' in medical_history:
-            sodium = daily_nutrition.get('sodium', 0)
-            if sodium <= 2000:
-                insights.append("Low sodium intake supports blood pressure management.")
-            else:
-                insights.append("Reducing sodium intake can help lower blood pressure.")
+        # Micronutrient adequacy against the general references
+        micro_analysis = self.analyze_micronutrients(meals, daily_nutrition)
+        for nutrient, analysis in micro_analysis.items():
+            record[f'{nutrient}_adequacy'] = analysis['adequacy_percentage']
         
-        return insights
+        return self.recommendation_rules.apply_one(record)
+    
+    def generate_health_insights(self, user_profile: Dict, meals: List[Dict], molecular_score: float,
+                                 daily_nutrition: Optional[Union[NutrientVector, Dict]] = None) -> List[str]:
+        """Generate health insights based on nutrition analysis"""
+        daily_nutrition = self._daily_totals(meals, daily_nutrition)
+        return self.insight_rules.apply_one(self._rule_record(user_profile, molecular_score, daily_nutrition))
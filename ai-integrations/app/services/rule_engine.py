@@ -0,0 +1,200 @@
+"""
+Declarative threshold rules compiled to vectorized NumPy evaluation
+"""
+
+import operator
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Comparison operators a condition can use; 'contains' tests list membership
+COMPARISONS = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+CONTAINS = 'contains'
+
+Condition = Tuple[str, str, Any]
+
+
+class Rule:
+    """An output emitted when every condition holds
+
+    Conditions are `(field, op, value)` tuples, e.g. `('glucose', '>', 100)`
+    or `('medical_history', 'contains', 'diabetes')`; a rule without
+    conditions always fires. Rules sharing a `group` behave like an
+    if/elif chain: only the first matching rule of the group fires. With
+    `template=True`, strings in the output are formatted with the row's
+    field values (e.g. "{fiber_adequacy:.1f}%").
+    """
+
+    __slots__ = ('output', 'when', 'group', 'template')
+
+    def __init__(self, output: Any, when: Sequence[Condition] = (),
+                 group: Optional[str] = None, template: bool = False):
+        for _, op, _ in when:
+            if op != CONTAINS and op not in COMPARISONS:
+                raise ValueError(f"Unknown rule operator: {op}")
+        self.output = output
+        self.when = tuple(when)
+        self.group = group
+        self.template = template
+
+    def render(self, row: Mapping[str, float]) -> Any:
+        """Output for one matching row"""
+        if not self.template:
+            return self.output
+        return _format_output(self.output, row)
+
+
+def _format_output(output: Any, row: Mapping[str, float]) -> Any:
+    """Format every string inside an output with the row's values"""
+    if isinstance(output, str):
+        return output.format_map(row)
+    if isinstance(output, dict):
+        return {key: _format_output(value, row) for key, value in output.items()}
+    if isinstance(output, (list, tuple)):
+        return type(output)(_format_output(value, row) for value in output)
+    return output
+
+
+class RuleSet:
+    """An ordered rule table compiled into column comparisons and a membership matrix
+
+    Rows are evaluated as a float matrix whose columns are `fields` (numeric
+    fields first, then one 0/1 column per `contains` test), so a single
+    user and a batch of thousands go through the same few array operations.
+    Outputs keep the order of the rule table.
+    """
+
+    def __init__(self, rules: Sequence[Rule], defaults: Optional[Dict[str, float]] = None):
+        self.rules = list(rules)
+        self.defaults = dict(defaults or {})
+
+        # Column layout: numeric fields, then (list field, item) membership flags
+        numeric_fields: List[str] = []
+        membership: List[Tuple[str, Any]] = []
+        for rule in self.rules:
+            for field, op, value in rule.when:
+                if op == CONTAINS:
+                    if (field, value) not in membership:
+                        membership.append((field, value))
+                elif field not in numeric_fields:
+                    numeric_fields.append(field)
+        self.numeric_fields = tuple(numeric_fields)
+        self.membership = tuple(membership)
+        self.fields = self.numeric_fields + tuple(f'{field}:{item}' for field, item in membership)
+        self._column = {field: i for i, field in enumerate(self.fields)}
+
+        # Distinct conditions as (column, op, threshold); membership flags are 0/1 columns
+        conditions: List[Tuple[int, str, float]] = []
+        condition_index: Dict[Tuple[int, str, float], int] = {}
+        requirements: List[List[int]] = []
+        for rule in self.rules:
+            required = []
+            for field, op, value in rule.when:
+                if op == CONTAINS:
+                    key = (self._column[f'{field}:{value}'], '>=', 1.0)
+                else:
+                    key = (self._column[field], op, float(value))
+                if key not in condition_index:
+                    condition_index[key] = len(conditions)
+                    conditions.append(key)
+                required.append(condition_index[key])
+            requirements.append(required)
+        self._condition_count = len(conditions)
+
+        # Orderings become one strict and one non-strict comparison on sign-adjusted
+        # columns (x < t is -x > -t); equality tests are compared as they are
+        self._comparisons = []
+        for compare, ops in ((operator.gt, ('>', '<')), (operator.ge, ('>=', '<=')),
+                             (operator.eq, ('==',)), (operator.ne, ('!=',))):
+            positions = [i for i, (_, op, _) in enumerate(conditions) if op in ops]
+            if positions:
+                signs = np.array([-1.0 if conditions[i][1] in ('<', '<=') else 1.0 for i in positions])
+                self._comparisons.append((
+                    compare,
+                    np.array(positions),
+                    np.array([conditions[i][0] for i in positions]),
+                    signs,
+                    signs * np.array([conditions[i][2] for i in positions])
+                ))
+
+        # condition x rule matrix: 1 where the rule requires the condition
+        self._requirement_matrix = np.zeros((len(conditions), len(self.rules)))
+        for position, required in enumerate(requirements):
+            self._requirement_matrix[required, position] = 1
+        self._required_counts = self._requirement_matrix.sum(axis=0)
+
+        # rule x rule matrix: 1 where the first rule precedes the second in a first-match group
+        self._precedes = np.zeros((len(self.rules), len(self.rules)))
+        groups: Dict[str, List[int]] = {}
+        for position, rule in enumerate(self.rules):
+            if rule.group is not None:
+                earlier = groups.setdefault(rule.group, [])
+                self._precedes[earlier, position] = 1
+                earlier.append(position)
+        self._has_groups = bool(self._precedes.any())
+
+    def to_matrix(self, records: Iterable[Mapping[str, Any]]) -> np.ndarray:
+        """Field matrix for dict records (missing fields take the defaults, else NaN)"""
+        defaults = [self.defaults.get(field, np.nan) for field in self.numeric_fields]
+        rows = []
+        for record in records:
+            row = [
+                value if value is not None else default
+                for value, default in zip(map(record.get, self.numeric_fields), defaults)
+            ]
+            row += [item in (record.get(field) or ()) for field, item in self.membership]
+            rows.append(row)
+        return np.array(rows, dtype=np.float64).reshape(len(rows), len(self.fields))
+
+    def evaluate(self, X: np.ndarray) -> np.ndarray:
+        """Boolean (rows x rules) matrix of the rules that fire for each row of a field matrix"""
+        X = np.asarray(X, dtype=np.float64)
+        satisfied = np.empty((X.shape[0], self._condition_count))
+        for compare, positions, columns, signs, thresholds in self._comparisons:
+            # NaN compares False, so a rule on a missing field does not fire
+            satisfied[:, positions] = compare(X[:, columns] * signs, thresholds)
+
+        # A rule fires when all of its conditions hold...
+        fired = satisfied @ self._requirement_matrix == self._required_counts
+
+        # ...and no earlier rule of its first-match group fired
+        if self._has_groups:
+            fired &= fired @ self._precedes == 0
+        return fired
+
+    def apply(self, X: np.ndarray) -> List[List[Any]]:
+        """Outputs of the fired rules for each row of a field matrix, in rule table order"""
+        X = np.asarray(X, dtype=np.float64)
+        rows, positions = np.nonzero(self.evaluate(X))
+
+        results: List[List[Any]] = [[] for _ in range(X.shape[0])]
+        rendered_rows: Dict[int, Dict[str, float]] = {}
+        rules = self.rules
+        for row, position in zip(rows.tolist(), positions.tolist()):
+            rule = rules[position]
+            if rule.template:
+                values = rendered_rows.get(row)
+                if values is None:
+                    values = rendered_rows[row] = dict(zip(self.fields, X[row].tolist()))
+                results[row].append(rule.render(values))
+            else:
+                results[row].append(rule.output)
+        return results
+
+    def apply_records(self, records: Sequence[Mapping[str, Any]]) -> List[List[Any]]:
+        """Outputs of the fired rules for each dict record"""
+        return self.apply(self.to_matrix(records))
+
+    def apply_one(self, record: Mapping[str, Any]) -> List[Any]:
+        """Outputs of the fired rules for a single dict record"""
+        return self.apply_records([record])[0]
@@ -0,0 +1,171 @@
+"""
+Fast JSON rendering of API responses, with native NumPy support, and
+MessagePack content negotiation for service-to-service callers
+"""
+
+from contextvars import ContextVar
+import json
+from typing import Any, Callable, Coroutine, Optional
+import logging
+
+import numpy as np
+from fastapi import HTTPException, Request, Response
+from fastapi.routing import APIRoute
+from pydantic import BaseModel
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; pydantic-core renders models without it
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional; without it every exchange stays JSON
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+# Names MessagePack goes by in Content-Type and Accept headers
+MSGPACK_MEDIA_TYPES = (MSGPACK_MEDIA_TYPE, "application/x-msgpack", "application/vnd.msgpack")
+
+# Response encoding negotiated for the request being handled (set by NegotiatedRoute)
+_response_media_type: ContextVar[str] = ContextVar("response_media_type", default=JSON_MEDIA_TYPE)
+
+
+def numpy_default(value: Any) -> Any:
+    """JSON-compatible stand-in for NumPy scalars and arrays"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def render_json(content: Any) -> bytes:
+    """Compact UTF-8 JSON for a response model or plain content
+
+    Pydantic models are serialized straight to JSON by pydantic-core (no
+    intermediate dict); other content goes through orjson when installed.
+    NumPy values are converted natively and NaN/inf render as null.
+    """
+    if isinstance(content, BaseModel):
+        return content.__pydantic_serializer__.to_json(content, fallback=numpy_default)
+    if orjson is not None:
+        return orjson.dumps(content, default=numpy_default,
+                            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=numpy_default, ensure_ascii=False,
+                      separators=(",", ":")).encode("utf-8")
+
+
+def render_msgpack(content: Any) -> bytes:
+    """MessagePack for a response model or plain content
+
+    Models are dumped in JSON mode first, so dates, enums and the like
+    arrive as the same values a JSON client would see.
+    """
+    if isinstance(content, BaseModel):
+        content = content.__pydantic_serializer__.to_python(content, mode="json", fallback=numpy_default)
+    return msgpack.packb(content, default=numpy_default)
+
+
+def _media_type(header: Optional[str]) -> str:
+    """Bare lower-case media type of a Content-Type header"""
+    return (header or "").split(";", 1)[0].strip().lower()
+
+
+def negotiate_media_type(accept: Optional[str]) -> str:
+    """MessagePack when the Accept header ranks it at least as high as JSON, else JSON"""
+    if not accept or msgpack is None:
+        return JSON_MEDIA_TYPE
+
+    qualities = {}
+    for item in accept.split(","):
+        media_type, *params = item.split(";")
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        media_type = media_type.strip().lower()
+        qualities[media_type] = max(quality, qualities.get(media_type, 0.0))
+
+    msgpack_quality = max(qualities.get(media_type, 0.0) for media_type in MSGPACK_MEDIA_TYPES)
+    json_quality = max(qualities.get(media_type, 0.0) for media_type in (JSON_MEDIA_TYPE, "application/*", "*/*"))
+    if msgpack_quality > 0 and msgpack_quality >= json_quality:
+        return MSGPACK_MEDIA_TYPE
+    return JSON_MEDIA_TYPE
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered by `render_json`
+
+    Endpoints can return `FastJSONResponse(model)` to skip FastAPI's
+    revalidation and dict round trip of an already-built response model.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return render_json(content)
+
+
+class NegotiatedResponse(FastJSONResponse):
+    """FastJSONResponse, or MessagePack when the request negotiated it through NegotiatedRoute"""
+
+    def __init__(self, content: Any, *args, **kwargs):
+        self.media_type = _response_media_type.get()
+        super().__init__(content, *args, **kwargs)
+
+    def render(self, content: Any) -> bytes:
+        if self.media_type == MSGPACK_MEDIA_TYPE:
+            return render_msgpack(content)
+        return render_json(content)
+
+
+class MsgPackRequest(Request):
+    """Request with a MessagePack body, handed to FastAPI as an already-decoded JSON body"""
+
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            self._json = msgpack.unpackb(await self.body())
+        return self._json
+
+
+class NegotiatedRoute(APIRoute):
+    """APIRoute that accepts and returns MessagePack alongside JSON
+
+    A request body sent as `Content-Type: application/msgpack` is decoded
+    and validated exactly like its JSON equivalent; `Accept:
+    application/msgpack` makes NegotiatedResponse encode the response as
+    MessagePack. JSON stays the default, and error responses are always
+    JSON. Without msgpack installed, MessagePack bodies are refused with
+    415 and responses fall back to JSON.
+    """
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+        route_handler = super().get_route_handler()
+
+        async def negotiated_route_handler(request: Request) -> Response:
+            if _media_type(request.headers.get("content-type")) in MSGPACK_MEDIA_TYPES:
+                if msgpack is None:
+                    raise HTTPException(status_code=415, detail="MessagePack is not supported by this server")
+                # FastAPI only calls json() on bodies it believes are JSON
+                scope = dict(request.scope)
+                scope["headers"] = [
+                    (name, JSON_MEDIA_TYPE.encode()) if name == b"content-type" else (name, value)
+                    for name, value in request.scope["headers"]
+                ]
+                request = MsgPackRequest(scope, request.receive)
+
+            token = _response_media_type.set(negotiate_media_type(request.headers.get("accept")))
+            try:
+                return await route_handler(request)
+            finally:
+                _response_media_type.reset(token)
+
+        return negotiated_route_handler
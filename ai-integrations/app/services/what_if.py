@@ -0,0 +1,138 @@
+"""
+Monte Carlo what-if simulation of nutrient intake changes
+"""
+
+from typing import Dict, List, Optional
+import logging
+
+import numpy as np
+
+from app.models.schema import (
+    BIOMARKERS, BIOMARKER_FEATURE_NUTRIENTS, BIOMARKER_FEATURES,
+    RISK_FEATURE_INDEX, RISK_MODEL_BIOMARKER_NAMES
+)
+from app.services.inference_pool import LocalInferenceBackend
+
+logger = logging.getLogger(__name__)
+
+# Nutrients that feed the models and can therefore be perturbed
+SIMULATED_NUTRIENTS = BIOMARKER_FEATURES[BIOMARKER_FEATURE_NUTRIENTS]
+
+# Percentiles reported for every outcome distribution
+OUTCOME_PERCENTILES = (5, 25, 50, 75, 95)
+
+# Risk levels used by prevention recommendations and monitoring schedules
+RISK_THRESHOLDS = {'moderate': 0.4, 'high': 0.7}
+
+
+class WhatIfSimulator:
+    """Sample intake changes and score every scenario in one batched model pass
+
+    All scenarios for a request are rows of one biomarker feature matrix;
+    predicted biomarkers are written into a matching risk feature matrix,
+    so each model runs once per request regardless of the scenario count.
+    The matrices are scored by `inference` (in-process by default, or a
+    ProcessInferenceBackend).
+    """
+
+    def __init__(self, biomarker_model, risk_model, max_scenarios: int = 50000, inference=None):
+        self.biomarker_model = biomarker_model
+        self.risk_model = risk_model
+        self.max_scenarios = max_scenarios
+        self.inference = inference or LocalInferenceBackend(biomarker_model, risk_model)
+
+    def sample_intakes(self, baseline: np.ndarray, perturbations: Dict[str, Dict],
+                       n_scenarios: int, rng: np.random.Generator) -> np.ndarray:
+        """Scenario intake matrix (scenarios x SIMULATED_NUTRIENTS) around a baseline intake"""
+        intakes = np.tile(baseline, (n_scenarios, 1))
+        for nutrient, perturbation in perturbations.items():
+            column = SIMULATED_NUTRIENTS.index(nutrient)
+            change = rng.uniform(perturbation['low'], perturbation['high'], n_scenarios)
+            if perturbation.get('relative'):
+                # Fractional change, e.g. -0.3..0 for "up to 30% less"
+                intakes[:, column] *= 1 + change
+            else:
+                # Absolute change in the nutrient's daily unit
+                intakes[:, column] += change
+        return np.maximum(intakes, 0)
+
+    def simulate(self, user_profile: Dict, nutrition_data: Dict, current_biomarkers: Dict,
+                 perturbations: Dict[str, Dict], n_scenarios: int = 1000,
+                 time_horizon_days: int = 30, seed: Optional[int] = None) -> Dict:
+        """Outcome distributions of biomarkers and risk scores over sampled intake scenarios"""
+        unknown = sorted(set(perturbations) - set(SIMULATED_NUTRIENTS))
+        if unknown:
+            raise ValueError(f"Cannot simulate {', '.join(unknown)}; "
+                             f"supported nutrients: {', '.join(SIMULATED_NUTRIENTS)}")
+        for nutrient, perturbation in perturbations.items():
+            if perturbation['low'] > perturbation['high']:
+                raise ValueError(f"{nutrient}: perturbation low must not exceed high")
+        if not 1 <= n_scenarios <= self.max_scenarios:
+            raise ValueError(f"n_scenarios must be between 1 and {self.max_scenarios}")
+
+        rng = np.random.default_rng(seed)
+
+        # Baseline row plus one row per scenario
+        biomarker_features = self.biomarker_model.prepare_features(user_profile, nutrition_data, current_biomarkers)
+        baseline_intake = biomarker_features[BIOMARKER_FEATURE_NUTRIENTS]
+        intakes = np.vstack([baseline_intake, self.sample_intakes(
+            baseline_intake, perturbations, n_scenarios, rng)])
+
+        X_biomarker = np.tile(biomarker_features, (len(intakes), 1))
+        X_biomarker[:, BIOMARKER_FEATURE_NUTRIENTS] = intakes
+        biomarkers = self.inference.predict_biomarker_matrix(X_biomarker, time_horizon_days)
+
+        # Risk outlook from each scenario's intake and predicted biomarkers
+        demographics = dict(user_profile)
+        demographics.setdefault('bmi', self._bmi(user_profile))
+        risk_features = self.risk_model._prepare_risk_features(
+            demographics, [nutrition_data], [current_biomarkers])
+        X_risk = np.tile(risk_features, (len(intakes), 1))
+        for column, nutrient in enumerate(SIMULATED_NUTRIENTS):
+            if nutrient in RISK_FEATURE_INDEX:
+                X_risk[:, RISK_FEATURE_INDEX[nutrient]] = intakes[:, column]
+        for biomarker in RISK_MODEL_BIOMARKER_NAMES:
+            X_risk[:, RISK_FEATURE_INDEX[biomarker]] = biomarkers[:, BIOMARKERS.index(biomarker)]
+        risks = self.inference.risk_score_matrix(X_risk)
+
+        return {
+            'n_scenarios': n_scenarios,
+            'time_horizon_days': time_horizon_days,
+            'intake': self._distributions(SIMULATED_NUTRIENTS, intakes),
+            'biomarkers': self._distributions(BIOMARKERS, biomarkers),
+            'risk_scores': self._distributions(self.risk_model.risk_categories, risks, RISK_THRESHOLDS)
+        }
+
+    @staticmethod
+    def _bmi(user_profile: Dict) -> float:
+        """BMI from weight and height, defaulting like the risk features"""
+        height_m = user_profile.get('height', 170) / 100
+        return user_profile.get('weight', 70) / height_m ** 2
+
+    @staticmethod
+    def _distributions(names: List[str], values: np.ndarray,
+                       thresholds: Optional[Dict[str, float]] = None) -> Dict:
+        """Baseline, spread and percentiles per column (row 0 is the unperturbed baseline)"""
+        baseline, scenarios = values[0], values[1:]
+        percentiles = np.percentile(scenarios, OUTCOME_PERCENTILES, axis=0)
+        means = scenarios.mean(axis=0)
+        stds = scenarios.std(axis=0)
+
+        distributions = {}
+        for column, name in enumerate(names):
+            distribution = {
+                'baseline': float(baseline[column]),
+                'mean': float(means[column]),
+                'std': float(stds[column]),
+                'mean_change': float(means[column] - baseline[column]),
+                'percentiles': {
+                    f'p{q}': float(value) for q, value in zip(OUTCOME_PERCENTILES, percentiles[:, column])
+                }
+            }
+            if thresholds:
+                distribution['probability_above'] = {
+                    level: float((scenarios[:, column] > threshold).mean())
+                    for level, threshold in thresholds.items()
+                }
+            distributions[name] = distribution
+        return distributions
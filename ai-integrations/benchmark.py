@@ -0,0 +1,134 @@
+"""
+Micro-benchmarks for the AI Integrations Service hot paths
+
+Times the per-request work behind each endpoint in-process (no HTTP) on
+payloads built from the synthetic cohorts, and measures the peak memory
+allocated per call with tracemalloc.
+
+Usage:
+    python benchmark.py
+    python benchmark.py --cases analysis,risk_features --repeat 2000
+"""
+
+import argparse
+import gc
+import logging
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+from load_test import RequestMixBuilder
+
+logger = logging.getLogger(__name__)
+
+
+class BenchmarkCase:
+    """A named callable run once per payload"""
+
+    def __init__(self, name: str, func: Callable, payloads: List):
+        self.name = name
+        self.func = func
+        self.payloads = payloads
+
+    def time_per_call(self, repeat: int) -> float:
+        """Mean wall time per call in microseconds"""
+        func, payloads = self.func, self.payloads
+        calls = 0
+        gc.disable()
+        try:
+            started = time.perf_counter()
+            while calls < repeat:
+                for payload in payloads:
+                    func(payload)
+                calls += len(payloads)
+            elapsed = time.perf_counter() - started
+        finally:
+            gc.enable()
+        return elapsed / calls * 1e6
+
+    def peak_bytes_per_call(self, sample: int = 200) -> float:
+        """Mean high-water mark of memory allocated during a single call (tracemalloc)"""
+        payloads = self.payloads[:sample]
+        gc.collect()
+        tracemalloc.start()
+        try:
+            total = 0
+            for payload in payloads:
+                baseline, _ = tracemalloc.get_traced_memory()
+                tracemalloc.reset_peak()
+                self.func(payload)
+                _, peak = tracemalloc.get_traced_memory()
+                total += peak - baseline
+        finally:
+            tracemalloc.stop()
+        return total / len(payloads)
+
+
+def build_cases(n_payloads: int) -> Dict[str, BenchmarkCase]:
+    """Benchmark cases over cohort payloads, keyed by name"""
+    from app import main
+    from app.services.serialization import render_json
+
+    builder = RequestMixBuilder(n_users=min(n_payloads, 500))
+    nutrition = [main.NutritionAnalysisRequest(**payload)
+                 for _, payload in builder.build({'/analyze-nutrition': 1}, n_payloads)]
+    biomarker = [main.BiomarkerPredictionRequest(**payload)
+                 for _, payload in builder.build({'/predict-biomarkers': 1}, n_payloads)]
+    health_risk = [main.HealthRiskAssessmentRequest(**payload)
+                   for _, payload in builder.build({'/assess-health-risk': 1}, n_payloads)]
+    # Multi-year daily histories (up to 3,000 entries)
+    long_history = [main.HealthRiskAssessmentRequest(**payload) for _, payload in RequestMixBuilder(
+        n_users=50, history_days=3000).build({'/assess-health-risk': 1}, min(n_payloads, 50))]
+
+    service = main.nutrition_service
+    cases = [
+        BenchmarkCase('daily_totals', lambda request: service._calculate_daily_nutrition(request.meals), nutrition),
+        BenchmarkCase('analysis', main.run_nutrition_analysis, nutrition),
+        BenchmarkCase('biomarker_features', main.prepare_biomarker_features, biomarker),
+        BenchmarkCase('risk_features', lambda request: main.risk_model._prepare_risk_features(
+            request.demographics, request.nutrition_history, request.biomarker_history), health_risk),
+        BenchmarkCase('risk_features_long', lambda request: main.risk_model._prepare_risk_features(
+            request.demographics, request.nutrition_history, request.biomarker_history), long_history),
+        BenchmarkCase('history_trends_long', lambda request: main.summarize_history_trends(
+            main.risk_model.summarize_history(request.nutrition_history, request.biomarker_history)),
+            long_history),
+        BenchmarkCase('risk_scores', main.calculate_health_risk_scores, health_risk),
+        BenchmarkCase('risk_assessment', main.assess_health_risks, health_risk),
+        # Response rendering alone, over responses built once up front
+        BenchmarkCase('serialize_analysis', render_json,
+                      [main.run_nutrition_analysis(request) for request in nutrition]),
+        BenchmarkCase('serialize_risk', render_json,
+                      [main.HealthRiskResponse(risk_scores=scores, risk_explanations=explanations,
+                                               risk_factors=main.identify_health_risk_factors(request),
+                                               prevention_recommendations=main.generate_prevention_recommendations(
+                                                   request, scores),
+                                               monitoring_schedule=main.create_monitoring_schedule(request, scores))
+                       for request in health_risk
+                       for scores, explanations in [main.assess_health_risks(request)]]),
+    ]
+    return {case.name: case for case in cases}
+
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Benchmark the service hot paths in-process")
+    parser.add_argument('--cases', help="comma-separated case names (default: all)")
+    parser.add_argument('--payloads', type=int, default=500, help="distinct payloads per case")
+    parser.add_argument('--repeat', type=int, default=5000, help="calls timed per case")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    cases = build_cases(args.payloads)
+    selected = args.cases.split(',') if args.cases else list(cases)
+
+    print(f"{'case':<22} {'us/call':>10} {'peak bytes':>11}")
+    for name in selected:
+        case = cases[name]
+        case.time_per_call(min(args.repeat, 500))  # warm up
+        micros = case.time_per_call(args.repeat)
+        peak_bytes = case.peak_bytes_per_call()
+        print(f"{name:<22} {micros:>10.2f} {peak_bytes:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
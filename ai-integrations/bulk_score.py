@@ -0,0 +1,317 @@
+"""
+Offline bulk scoring of user-day records stored in columnar files
+
+Reads Parquet (requires pyarrow) or CSV files of user-days, scores them with
+the same NutritionAnalysisService, BiomarkerPredictionModel and
+HealthRiskAssessmentModel logic as the API across a process pool, and
+writes one output part per input part. Each worker loads the models once.
+Output parts are named by the input rows they hold, e.g.
+days.rows-0000000000-0000050000.csv. Parts whose output already exists are
+skipped, so an interrupted run is resumed by running the same command again;
+a resume whose parts cover other row ranges (e.g. after changing
+--chunk-rows) is refused, since it would skip or duplicate rows, unless
+--overwrite is given.
+
+Input columns (missing columns or null values take the API defaults):
+    id, day                          passed through (see --keep-columns)
+    age, sex, weight, height, bmi, activity_level
+    health_goals, medical_history, family_history
+                                     lists (Parquet) or ';'-separated strings (CSV)
+    protein, carbs, fat, ...         daily nutrient totals (NUTRIENTS)
+    glucose, cholesterol, ...        current biomarkers (BIOMARKERS)
+
+Output columns: the kept columns, molecular_balance_score,
+predicted_<biomarker>, risk_<category> and error (null for scored rows).
+
+Usage:
+    python bulk_score.py history/ scores/ --workers 8
+    python bulk_score.py days.csv scores/ --chunk-rows 100000 --time-horizon-days 90
+"""
+
+import argparse
+import logging
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.models.healthcare_models import BiomarkerPredictionModel, HealthRiskAssessmentModel
+from app.models.schema import BIOMARKERS, NUTRIENTS, NutrientVector
+from app.services.nutrition_analysis import NutritionAnalysisService
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet support is optional
+    pa = pq = None
+
+logger = logging.getLogger(__name__)
+
+INPUT_SUFFIXES = ('.parquet', '.csv')
+
+# Inputs given as lists (Parquet) or ';'-separated strings (CSV)
+LIST_COLUMNS = ('health_goals', 'medical_history', 'family_history')
+
+# Numeric inputs; unparseable values fail their row
+NUMERIC_COLUMNS = ('age', 'weight', 'height', 'bmi') + tuple(NUTRIENTS) + tuple(BIOMARKERS)
+
+# A unit of work: (input path, part number, offset, first row, row count); Parquet parts
+# are row groups, CSV parts are runs of rows starting at a byte offset
+Part = Tuple[str, int, int, int, int]
+
+
+class ColumnarScorer:
+    """Score DataFrames of user-days with the service models, vectorized per chunk"""
+
+    def __init__(self, models_dir: str = 'models', time_horizon_days: int = 30):
+        self.time_horizon_days = time_horizon_days
+        self.nutrition_service = NutritionAnalysisService()
+        self.biomarker_model = BiomarkerPredictionModel()
+        self.risk_model = HealthRiskAssessmentModel()
+
+        biomarker_path = os.path.join(models_dir, 'biomarker_model.pkl')
+        if os.path.exists(biomarker_path):
+            self.biomarker_model.load_model(biomarker_path)
+        risk_path = os.path.join(models_dir, 'health_risk_model.pkl')
+        if os.path.exists(risk_path):
+            self.risk_model.load_model(risk_path)
+
+    def score(self, frame: pd.DataFrame, keep_columns: List[str]) -> pd.DataFrame:
+        """Scores for every row of an input frame, one output row per input row"""
+        n_rows = len(frame)
+        invalid = _invalid_values(frame)
+
+        # Feature matrices through the models' own pipelines, as the API builds them
+        features = frame.assign(**{name: _list_column(frame, name) for name in LIST_COLUMNS})
+        X_biomarker = self.biomarker_model.feature_pipeline.transform(features)
+        X_risk = self.risk_model.feature_pipeline.transform(features)
+
+        biomarkers = self.biomarker_model.predict_biomarker_matrix(X_biomarker, self.time_horizon_days)
+        risks = self.risk_model.risk_score_matrix(X_risk)
+
+        # The molecular balance score is rule-based per user profile
+        profiles = self._profiles(features, X_biomarker, self.biomarker_model.feature_pipeline.feature_index)
+        nutrients = np.column_stack([
+            pd.to_numeric(frame[name], errors='coerce').fillna(0.0).to_numpy(dtype=np.float64)
+            if name in frame.columns else np.zeros(n_rows)
+            for name in NUTRIENTS
+        ])
+        scores = np.array([
+            self.nutrition_service.calculate_molecular_balance_score(profile, [], NutrientVector(row))
+            for profile, row in zip(profiles, nutrients)
+        ])
+
+        out = frame[[name for name in keep_columns if name in frame.columns]].reset_index(drop=True)
+        out['molecular_balance_score'] = scores
+        for column, biomarker in enumerate(BIOMARKERS):
+            out[f'predicted_{biomarker}'] = biomarkers[:, column]
+        for column, category in enumerate(self.risk_model.risk_categories):
+            out[f'risk_{category}'] = risks[:, column]
+
+        # Rows with unparseable values are reported rather than scored with defaults
+        errors = np.full(n_rows, None, dtype=object)
+        for name, bad in invalid.items():
+            for row in np.flatnonzero(bad):
+                errors[row] = f"invalid {name}" if errors[row] is None else f"{errors[row]}, {name}"
+        failed = np.array([error is not None for error in errors], dtype=bool)
+        scored_columns = out.columns[out.columns.get_loc('molecular_balance_score'):]
+        out.loc[failed, scored_columns] = np.nan
+        out['error'] = errors
+        return out
+
+    @staticmethod
+    def _profiles(frame: pd.DataFrame, X_biomarker: np.ndarray, feature_index: Dict[str, int]) -> List[Dict]:
+        """User profile dicts for the nutrition analysis service, demographics as the pipeline filled them"""
+        n_rows = len(frame)
+        sex = frame['sex'].where(frame['sex'].notna(), 'male').tolist() if 'sex' in frame.columns \
+            else ['male'] * n_rows
+        activity = frame['activity_level'].where(frame['activity_level'].notna(), 'sedentary').tolist() \
+            if 'activity_level' in frame.columns else ['sedentary'] * n_rows
+        age, weight, height = (X_biomarker[:, feature_index[name]].tolist() for name in ('age', 'weight', 'height'))
+        return [
+            {'age': a, 'sex': s, 'weight': w, 'height': h, 'activity_level': level,
+             'health_goals': goals, 'medical_history': history}
+            for a, s, w, h, level, goals, history in zip(
+                age, sex, weight, height, activity, frame['health_goals'], frame['medical_history'])
+        ]
+
+
+def _invalid_values(frame: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """Masks of the rows whose numeric inputs are present but unparseable, by column"""
+    invalid = {}
+    for name in NUMERIC_COLUMNS:
+        if name not in frame.columns:
+            continue
+        raw = frame[name]
+        missing = pd.to_numeric(raw, errors='coerce').isna().to_numpy()
+        bad = missing & raw.notna().to_numpy() & (raw.astype(str).str.strip() != '').to_numpy()
+        if bad.any():
+            invalid[name] = bad
+    return invalid
+
+
+def _list_column(frame: pd.DataFrame, name: str) -> List[List[str]]:
+    """A list column as Python lists (CSV stores lists as ';'-separated strings)"""
+    if name not in frame.columns:
+        return [[] for _ in range(len(frame))]
+    lists = []
+    for value in frame[name].tolist():
+        if isinstance(value, str):
+            lists.append([item.strip() for item in value.split(';') if item.strip()])
+        elif value is None or (isinstance(value, float) and np.isnan(value)):
+            lists.append([])
+        else:
+            lists.append(list(value))
+    return lists
+
+
+def discover_parts(inputs: List[str], chunk_rows: int) -> List[Part]:
+    """Units of work for every input file: Parquet row groups, CSV row ranges"""
+    paths = []
+    for path in inputs:
+        if os.path.isdir(path):
+            paths += sorted(os.path.join(path, name) for name in os.listdir(path)
+                            if name.endswith(INPUT_SUFFIXES))
+        else:
+            paths.append(path)
+
+    parts: List[Part] = []
+    for path in paths:
+        if path.endswith('.parquet'):
+            if pq is None:
+                raise RuntimeError("Reading Parquet requires pyarrow (pip install pyarrow)")
+            metadata = pq.ParquetFile(path).metadata
+            offset = 0
+            for group in range(metadata.num_row_groups):
+                rows = metadata.row_group(group).num_rows
+                parts.append((path, group, offset, offset, rows))
+                offset += rows
+        elif path.endswith('.csv'):
+            # One record per line; remember where every chunk of rows starts
+            offsets, n_rows = [], 0
+            with open(path, 'rb') as f:
+                f.readline()  # header
+                position = f.tell()
+                for line in f:
+                    if n_rows % chunk_rows == 0:
+                        offsets.append(position)
+                    position += len(line)
+                    n_rows += 1
+            for part, offset in enumerate(offsets):
+                first = part * chunk_rows
+                parts.append((path, part, offset, first, min(chunk_rows, n_rows - first)))
+        else:
+            raise ValueError(f"Unsupported input file: {path}")
+    return parts
+
+
+def output_path(output_dir: str, part: Part) -> str:
+    """Output file of a part, in the input's format, named by its input row range"""
+    path, _, _, first, rows = part
+    stem, suffix = os.path.splitext(os.path.basename(path))
+    return os.path.join(output_dir, f"{stem}.rows-{first:010d}-{first + rows:010d}{suffix}")
+
+
+def mismatched_outputs(output_dir: str, parts: List[Part]) -> List[str]:
+    """Existing outputs of the inputs whose row ranges are not among the parts"""
+    expected = {output_path(output_dir, part) for part in parts}
+    outputs = set()
+    for path in {part[0] for part in parts}:
+        stem, suffix = os.path.splitext(os.path.basename(path))
+        pattern = re.compile(rf"{re.escape(stem)}\.rows-\d+-\d+{re.escape(suffix)}")
+        outputs |= {os.path.join(output_dir, name) for name in os.listdir(output_dir) if pattern.fullmatch(name)}
+    return sorted(outputs - expected)
+
+
+def read_part(part: Part) -> pd.DataFrame:
+    """The input rows of one part"""
+    path, number, offset, _, rows = part
+    if path.endswith('.parquet'):
+        return pq.ParquetFile(path).read_row_group(number).to_pandas()
+    header = pd.read_csv(path, nrows=0).columns
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return pd.read_csv(f, header=None, names=header, nrows=rows)
+
+
+def write_part(frame: pd.DataFrame, path: str):
+    """Write a finished part atomically, so a partial file never looks complete"""
+    temporary = f"{path}.tmp-{os.getpid()}"
+    if path.endswith('.parquet'):
+        pq.write_table(pa.Table.from_pandas(frame, preserve_index=False), temporary)
+    else:
+        frame.to_csv(temporary, index=False)
+    os.replace(temporary, path)
+
+
+# Per-process scorer, created once by the pool initializer
+_worker_scorer: Optional[ColumnarScorer] = None
+
+
+def _init_worker(models_dir: str, time_horizon_days: int):
+    """Load the models once per worker process"""
+    global _worker_scorer
+    logging.basicConfig(level=logging.WARNING)
+    _worker_scorer = ColumnarScorer(models_dir, time_horizon_days)
+
+
+def _score_part(part: Part, output_dir: str, keep_columns: List[str]) -> Tuple[Part, int, int, float]:
+    """Score one part in a worker: (part, rows, error rows, seconds)"""
+    start = time.perf_counter()
+    scored = _worker_scorer.score(read_part(part), keep_columns)
+    write_part(scored, output_path(output_dir, part))
+    return part, len(scored), int(scored['error'].notna().sum()), time.perf_counter() - start
+
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Score columnar user-day files with the service models")
+    parser.add_argument('inputs', nargs='+', help="input .parquet/.csv files or directories")
+    parser.add_argument('output_dir', help="directory for the scored parts")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument('--models-dir', default='models', help="directory of trained model files")
+    parser.add_argument('--chunk-rows', type=int, default=50000, help="rows per CSV part")
+    parser.add_argument('--time-horizon-days', type=int, default=30)
+    parser.add_argument('--keep-columns', default='id,day', help="input columns copied to the output")
+    parser.add_argument('--overwrite', action='store_true',
+                        help="rescore parts that already have output, removing outputs of other row ranges")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    os.makedirs(args.output_dir, exist_ok=True)
+    keep_columns = [name for name in args.keep_columns.split(',') if name]
+
+    parts = discover_parts(args.inputs, args.chunk_rows)
+    mismatched = mismatched_outputs(args.output_dir, parts)
+    if mismatched and not args.overwrite:
+        parser.error(f"{len(mismatched)} existing outputs cover other row ranges than this run's parts "
+                     f"(e.g. {mismatched[0]}); rerun with the original --chunk-rows, or --overwrite")
+    for path in mismatched:
+        os.remove(path)
+    pending = [part for part in parts
+               if args.overwrite or not os.path.exists(output_path(args.output_dir, part))]
+    logger.info(f"{len(parts)} parts, {len(parts) - len(pending)} already scored, {len(pending)} to go")
+    if not pending:
+        return
+
+    start = time.perf_counter()
+    total_rows = 0
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                             initargs=(args.models_dir, args.time_horizon_days)) as pool:
+        futures = [pool.submit(_score_part, part, args.output_dir, keep_columns) for part in pending]
+        for done, future in enumerate(as_completed(futures), 1):
+            part, rows, errors, seconds = future.result()
+            total_rows += rows
+            logger.info(f"[{done}/{len(pending)}] {output_path(args.output_dir, part)}: "
+                        f"{rows} rows, {errors} errors, {seconds:.1f}s")
+
+    elapsed = time.perf_counter() - start
+    logger.info(f"Scored {total_rows} rows in {elapsed:.1f}s ({total_rows / elapsed:.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Throughput scaling of the inference backends
+
+Drives the in-process ("thread") backend and the worker-process
+("process") backend with 1..N concurrent callers, and reports:
+
+- batch: each caller scores a fixed feature batch through the biomarker
+  and risk models in turn (what-if and bulk scoring), in rows per second;
+- single: each caller makes the one-row calls behind /predict-biomarkers
+  and /assess-health-risk in turn (trajectory with intervals, risk scores
+  with explanations), in requests per second.
+
+Threads share one GIL; worker processes do not, so the process backend
+should keep scaling up to the number of cores, less the pipe round trip
+that dominates single requests.
+
+Uses the saved models in --models-dir, or fits synthetic ones of the same
+shape into a temporary directory when none are saved.
+
+Usage:
+    python inference_benchmark.py
+    python inference_benchmark.py --workers 1,2,4,8,16 --rows 256 --seconds 5
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Callable, List
+
+import numpy as np
+
+from app.models.healthcare_models import BiomarkerPredictionModel, HealthRiskAssessmentModel
+from app.models.schema import BIOMARKER_FEATURES, BIOMARKERS, RISK_CATEGORIES, RISK_FEATURES
+from app.services.inference_pool import LocalInferenceBackend, ProcessInferenceBackend
+
+logger = logging.getLogger(__name__)
+
+BIOMARKER_MODEL_FILE = 'biomarker_model.pkl'
+RISK_MODEL_FILE = 'health_risk_model.pkl'
+
+
+def fit_synthetic_models(models_dir: str, n_samples: int = 2000, seed: int = 0):
+    """Train and save models of the service's shape on random data"""
+    rng = np.random.default_rng(seed)
+    X = rng.normal(50, 10, size=(n_samples, len(BIOMARKER_FEATURES)))
+    biomarker_model = BiomarkerPredictionModel()
+    biomarker_model.train(X, {biomarker: X[:, i] + rng.normal(size=n_samples)
+                              for i, biomarker in enumerate(BIOMARKERS)})
+    biomarker_model.save_model(os.path.join(models_dir, BIOMARKER_MODEL_FILE))
+
+    X = rng.normal(50, 10, size=(n_samples, len(RISK_FEATURES)))
+    risk_model = HealthRiskAssessmentModel()
+    risk_model.train(X, {category: (X[:, i] + rng.normal(size=n_samples) > 50).astype(int)
+                         for i, category in enumerate(RISK_CATEGORIES)})
+    risk_model.save_model(os.path.join(models_dir, RISK_MODEL_FILE))
+
+
+def load_local_backend(models_dir: str) -> LocalInferenceBackend:
+    """In-process backend over the saved models"""
+    biomarker_model, risk_model = BiomarkerPredictionModel(), HealthRiskAssessmentModel()
+    biomarker_model.load_model(os.path.join(models_dir, BIOMARKER_MODEL_FILE))
+    risk_model.load_model(os.path.join(models_dir, RISK_MODEL_FILE))
+    return LocalInferenceBackend(biomarker_model, risk_model)
+
+
+def batch_calls(backend, rows: int, seed: int = 1) -> List[Callable]:
+    """Matrix calls over `rows` random feature rows, biomarkers then risks"""
+    rng = np.random.default_rng(seed)
+    X_biomarker = rng.normal(50, 10, size=(rows, len(BIOMARKER_FEATURES)))
+    X_risk = rng.normal(50, 10, size=(rows, len(RISK_FEATURES)))
+    return [
+        lambda: backend.predict_biomarker_matrix(X_biomarker, 30),
+        lambda: backend.risk_score_matrix(X_risk)
+    ]
+
+
+def single_calls(backend, seed: int = 1) -> List[Callable]:
+    """The one-row calls of a biomarker prediction and a risk assessment"""
+    rng = np.random.default_rng(seed)
+    biomarker_features = rng.normal(50, 10, size=len(BIOMARKER_FEATURES))
+    risk_features = rng.normal(50, 10, size=len(RISK_FEATURES))
+    return [
+        lambda: backend.predict_biomarker_trajectory(biomarker_features, [30]),
+        lambda: backend.assess_feature_row(risk_features)
+    ]
+
+
+def calls_per_second(calls: List[Callable], callers: int, seconds: float) -> float:
+    """Calls completed per second by `callers` threads taking turns through `calls`"""
+    for call in calls:  # warm up (and start worker processes)
+        call()
+
+    counts = [0] * callers
+    stop = threading.Event()
+
+    def caller(index: int):
+        while not stop.is_set():
+            calls[counts[index] % len(calls)]()
+            counts[index] += 1
+
+    threads = [threading.Thread(target=caller, args=(index,)) for index in range(callers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / (time.perf_counter() - started)
+
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Compare thread and process inference backend scaling")
+    parser.add_argument('--models-dir', default='models', help="directory with the saved models")
+    parser.add_argument('--workers', default='1,2,4,8,16', help="comma-separated caller/worker counts")
+    parser.add_argument('--rows', type=int, default=256, help="rows per model call")
+    parser.add_argument('--seconds', type=float, default=3.0, help="measurement time per setting")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    with tempfile.TemporaryDirectory() as scratch:
+        models_dir = args.models_dir
+        if not all(os.path.exists(os.path.join(models_dir, name)) for name in (BIOMARKER_MODEL_FILE, RISK_MODEL_FILE)):
+            print(f"No saved models in {models_dir}; fitting synthetic ones")
+            models_dir = scratch
+            fit_synthetic_models(models_dir)
+
+        local = load_local_backend(models_dir)
+        print(f"{os.cpu_count()} CPUs, {args.rows} rows per batch call")
+        print(f"{'workers':>7} {'thread rows/s':>14} {'process rows/s':>15} {'speedup':>8} "
+              f"{'thread req/s':>13} {'process req/s':>14} {'speedup':>8}")
+        for workers in [int(value) for value in args.workers.split(',')]:
+            thread_rows = calls_per_second(batch_calls(local, args.rows), workers, args.seconds) * args.rows
+            thread_requests = calls_per_second(single_calls(local), workers, args.seconds)
+            pool = ProcessInferenceBackend(os.path.join(models_dir, BIOMARKER_MODEL_FILE),
+                                           os.path.join(models_dir, RISK_MODEL_FILE), workers=workers)
+            try:
+                process_rows = calls_per_second(batch_calls(pool, args.rows), workers, args.seconds) * args.rows
+                process_requests = calls_per_second(single_calls(pool), workers, args.seconds)
+            finally:
+                pool.close()
+            print(f"{workers:>7} {thread_rows:>14.0f} {process_rows:>15.0f} {process_rows / thread_rows:>7.2f}x "
+                  f"{thread_requests:>13.0f} {process_requests:>14.0f} {process_requests / thread_requests:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,385 @@
+"""
+Load-testing harness for the AI Integrations Service
+
+Drives the three prediction endpoints with a realistic request mix built from
+the synthetic training cohorts, either in-process or against a running
+uvicorn, and reports throughput and latency percentiles at increasing
+concurrency levels.
+
+Usage:
+    python load_test.py --in-process --concurrency 1,4,16,64
+    python load_test.py --url http://localhost:8000 --duration 20
+    python load_test.py --spawn-workers 1,2,4 --concurrency 1,8,32,128
+
+The request mix cycles through a fixed set of payloads, so in-process and
+spawned servers run with the response cache disabled unless --cache is given;
+otherwise every request after the first pass would be a cache hit. A service
+started separately for --url should set RESPONSE_CACHE_MAX_ENTRIES=0 itself.
+
+Requires httpx (pip install httpx).
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from train_models import HealthcareDataTrainer
+from train_molecular_models import MolecularHealthTrainer
+
+logger = logging.getLogger(__name__)
+
+ENDPOINTS = ['/analyze-nutrition', '/predict-biomarkers', '/assess-health-risk']
+
+# Share of each daily total eaten at breakfast, lunch, dinner and snacks
+MEAL_SPLIT = {'breakfast': 0.25, 'lunch': 0.35, 'dinner': 0.3, 'snack': 0.1}
+
+NUTRITION_KEYS = ['protein', 'carbs', 'fat', 'fiber', 'vitamin_c', 'vitamin_d',
+                  'calcium', 'iron', 'sodium', 'sugar']
+BIOMARKER_KEYS = ['glucose', 'cholesterol', 'blood_pressure_systolic', 'blood_pressure_diastolic',
+                  'hba1c', 'triglycerides', 'hdl', 'ldl']
+HISTORY_BIOMARKER_KEYS = ['glucose', 'cholesterol', 'hba1c', 'triglycerides', 'hdl', 'ldl',
+                          'crp', 'insulin']
+
+
+class RequestMixBuilder:
+    """Build request payloads for all endpoints from the synthetic cohorts"""
+
+    def __init__(self, n_users: int = 200, history_days: int = 30, seed: int = 42):
+        self.n_users = n_users
+        self.history_days = history_days
+        self.rng = np.random.default_rng(seed)
+
+        # Both generators reseed the global RNG, so build them once up front
+        self.healthcare_df = HealthcareDataTrainer().generate_synthetic_healthcare_data(n_users)
+        self.molecular_df = MolecularHealthTrainer().generate_molecular_health_data(n_users)
+
+    def build(self, mix: Dict[str, float], n_requests: int) -> List[Tuple[str, Dict]]:
+        """Build a shuffled list of (path, payload) pairs following the endpoint mix"""
+        builders = {
+            '/analyze-nutrition': self.nutrition_payload,
+            '/predict-biomarkers': self.biomarker_payload,
+            '/assess-health-risk': self.health_risk_payload
+        }
+
+        paths = list(mix.keys())
+        weights = np.array([mix[path] for path in paths], dtype=float)
+        chosen = self.rng.choice(len(paths), size=n_requests, p=weights / weights.sum())
+        users = self.rng.integers(0, self.n_users, size=n_requests)
+
+        return [(paths[i], builders[paths[i]](int(user))) for i, user in zip(chosen, users)]
+
+    def _daily_nutrition(self, row, scale: float = 1.0) -> Dict:
+        """Daily nutrition totals for a cohort row, clipped at zero"""
+        return {key: max(0.0, float(row[key]) * scale) for key in NUTRITION_KEYS}
+
+    def nutrition_payload(self, user: int) -> Dict:
+        """Payload for /analyze-nutrition with the day split into meals"""
+        row = self.healthcare_df.iloc[user]
+        daily = self._daily_nutrition(row, scale=self.rng.normal(1.0, 0.1))
+
+        meals = []
+        for meal_type, share in MEAL_SPLIT.items():
+            total_nutrition = {key: value * share for key, value in daily.items()}
+            total_nutrition['calories'] = (total_nutrition['protein'] * 4 + total_nutrition['carbs'] * 4 +
+                                           total_nutrition['fat'] * 9)
+            meals.append({'meal_type': meal_type, 'total_nutrition': total_nutrition})
+
+        return {
+            'age': int(row['age']),
+            'sex': row['sex'],
+            'weight': float(row['weight']),
+            'height': float(row['height']),
+            'activity_level': row['activity_level'],
+            'health_goals': list(row['health_goals']),
+            'medical_history': list(row['medical_history']),
+            'meals': meals,
+            'biomarkers': {key: float(row[key]) for key in BIOMARKER_KEYS}
+        }
+
+    def biomarker_payload(self, user: int) -> Dict:
+        """Payload for /predict-biomarkers"""
+        row = self.healthcare_df.iloc[user]
+        return {
+            'user_profile': {
+                'age': float(row['age']),
+                'weight': float(row['weight']),
+                'height': float(row['height']),
+                'sex': row['sex']
+            },
+            'nutrition_data': self._daily_nutrition(row),
+            'current_biomarkers': {key: float(row[key]) for key in BIOMARKER_KEYS},
+            'time_horizon_days': int(self.rng.choice([30, 90, 180, 365]))
+        }
+
+    def health_risk_payload(self, user: int) -> Dict:
+        """Payload for /assess-health-risk with daily nutrition and biomarker history"""
+        row = self.healthcare_df.iloc[user]
+        molecular_row = self.molecular_df.iloc[user]
+        days = max(1, int(self.rng.integers(1, self.history_days + 1)))
+
+        nutrition_history = [self._daily_nutrition(row, scale=self.rng.normal(1.0, 0.15)) for _ in range(days)]
+        biomarker_history = [
+            {key: float(molecular_row[key]) * float(self.rng.normal(1.0, 0.05)) for key in HISTORY_BIOMARKER_KEYS}
+            for _ in range(max(1, days // 7))
+        ]
+
+        return {
+            'demographics': {
+                'age': float(row['age']),
+                'weight': float(row['weight']),
+                'height': float(row['height']),
+                'sex': row['sex'],
+                'bmi': float(row['bmi']),
+                'family_history': list(row['family_history'])
+            },
+            'nutrition_history': nutrition_history,
+            'biomarker_history': biomarker_history,
+            'family_history': list(row['family_history'])
+        }
+
+
+class LevelResult:
+    """Latency samples and status counts collected at one concurrency level"""
+
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self.latencies: Dict[str, List[float]] = {path: [] for path in ENDPOINTS}
+        self.errors: Dict[str, int] = {path: 0 for path in ENDPOINTS}
+        self.elapsed = 0.0
+
+    @property
+    def completed(self) -> int:
+        return sum(len(samples) for samples in self.latencies.values())
+
+    @property
+    def throughput(self) -> float:
+        return self.completed / self.elapsed if self.elapsed > 0 else 0.0
+
+    def percentiles(self, path: Optional[str] = None) -> Dict[str, float]:
+        """p50/p95/p99 latency in milliseconds for one endpoint or all of them"""
+        if path is None:
+            samples = [value for values in self.latencies.values() for value in values]
+        else:
+            samples = self.latencies[path]
+        if not samples:
+            return {'p50': 0.0, 'p95': 0.0, 'p99': 0.0}
+
+        p50, p95, p99 = np.percentile(np.asarray(samples) * 1000, [50, 95, 99])
+        return {'p50': float(p50), 'p95': float(p95), 'p99': float(p99)}
+
+    def to_dict(self) -> Dict:
+        return {
+            'concurrency': self.concurrency,
+            'completed': self.completed,
+            'errors': sum(self.errors.values()),
+            'elapsed_s': self.elapsed,
+            'throughput_rps': self.throughput,
+            'latency_ms': self.percentiles(),
+            'endpoints': {
+                path: {
+                    'completed': len(self.latencies[path]),
+                    'errors': self.errors[path],
+                    'latency_ms': self.percentiles(path)
+                }
+                for path in ENDPOINTS
+            }
+        }
+
+
+async def run_level(client, payloads: List[Tuple[str, Dict]], concurrency: int,
+                    duration: float, max_requests: Optional[int]) -> LevelResult:
+    """Keep `concurrency` requests in flight until the duration or request budget runs out"""
+    result = LevelResult(concurrency)
+    cursor = 0
+    started = time.perf_counter()
+    deadline = started + duration
+
+    async def worker():
+        nonlocal cursor
+        while time.perf_counter() < deadline:
+            if max_requests is not None and cursor >= max_requests:
+                return
+            path, payload = payloads[cursor % len(payloads)]
+            cursor += 1
+
+            sent = time.perf_counter()
+            try:
+                response = await client.post(path, json=payload)
+                ok = response.status_code == 200
+            except Exception as e:
+                logger.debug(f"Request to {path} failed: {e}")
+                ok = False
+
+            if ok:
+                result.latencies[path].append(time.perf_counter() - sent)
+            else:
+                result.errors[path] += 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+def find_saturation(results: List[LevelResult], tolerance: float = 0.05) -> Optional[int]:
+    """First concurrency level after which throughput stops growing by more than `tolerance`"""
+    for previous, current in zip(results, results[1:]):
+        if current.throughput < previous.throughput * (1 + tolerance):
+            return previous.concurrency
+    return None
+
+
+def print_report(label: str, results: List[LevelResult]):
+    """Print a throughput/latency table for one worker configuration"""
+    print(f"\n=== {label} ===")
+    print(f"{'conc':>6} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for result in results:
+        latency = result.percentiles()
+        print(f"{result.concurrency:>6} {result.throughput:>9.1f} {latency['p50']:>9.2f} "
+              f"{latency['p95']:>9.2f} {latency['p99']:>9.2f} {sum(result.errors.values()):>7}")
+
+    for path in ENDPOINTS:
+        row = ' '.join(f"{result.percentiles(path)['p99']:>9.2f}" for result in results)
+        print(f"  p99 {path:<22} {row}")
+
+    saturation = find_saturation(results)
+    if saturation is not None:
+        print(f"Saturation at concurrency {saturation} "
+              f"({max(result.throughput for result in results):.1f} req/s peak)")
+    else:
+        print("No saturation reached; try higher concurrency levels")
+
+
+async def sweep(client, payloads: List[Tuple[str, Dict]], levels: List[int],
+                duration: float, max_requests: Optional[int], warmup: int) -> List[LevelResult]:
+    """Run every concurrency level against one client"""
+    if warmup:
+        await run_level(client, payloads, min(levels), duration, warmup)
+
+    results = []
+    for concurrency in levels:
+        result = await run_level(client, payloads, concurrency, duration, max_requests)
+        logger.info(f"concurrency={concurrency} throughput={result.throughput:.1f} req/s")
+        results.append(result)
+    return results
+
+
+async def run_in_process(payloads, levels, duration, max_requests, warmup) -> List[LevelResult]:
+    """Drive the FastAPI app directly through an ASGI transport"""
+    import httpx
+    from app.main import app, load_models, open_stores
+
+    await open_stores()
+    await load_models()
+    async with httpx.AsyncClient(app=app, base_url="http://load-test") as client:
+        return await sweep(client, payloads, levels, duration, max_requests, warmup)
+
+
+async def run_remote(url, payloads, levels, duration, max_requests, warmup) -> List[LevelResult]:
+    """Drive a running service over HTTP"""
+    import httpx
+
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60.0) as client:
+        return await sweep(client, payloads, levels, duration, max_requests, warmup)
+
+
+def wait_until_healthy(url: str, timeout: float = 60.0):
+    """Poll /health until the spawned server answers"""
+    import httpx
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"{url}/health", timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError(f"Service at {url} did not become healthy within {timeout:.0f}s")
+
+
+def spawn_uvicorn(workers: int, port: int) -> subprocess.Popen:
+    """Start a local uvicorn with the given number of worker processes"""
+    command = [sys.executable, '-m', 'uvicorn', 'app.main:app', '--host', '127.0.0.1',
+               '--port', str(port), '--workers', str(workers), '--log-level', 'warning']
+    return subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """Parse an 'analyze:predict:assess' weight triple such as '2:1:1'"""
+    weights = [float(part) for part in value.split(':')]
+    if len(weights) != len(ENDPOINTS) or sum(weights) <= 0:
+        raise argparse.ArgumentTypeError("mix must be three non-negative weights, e.g. 2:1:1")
+    return {path: weight for path, weight in zip(ENDPOINTS, weights) if weight > 0}
+
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Load-test the AI Integrations Service")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--in-process', action='store_true', help="drive the app through ASGI in this process")
+    target.add_argument('--url', default='http://127.0.0.1:8000', help="base URL of a running service")
+    target.add_argument('--spawn-workers', help="comma-separated uvicorn worker counts to start and test")
+    parser.add_argument('--port', type=int, default=8765, help="port for spawned uvicorn servers")
+    parser.add_argument('--concurrency', default='1,2,4,8,16,32,64', help="comma-separated concurrency levels")
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds per concurrency level")
+    parser.add_argument('--max-requests', type=int, help="stop each level after this many requests")
+    parser.add_argument('--warmup', type=int, default=50, help="requests sent before measuring")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('2:1:1'),
+                        help="analyze:predict:assess request weights")
+    parser.add_argument('--users', type=int, default=200, help="synthetic users in the cohort")
+    parser.add_argument('--payloads', type=int, default=2000, help="distinct payloads to cycle through")
+    parser.add_argument('--cache', action='store_true',
+                        help="keep the response cache on for in-process and spawned servers")
+    parser.add_argument('--json', help="write the full results to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if not args.cache:
+        # Read when app.main is imported, here or in the spawned uvicorn workers
+        os.environ['RESPONSE_CACHE_MAX_ENTRIES'] = '0'
+    levels = sorted(int(level) for level in args.concurrency.split(','))
+
+    logger.info("Building request mix from synthetic cohorts...")
+    payloads = RequestMixBuilder(n_users=args.users).build(args.mix, args.payloads)
+
+    report = {}
+    if args.in_process:
+        results = asyncio.run(run_in_process(payloads, levels, args.duration, args.max_requests, args.warmup))
+        report['in-process'] = results
+    elif args.spawn_workers:
+        url = f"http://127.0.0.1:{args.port}"
+        for workers in (int(count) for count in args.spawn_workers.split(',')):
+            server = spawn_uvicorn(workers, args.port)
+            try:
+                wait_until_healthy(url)
+                results = asyncio.run(run_remote(url, payloads, levels, args.duration,
+                                                 args.max_requests, args.warmup))
+                report[f"uvicorn --workers {workers}"] = results
+            finally:
+                server.terminate()
+                server.wait()
+    else:
+        results = asyncio.run(run_remote(args.url, payloads, levels, args.duration, args.max_requests, args.warmup))
+        report[args.url] = results
+
+    for label, results in report.items():
+        print_report(label, results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({label: [result.to_dict() for result in results] for label, results in report.items()},
+                      f, indent=2)
+        logger.info(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Accuracy and throughput of float32 model serving against float64
+
+Trains the biomarker and risk models on part of the synthetic training
+cohort, then scores the held-out rest at both MODEL_PRECISIONS: features
+are built by the models' pipelines, scaled and run through the trees at
+that precision. Reports how far float32 predictions and risk scores drift
+from float64 (and how many risk scores change band or class), then the
+feature bytes per row and rows scored per second for single records,
+batches and bulk matrices.
+
+Usage:
+    python precision_benchmark.py
+    python precision_benchmark.py --samples 5000 --batch-sizes 1,64,1024 --repeats 5
+"""
+
+import argparse
+import logging
+import time
+from typing import Callable, Dict
+
+import numpy as np
+from sklearn.model_selection import train_test_split
+
+from app.models.healthcare_models import MODEL_PRECISIONS
+from app.models.schema import BIOMARKERS, RISK_CATEGORIES
+from app.services.what_if import RISK_THRESHOLDS
+from train_models import HealthcareDataTrainer
+
+logger = logging.getLogger(__name__)
+
+
+def best_seconds(call: Callable, repeats: int) -> float:
+    """Fastest of `repeats` timed calls (after one warm-up call)"""
+    call()
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def risk_bands(scores: np.ndarray) -> np.ndarray:
+    """Index of each score's band under the what-if RISK_THRESHOLDS (0 = low)"""
+    return np.searchsorted(sorted(RISK_THRESHOLDS.values()), scores, side='right')
+
+
+def score_cohort(trainer: HealthcareDataTrainer, cohort, dtype) -> Dict[str, np.ndarray]:
+    """Biomarker predictions and risk scores of every cohort row at `dtype` precision"""
+    trainer.biomarker_model.dtype = trainer.risk_model.dtype = dtype
+    biomarker_X = trainer.biomarker_model.feature_pipeline.transform(cohort, dtype)
+    risk_X = trainer.risk_model.feature_pipeline.transform(cohort, dtype)
+    return {
+        'biomarkers': trainer.biomarker_model.predict_biomarker_matrix(biomarker_X, 30),
+        'risks': trainer.risk_model.risk_score_matrix(risk_X)
+    }
+
+
+def report_accuracy(trainer: HealthcareDataTrainer, cohort, risk_targets: Dict[str, np.ndarray]):
+    """float32 deltas against float64 on the held-out cohort"""
+    reference = score_cohort(trainer, cohort, np.float64)
+    reduced = score_cohort(trainer, cohort, np.float32)
+
+    print(f"\nHeld-out cohort: {len(cohort)} rows")
+    print(f"{'biomarker':<26} {'max |delta|':>12} {'max rel':>10} {'rows changed':>13}")
+    for column, biomarker in enumerate(BIOMARKERS):
+        delta = np.abs(reduced['biomarkers'][:, column] - reference['biomarkers'][:, column])
+        relative = delta / np.maximum(np.abs(reference['biomarkers'][:, column]), 1e-12)
+        print(f"{biomarker:<26} {delta.max():>12.3g} {relative.max():>10.3g} {np.count_nonzero(delta):>13}")
+
+    print(f"\n{'risk category':<26} {'max |delta|':>12} {'band flips':>11} {'acc f64':>8} {'acc f32':>8}")
+    for column, category in enumerate(RISK_CATEGORIES):
+        base, low = reference['risks'][:, column], reduced['risks'][:, column]
+        flips = np.count_nonzero(risk_bands(base) != risk_bands(low))
+        target = risk_targets.get(category)
+        accuracy = ['-', '-'] if target is None else [
+            f"{np.mean((scores > 0.5) == target):.4f}" for scores in (base, low)]
+        print(f"{category:<26} {np.abs(low - base).max():>12.3g} {flips:>11} {accuracy[0]:>8} {accuracy[1]:>8}")
+
+
+def report_throughput(trainer: HealthcareDataTrainer, cohort, batch_sizes, repeats: int):
+    """Feature bytes and rows per second of feature building + scaling + trees, per precision"""
+    biomarker_model, risk_model = trainer.biomarker_model, trainer.risk_model
+    records = cohort.to_dict('records')
+    columns = len(biomarker_model.feature_pipeline.feature_names) + len(risk_model.feature_pipeline.feature_names)
+
+    print(f"\n{'rows':>6} " + " ".join(f"{name + ' rows/s':>15}" for name in MODEL_PRECISIONS) + f" {'speedup':>8}")
+    for rows in batch_sizes:
+        rates = []
+        for dtype in MODEL_PRECISIONS.values():
+            biomarker_model.dtype = risk_model.dtype = dtype
+            batch = cohort.iloc[:rows]
+            if rows == 1:
+                # A single request: per-record features, as the endpoints build them
+                record = records[0]
+
+                def call():
+                    biomarker_model.predict_biomarker_matrix(
+                        biomarker_model.feature_pipeline.transform_one(record, dtype)[np.newaxis], 30)
+                    risk_model.risk_score_matrix(risk_model.feature_pipeline.transform_one(record, dtype)[np.newaxis])
+            else:
+                def call():
+                    biomarker_model.predict_biomarker_matrix(biomarker_model.feature_pipeline.transform(batch, dtype), 30)
+                    risk_model.risk_score_matrix(risk_model.feature_pipeline.transform(batch, dtype))
+            rates.append(len(batch) / best_seconds(call, repeats))
+        print(f"{rows:>6} " + " ".join(f"{rate:>15.0f}" for rate in rates) + f" {rates[1] / rates[0]:>7.2f}x")
+
+    for name, dtype in MODEL_PRECISIONS.items():
+        # Feature matrix written by the pipeline, read by the scaler; scaled matrix written and read by the trees
+        itemsize = np.dtype(dtype).itemsize
+        print(f"{name}: {columns * itemsize} feature bytes per row, ~{4 * columns * itemsize} bytes moved per row")
+
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Compare float32 and float64 model serving")
+    parser.add_argument('--samples', type=int, default=4000, help="synthetic cohort size")
+    parser.add_argument('--holdout', type=float, default=0.25, help="fraction of the cohort held out")
+    parser.add_argument('--batch-sizes', default='1,64,1024', help="comma-separated rows per call")
+    parser.add_argument('--repeats', type=int, default=5, help="timed calls per setting (best is kept)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    trainer = HealthcareDataTrainer()
+    cohort = trainer.generate_synthetic_healthcare_data(args.samples)
+    training, held_out = train_test_split(cohort, test_size=args.holdout, random_state=42)
+    held_out = held_out.reset_index(drop=True)
+
+    print(f"Training on {len(training)} synthetic rows...")
+    _, (biomarker_X, biomarker_y), (risk_X, risk_y) = trainer.prepare_training_data(training)
+    trainer.biomarker_model.train(biomarker_X, biomarker_y)
+    trainer.risk_model.train(risk_X, risk_y)
+
+    _, _, (_, risk_targets) = trainer.prepare_training_data(held_out)
+    report_accuracy(trainer, held_out, risk_targets)
+    batch_sizes = [min(int(value), len(held_out)) for value in args.batch_sizes.split(',')]
+    report_throughput(trainer, held_out, batch_sizes, args.repeats)
+
+
+if __name__ == "__main__":
+    main()
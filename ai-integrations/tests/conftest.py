@@ -0,0 +1,11 @@
+"""
+Shared test setup: the service is imported from this directory, with in-memory stores
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("FEATURE_STORE_PATH", ":memory:")
+os.environ.setdefault("COHORT_ANALYTICS_PATH", ":memory:")
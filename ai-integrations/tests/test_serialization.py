@@ -0,0 +1,115 @@
+"""
+JSON and MessagePack content negotiation on the analysis endpoints
+"""
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.services import serialization
+from app.services.serialization import JSON_MEDIA_TYPE, MSGPACK_MEDIA_TYPE, negotiate_media_type
+from load_test import RequestMixBuilder
+
+requires_msgpack = pytest.mark.skipif(serialization.msgpack is None, reason="msgpack is not installed")
+
+ENDPOINTS = ('/analyze-nutrition', '/predict-biomarkers', '/assess-health-risk')
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture(scope="module")
+def payloads():
+    """One synthetic request per endpoint"""
+    builder = RequestMixBuilder(n_users=5, seed=3)
+    return {path: builder.build({path: 1}, 1)[0][1] for path in ENDPOINTS}
+
+
+def msgpack_post(client, path, body, accept=MSGPACK_MEDIA_TYPE):
+    return client.post(path, content=body, headers={"Content-Type": MSGPACK_MEDIA_TYPE, "Accept": accept})
+
+
+@requires_msgpack
+@pytest.mark.parametrize("path", ENDPOINTS)
+def test_msgpack_round_trip_matches_json(client, payloads, path):
+    expected = client.post(path, json=payloads[path])
+    assert expected.status_code == 200
+    assert expected.headers["content-type"].startswith(JSON_MEDIA_TYPE)
+
+    response = msgpack_post(client, path, serialization.msgpack.packb(payloads[path]))
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith(MSGPACK_MEDIA_TYPE)
+    assert serialization.msgpack.unpackb(response.content) == expected.json()
+
+
+@requires_msgpack
+@pytest.mark.parametrize("path", ENDPOINTS)
+def test_msgpack_request_with_json_response(client, payloads, path):
+    expected = client.post(path, json=payloads[path])
+    response = msgpack_post(client, path, serialization.msgpack.packb(payloads[path]), accept=JSON_MEDIA_TYPE)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith(JSON_MEDIA_TYPE)
+    assert response.json() == expected.json()
+
+
+@requires_msgpack
+def test_malformed_msgpack_body_is_rejected(client):
+    # 0xc1 is never used by the MessagePack format
+    response = msgpack_post(client, '/predict-biomarkers', b"\xc1\x00")
+    assert response.status_code == 400
+    assert response.headers["content-type"].startswith(JSON_MEDIA_TYPE)
+
+
+@requires_msgpack
+def test_invalid_msgpack_field_is_a_validation_error(client, payloads):
+    payload = {**payloads['/analyze-nutrition'], 'age': "not a number"}
+    response = msgpack_post(client, '/analyze-nutrition', serialization.msgpack.packb(payload))
+    assert response.status_code == 422
+    assert response.headers["content-type"].startswith(JSON_MEDIA_TYPE)
+    assert response.json()["detail"][0]["loc"] == ["body", "age"]
+
+
+@requires_msgpack
+@pytest.mark.parametrize("accept, expected", [
+    (None, JSON_MEDIA_TYPE),
+    ("*/*", JSON_MEDIA_TYPE),
+    (MSGPACK_MEDIA_TYPE, MSGPACK_MEDIA_TYPE),
+    ("application/json, application/msgpack", MSGPACK_MEDIA_TYPE),
+    ("application/json;q=0.9, application/msgpack", MSGPACK_MEDIA_TYPE),
+    ("application/msgpack;q=0.5, application/json", JSON_MEDIA_TYPE),
+    ("application/msgpack;q=0.5, */*;q=0.8", JSON_MEDIA_TYPE),
+    ("application/x-msgpack, */*;q=0.1", MSGPACK_MEDIA_TYPE),
+    ("application/vnd.msgpack;q=0.7, application/*;q=0.6", MSGPACK_MEDIA_TYPE),
+    ("application/msgpack;q=0", JSON_MEDIA_TYPE),
+    ("application/msgpack;q=oops", JSON_MEDIA_TYPE),
+])
+def test_accept_quality_ordering(accept, expected):
+    assert negotiate_media_type(accept) == expected
+
+
+@requires_msgpack
+def test_accept_quality_ordering_end_to_end(client, payloads):
+    path = '/predict-biomarkers'
+    preferred = client.post(path, json=payloads[path],
+                            headers={"Accept": "application/json;q=0.5, application/msgpack;q=0.8"})
+    assert preferred.headers["content-type"].startswith(MSGPACK_MEDIA_TYPE)
+    declined = client.post(path, json=payloads[path],
+                           headers={"Accept": "application/json;q=0.8, application/msgpack;q=0.5"})
+    assert declined.headers["content-type"].startswith(JSON_MEDIA_TYPE)
+
+
+def test_without_msgpack_bodies_are_refused_and_responses_stay_json(client, payloads, monkeypatch):
+    monkeypatch.setattr(serialization, "msgpack", None)
+
+    # An empty MessagePack map
+    response = msgpack_post(client, '/predict-biomarkers', b"\x80")
+    assert response.status_code == 415
+
+    path = '/predict-biomarkers'
+    response = client.post(path, json=payloads[path], headers={"Accept": MSGPACK_MEDIA_TYPE})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith(JSON_MEDIA_TYPE)
+    assert "predicted_values" in response.json()
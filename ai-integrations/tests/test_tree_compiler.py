@@ -0,0 +1,98 @@
+"""
+Compiled forests with the feature scaler folded into their thresholds
+"""
+
+import numpy as np
+import pytest
+from scipy.special import expit
+from sklearn.ensemble import GradientBoostingClassifier, RandomForestRegressor
+from sklearn.preprocessing import StandardScaler
+
+from app.models.tree_compiler import CompiledForest
+
+
+@pytest.fixture(scope="module")
+def cohort():
+    """Unscaled features of mixed magnitudes (some integer-valued, so rows tie on split values)"""
+    rng = np.random.default_rng(0)
+    n = 400
+    X = np.column_stack([
+        rng.normal(120, 35, n),
+        rng.integers(18, 90, n).astype(np.float64),
+        rng.lognormal(0, 1, n),
+        rng.normal(-3, 0.01, n),
+        rng.integers(0, 2, n).astype(np.float64),
+        rng.uniform(0, 5000, n)
+    ])
+    y = 0.02 * X[:, 0] + np.sin(X[:, 1] / 10) + np.log1p(X[:, 2]) + 50 * (X[:, 3] + 3) + X[:, 4] + rng.normal(0, 0.1, n)
+    return X, y
+
+
+@pytest.fixture(scope="module")
+def fitted(cohort):
+    X, y = cohort
+    scaler = StandardScaler().fit(X)
+    scaled = scaler.transform(X)
+    regressor = RandomForestRegressor(n_estimators=20, max_depth=8, random_state=0).fit(scaled, y)
+    classifier = GradientBoostingClassifier(n_estimators=30, max_depth=3, random_state=0).fit(
+        scaled, y > np.median(y))
+    return scaler, regressor, classifier
+
+
+def split_rows(forest: CompiledForest, X: np.ndarray, dtype) -> np.ndarray:
+    """Cohort rows with one feature set on a split's cut, or on the values either side of it"""
+    rng = np.random.default_rng(1)
+    thresholds = forest.threshold32 if dtype == np.float32 else forest.threshold
+    splits = np.flatnonzero(forest.left != np.arange(len(forest.left)))
+    rows = []
+    for split in rng.choice(splits, size=min(len(splits), 300), replace=False):
+        cut = dtype(thresholds[split])
+        for value in (np.nextafter(cut, dtype(-np.inf)), cut, np.nextafter(cut, dtype(np.inf))):
+            row = X[rng.integers(len(X))].astype(dtype)
+            row[forest.feature[split]] = value
+            rows.append(row)
+    return np.vstack(rows).astype(dtype)
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_folded_regressor_matches_scaled_predict(cohort, fitted, dtype):
+    X, _ = cohort
+    scaler, regressor, _ = fitted
+    forest = CompiledForest.try_compile({'target': regressor}, scaler)
+    assert forest.scaler_folded
+
+    rows = np.vstack([X.astype(dtype), split_rows(forest, X, dtype)])
+    expected = regressor.predict(scaler.transform(rows))
+    np.testing.assert_array_equal(forest.predict(rows)[:, 0], expected)
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_folded_classifier_matches_scaled_predict_proba(cohort, fitted, dtype):
+    X, _ = cohort
+    scaler, _, classifier = fitted
+    forest = CompiledForest.try_compile({'target': classifier}, scaler)
+
+    rows = np.vstack([X.astype(dtype), split_rows(forest, X, dtype)])
+    scaled = scaler.transform(rows)
+    log_odds = forest.predict(rows)[:, 0]
+    np.testing.assert_array_equal(log_odds, classifier.decision_function(scaled))
+    np.testing.assert_array_equal(expit(log_odds), classifier.predict_proba(scaled)[:, 1])
+
+
+def test_folding_moves_rows_on_a_cut_like_the_scaled_split(cohort, fitted):
+    """A value exactly on a folded cut goes left and the next one up goes right, as after scaling"""
+    X, _ = cohort
+    scaler, regressor, _ = fitted
+    forest = CompiledForest.try_compile({'target': regressor}, scaler)
+    splits = np.flatnonzero(forest.left != np.arange(len(forest.left)))
+    features = forest.feature[splits]
+    # What sklearn compares: float32 inputs against the float64 thresholds it was fitted with
+    fitted_thresholds = np.concatenate([tree.tree_.threshold for tree in regressor.estimators_])[splits]
+
+    for dtype, thresholds in ((np.float64, forest.threshold), (np.float32, forest.threshold32)):
+        cuts = thresholds[splits].astype(dtype)
+        for values, goes_left in ((cuts, True), (np.nextafter(cuts, dtype(np.inf)), False)):
+            rows = np.tile(X.mean(axis=0).astype(dtype), (len(splits), 1))
+            rows[np.arange(len(splits)), features] = values
+            scaled = scaler.transform(rows).astype(np.float32)[np.arange(len(splits)), features]
+            assert np.all((scaled <= fitted_thresholds) == goes_left)
@@ -16,6 +16,8 @@ from app.models.healthcare_models import (
     BiomarkerPredictionModel, 
     HealthRiskAssessmentModel
 )
+from app.models.percentiles import PercentileIndex
+from app.models.schema import BIOMARKERS, NUTRIENTS
 
 logger = logging.getLogger(__name__)
 
@@ -47,13 +49,13 @@ class HealthcareDataTrainer:
             activity_level = np.random.choice(['sedentary', 'light', 'moderate', 'active', 'very_active'])
             
             # Health goals
-            health_goals = np.random.choice([
+            health_goals = self._choose([
                 ['weight_loss'], ['muscle_gain'], ['general_health'], 
                 ['diabetes_management'], ['heart_health'], ['energy']
             ])
             
             # Medical history
-            medical_history = np.random.choice([
+            medical_history = self._choose([
                 [], ['diabetes'], ['hypertension'], ['heart_disease'], 
                 ['diabetes', 'hypertension'], ['obesity']
             ])
@@ -87,7 +89,7 @@ class HealthcareDataTrainer:
             )
             
             # Family history
-            family_history = np.random.choice([
+            family_history = self._choose([
                 [], ['diabetes'], ['heart_disease'], ['cancer'], 
                 ['diabetes', 'heart_disease']
             ])
@@ -125,6 +127,11 @@ class HealthcareDataTrainer:
         
         return pd.DataFrame(data)
     
+    @staticmethod
+    def _choose(options: List[List[str]]) -> List[str]:
+        """Pick one list of options (np.random.choice rejects ragged lists)"""
+        return list(options[np.random.randint(len(options))])
+    
     def _calculate_synthetic_molecular_score(self, protein, carbs, fat, fiber, 
                                            vitamin_c, vitamin_d, calcium, iron,
                                            glucose, cholesterol, bp_systolic, 
@@ -189,25 +196,20 @@ class HealthcareDataTrainer:
         return max(0, min(100, score))
     
     def prepare_training_data(self, df: pd.DataFrame) -> Tuple[np.ndarray, Dict]:
-        """Prepare training data for different models"""
+        """Prepare training data for different models
+        
+        Each model's feature pipeline encodes the frame, so the matrices have
+        the layout the service builds for single requests.
+        """
         
-        # Features for nutrition analysis
-        nutrition_features = df[[
-            'age', 'sex', 'weight', 'height', 'activity_level',
-            'protein', 'carbs', 'fat', 'fiber', 'vitamin_c', 
-            'vitamin_d', 'calcium', 'iron'
-        ]].copy()
+        # Features for nutrition analysis (encoded profile fields, nutrients and ratios)
+        nutrition_features = self.nutrition_model.prepare_features(df)
         
         # Target for nutrition model
         nutrition_target = df['molecular_score'].values
         
-        # Features for biomarker prediction
-        biomarker_features = df[[
-            'age', 'weight', 'height', 'sex', 'protein', 'carbs', 'fat', 
-            'fiber', 'sodium', 'sugar', 'glucose', 'cholesterol',
-            'blood_pressure_systolic', 'blood_pressure_diastolic',
-            'hba1c', 'triglycerides', 'hdl', 'ldl'
-        ]].copy()
+        # Features for biomarker prediction (BIOMARKER_FEATURES)
+        biomarker_features = self.biomarker_model.feature_pipeline.transform(df)
         
         # Targets for biomarker models (future values)
         biomarker_targets = {
@@ -221,12 +223,8 @@ class HealthcareDataTrainer:
             'ldl': df['ldl'].values * (1 + np.random.normal(0, 0.1, len(df)))
         }
         
-        # Features for health risk assessment
-        risk_features = df[[
-            'age', 'weight', 'height', 'sex', 'bmi', 'family_history',
-            'protein', 'carbs', 'fat', 'fiber', 'sodium',
-            'glucose', 'cholesterol', 'blood_pressure_systolic', 'blood_pressure_diastolic'
-        ]].copy()
+        # Features for health risk assessment (RISK_FEATURES; the day's values stand in for averages)
+        risk_features = self.risk_model.feature_pipeline.transform(df)
         
         # Targets for risk models (binary classification)
         risk_targets = {
@@ -237,7 +235,7 @@ class HealthcareDataTrainer:
             'metabolic_syndrome': ((df['glucose'] > 100) & (df['cholesterol'] > 200) & (df['bmi'] > 25)).astype(int).values
         }
         
-        return (nutrition_features.values, nutrition_target), (biomarker_features.values, biomarker_targets), (risk_features.values, risk_targets)
+        return (nutrition_features, nutrition_target), (biomarker_features, biomarker_targets), (risk_features, risk_targets)
     
     def train_all_models(self, n_samples: int = 10000):
         """Train all healthcare models"""
@@ -265,6 +263,11 @@ class HealthcareDataTrainer:
         self.risk_model.train(risk_X, risk_y)
         self.risk_model.save_model("models/health_risk_model.pkl")
         
+        # Population percentiles of the cohort's intakes and biomarkers, served next to the models
+        logger.info("Building population percentile index...")
+        PercentileIndex.from_cohort(df, {'nutrients': NUTRIENTS, 'biomarkers': BIOMARKERS}).save(
+            "models/population_percentiles.npz")
+        
         logger.info("All models trained successfully!")
         
         # Print model performance
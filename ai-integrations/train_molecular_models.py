@@ -8,7 +8,7 @@ from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_squared_error, accuracy_score
 import joblib
 import os
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 import logging
 
 from app.models.healthcare_models import (
@@ -16,6 +16,8 @@ from app.models.healthcare_models import (
     BiomarkerPredictionModel, 
     HealthRiskAssessmentModel
 )
+from app.models.feature_pipeline import FeaturePipeline, NumericColumns, OneHot, Ordinal, SEX_VALUES
+from app.models.percentiles import PercentileIndex
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +28,8 @@ class MolecularHealthTrainer:
         self.nutrition_model = NutritionAnalysisModel()
         self.biomarker_model = BiomarkerPredictionModel()
         self.risk_model = HealthRiskAssessmentModel()
+        # Fitted on the training data by prepare_molecular_training_data
+        self.feature_pipeline: Optional[FeaturePipeline] = None
         
         # Molecular health specific parameters
         self.molecular_nutrients = {
@@ -46,6 +50,13 @@ class MolecularHealthTrainer:
             'nutrient_status': ['vitamin_d', 'b12', 'folate', 'ferritin', 'zinc', 'magnesium']
         }
         
+        # Ordered levels of the molecular health factors, encoded as ordinals
+        self.molecular_factor_levels = {
+            'genetic_variants': ('wild_type', 'heterozygous', 'homozygous'),
+            'metabolic_type': ('slow', 'normal', 'fast'),
+            'inflammatory_tendency': ('low', 'moderate', 'high')
+        }
+        
         self.molecular_health_conditions = {
             'metabolic_syndrome': ['insulin_resistance', 'inflammation', 'oxidative_stress'],
             'cardiovascular_disease': ['endothelial_dysfunction', 'inflammation', 'lipid_disorders'],
@@ -496,32 +507,52 @@ class MolecularHealthTrainer:
         
         return conditions
     
+    def build_feature_pipeline(self, df: pd.DataFrame) -> FeaturePipeline:
+        """Feature pipeline of the molecular models, fitted on the training frame
+        
+        Sex is one-hot encoded and the molecular health factors are ordinal;
+        numeric fields missing at prediction time take their training medians.
+        """
+        # Molecular nutrition, then biomarker features - only those in the dataframe, each once
+        numeric = []
+        for category in ['amino_acids', 'fatty_acids', 'vitamins', 'minerals', 'antioxidants', 'phytonutrients']:
+            numeric += [nutrient for nutrient in self.molecular_nutrients[category] if nutrient in df.columns]
+        for category in ['inflammatory_markers', 'oxidative_stress', 'metabolic_markers', 'cardiovascular', 'hormonal', 'nutrient_status']:
+            numeric += [biomarker for biomarker in self.molecular_biomarkers[category] if biomarker in df.columns]
+        
+        return FeaturePipeline([
+            NumericColumns(('age', 'weight', 'height', 'bmi')),
+            OneHot('sex', SEX_VALUES),
+            *[Ordinal(factor, levels) for factor, levels in self.molecular_factor_levels.items()],
+            NumericColumns(dict.fromkeys(numeric))
+        ]).fit(df)
+    
+    def build_percentile_index(self, df: pd.DataFrame) -> PercentileIndex:
+        """Percentile index of the molecular intakes and biomarkers in the cohort
+        
+        Names are grouped as generated (e.g. vitamin_d is a blood level
+        here, not an intake); columns the cohort lacks are left out.
+        """
+        return PercentileIndex.from_cohort(df, {
+            'nutrients': [name for names in self.molecular_nutrients.values() for name in names
+                          if not any(name in markers for markers in self.molecular_biomarkers.values())],
+            'biomarkers': [name for names in self.molecular_biomarkers.values() for name in names]
+        })
+    
     def prepare_molecular_training_data(self, df: pd.DataFrame) -> Tuple[np.ndarray, Dict]:
         """Prepare molecular health training data"""
         
-        # Features for molecular nutrition analysis
-        molecular_features = []
-        
-        # Demographics
-        molecular_features.extend(['age', 'sex', 'weight', 'height', 'bmi'])
-        
-        # Molecular nutrition features - only add if they exist in the dataframe
-        for category in ['amino_acids', 'fatty_acids', 'vitamins', 'minerals', 'antioxidants', 'phytonutrients']:
-            for nutrient in self.molecular_nutrients[category]:
-                if nutrient in df.columns:
-                    molecular_features.append(nutrient)
-        
-        # Molecular biomarker features - only add if they exist in the dataframe
-        for category in ['inflammatory_markers', 'oxidative_stress', 'metabolic_markers', 'cardiovascular', 'hormonal', 'nutrient_status']:
-            for biomarker in self.molecular_biomarkers[category]:
-                if biomarker in df.columns:
-                    molecular_features.append(biomarker)
+        # Features for molecular nutrition analysis, shared by all three models
+        self.feature_pipeline = self.build_feature_pipeline(df)
+        molecular_features = self.feature_pipeline.transform(df)
+        for model in (self.nutrition_model, self.biomarker_model, self.risk_model):
+            model.feature_pipeline = self.feature_pipeline
         
         # Target for molecular nutrition model
         molecular_target = df['molecular_score'].values
         
         # Features for molecular biomarker prediction
-        biomarker_features = molecular_features.copy()
+        biomarker_features = molecular_features
         
         # Targets for molecular biomarker models
         biomarker_targets = {}
@@ -534,7 +565,7 @@ class MolecularHealthTrainer:
                     biomarker_targets[marker] = future_values
         
         # Features for molecular health risk assessment
-        risk_features = molecular_features.copy()
+        risk_features = molecular_features
         
         # Targets for molecular risk models
         risk_targets = {}
@@ -549,7 +580,7 @@ class MolecularHealthTrainer:
         if 'inflammation' in df.columns:
             risk_targets['inflammation'] = df['inflammation'].values
         
-        return (df[molecular_features].values, molecular_target), (df[biomarker_features].values, biomarker_targets), (df[risk_features].values, risk_targets)
+        return (molecular_features, molecular_target), (biomarker_features, biomarker_targets), (risk_features, risk_targets)
     
     def train_molecular_models(self, n_samples: int = 15000):
         """Train molecular health-specific models"""
@@ -577,6 +608,10 @@ class MolecularHealthTrainer:
         self.risk_model.train(risk_X, risk_y)
         self.risk_model.save_model("models/molecular_health_risk_model.pkl")
         
+        # Population percentiles of the cohort's intakes and biomarkers, saved next to the models
+        logger.info("Building molecular population percentile index...")
+        self.build_percentile_index(df).save("models/molecular_population_percentiles.npz")
+        
         logger.info("All molecular health models trained successfully!")
         
         # Print model performance